@@ -0,0 +1,118 @@
+"""Compare the fast HTML text extractor with BeautifulSoup.
+
+Usage:
+    python -m benchmarks.html_text [path/to/corpus] [--repeat N]
+
+The corpus is a folder of saved HTML emails (*.html, *.htm). Without
+a folder, a generated corpus of newsletter-like documents is used: nested
+layout tables, inline styles, style and script blocks, tracking pixels
+and character references.
+"""
+import argparse
+import glob
+import os
+import random
+import time
+import tracemalloc
+
+from email_app.read import get_html_text
+
+
+ROW = (
+    '<tr><td class="content" style="padding:12px 24px;font-family:Arial,'
+    'sans-serif;font-size:14px;line-height:20px;color:#333333;">'
+    '<table role="presentation" width="100%" cellpadding="0" cellspacing="0">'
+    '<tr><td><a href="https://example.com/item/{n}?utm_source=newsletter" '
+    'style="color:#0066cc;text-decoration:none;"><img src="https://example.com'
+    '/img/{n}.png" width="120" alt="Item {n}"></a></td>'
+    '<td style="padding-left:16px;"><h3 style="margin:0;">Product {n} '
+    '&mdash; only&nbsp;today</h3><p style="margin:8px 0;">{text}</p>'
+    '<p><a href="https://example.com/buy/{n}" class="button">Buy now '
+    '&raquo;</a></p></td></tr></table></td></tr>\n'
+)
+WORDS = (
+    'discount offer price free delivery new collection limited season sale '
+    'exclusive members only quality best choice order gift card'
+).split()
+
+
+def generate_document(rows: int, seed: int) -> str:
+    rnd = random.Random(seed)
+    style = ''.join(
+        f'.c{i} {{margin:{i}px;padding:{i}px;color:#{i:06x};}}\n'
+        for i in range(200)
+    )
+    body = ''.join(
+        ROW.format(n=n, text=' '.join(rnd.choices(WORDS, k=40)))
+        for n in range(rows)
+    )
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        f'<title>Newsletter {seed}</title><style>{style}</style>'
+        '<script>window.dataLayer=[{"event":"open"}];</script></head>'
+        '<body style="margin:0;background:#f4f4f4;">'
+        '<table role="presentation" width="600" align="center">'
+        f'{body}</table>'
+        '<img src="https://example.com/pixel.gif" width="1" height="1">'
+        '<p style="font-size:11px;">Unsubscribe &copy; Example Inc.</p>'
+        '</body></html>'
+    )
+
+
+def load_corpus(path: str = None) -> list[str]:
+    if path is None:
+        return [
+            generate_document(rows, seed)
+            for seed, rows in enumerate([10, 25, 50, 100, 200] * 4)
+        ]
+    documents = []
+    for pattern in ('*.html', '*.htm'):
+        for filepath in sorted(glob.glob(os.path.join(path, pattern))):
+            with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
+                documents.append(f.read())
+    return documents
+
+
+def measure(documents: list[str], engine: str, repeat: int) -> dict:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for document in documents:
+            get_html_text(document, engine=engine)
+    elapsed = time.perf_counter() - start
+    # Memory is measured separately, tracing slows parsing down
+    peak = 0
+    for document in documents:
+        tracemalloc.start()
+        get_html_text(document, engine=engine)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {
+        'ms': elapsed * 1000 / (repeat * len(documents)),
+        'peak': peak / 2 ** 20
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('corpus', nargs='?', help='folder of HTML files')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    documents = load_corpus(args.corpus)
+    if not documents:
+        parser.error('no HTML files in the corpus folder')
+    size = sum(len(document) for document in documents) / len(documents)
+    print(f'{len(documents)} documents, {size / 1024:.1f} KB on average')
+    results = {
+        engine: measure(documents, engine, args.repeat)
+        for engine in ('fast', 'bs4')
+    }
+    for engine, result in results.items():
+        print(
+            f'{engine:>5}: {result["ms"]:8.2f} ms/document, '
+            f'peak {result["peak"]:6.2f} MB'
+        )
+    print(f'speedup: {results["bs4"]["ms"] / results["fast"]["ms"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Measure import time of email_app with python -X importtime.
+
+Usage:
+    python -m benchmarks.importtime [--repeat N] [--max-ms MS] [--json]
+
+Each scenario is imported in a new interpreter: the bare package, the
+sending entry point and the reading entry point. For each scenario the
+benchmark reports the cumulative import time of the statement (the best of
+repeat runs, microseconds of -X importtime summed over the top level
+modules) and the slowest imported modules.
+
+The exit code is 1 if a scenario imports a heavy dependency it does not
+need (for example jinja2 or bs4 when only plain text is sent) or, with
+--max-ms, if the bare package import is slower than the limit.
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+
+
+# Statement, modules which must not be imported by it
+SCENARIOS = {
+    'package': (
+        'import email_app',
+        ('smtplib', 'imaplib', 'pydantic', 'jinja2', 'bs4', 'email.mime')
+    ),
+    'send': (
+        'from email_app import send_email',
+        ('imaplib', 'jinja2', 'bs4', 'email_app.read')
+    ),
+    'read': (
+        'from email_app import read_email',
+        ('smtplib', 'jinja2', 'bs4', 'email_app.send')
+    ),
+}
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def measure(statement: str) -> dict:
+    """Import in a new interpreter.
+
+    return    dict {'us': cumulative microseconds of the top level modules,
+              'modules': {module: cumulative microseconds}}.
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        capture_output=True, text=True, check=True
+    )
+    total = 0
+    modules = {}
+    for line in process.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        cumulative = int(match.group(2))
+        modules[match.group(4)] = cumulative
+        # Top level modules are not indented, nested ones are included
+        # in their cumulative time
+        if len(match.group(3)) == 1:
+            total += cumulative
+    return {'us': total, 'modules': modules}
+
+
+def check(modules: dict, forbidden: tuple) -> list[str]:
+    """Get forbidden modules which were imported (themselves or their
+    submodules).
+    """
+    return [
+        name for name in forbidden
+        if any(
+            module == name or module.startswith(name + '.')
+            for module in modules
+        )
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='the best of n runs is taken. Default: 5')
+    parser.add_argument('--max-ms', type=float,
+                        help='limit of the bare package import time, ms')
+    parser.add_argument('--top', type=int, default=5,
+                        help='number of the slowest modules to print')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args()
+
+    results = {}
+    failures = []
+    for name, (statement, forbidden) in SCENARIOS.items():
+        runs = [measure(statement) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run['us'])
+        imported = check(best['modules'], forbidden)
+        if imported:
+            failures.append(f'{name}: imports {", ".join(imported)}')
+        results[name] = {
+            'statement': statement,
+            'ms': best['us'] / 1000,
+            'modules': len(best['modules']),
+            'slowest': dict(sorted(
+                best['modules'].items(), key=lambda item: -item[1]
+            )[:args.top])
+        }
+    if args.max_ms and results['package']['ms'] > args.max_ms:
+        failures.append(
+            f'package: {results["package"]["ms"]:.1f} ms '
+            f'(limit {args.max_ms:.1f} ms)'
+        )
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        for name, result in results.items():
+            print(
+                f'{name}: {result["statement"]}: {result["ms"]:.1f} ms, '
+                f'{result["modules"]} modules'
+            )
+            for module, us in result['slowest'].items():
+                print(f'  {module:>30}: {us / 1000:7.1f} ms')
+    for failure in failures:
+        print(f'regression: {failure}')
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
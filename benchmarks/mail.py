@@ -0,0 +1,407 @@
+"""Measure sending and reading throughput against local SMTP and IMAP
+stand-ins, without network access.
+
+Usage:
+    python -m benchmarks.mail [--messages N] [--sends N] [--latency S]
+                              [--sizes SIZE:WEIGHT,...] [--html-ratio R]
+                              [--attachment-ratio R] [--attachment-size B]
+                              [--baseline PATH] [--save-baseline]
+                              [--repeat N] [--tolerance T] [--json]
+
+The IMAP server holds a generated mailbox: text sizes are drawn from the
+size mix, a part of the emails are HTML and a part have a binary
+attachment. send_email sends messages with texts and attachments of the
+same mix to the SMTP sink. Each side runs in a new interpreter, so its
+peak RSS does not include the memory of the other one. For each side the
+benchmark reports messages per second (the best of repeat runs), bytes
+sent and received by the server (application data, without TLS
+overhead), peak RSS of the process (servers run in the same process) and
+timings of the stages: connect (TCP and TLS), login, select, search,
+fetch, parse for reading; connect, login, build, data for sending.
+
+Messages per second depend on the machine, so they are also divided by
+the speed of a reference workload measured in the same run: parsing of
+the generated mailbox with the email package of the standard library.
+Results are compared with the baseline file saved with the same
+parameters: the relative throughput must not drop and bytes and RSS must
+not grow by more than the tolerance, otherwise the exit code is 1.
+Absolute messages per second and stage timings are printed for
+information only.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import email
+import imaplib
+import json
+import multiprocessing
+import os
+import random
+import smtplib
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from email_app.read import fetch_raw, parse_emails, read_email
+from email_app.send import build_message, send_email
+from email_app.types import SendEmailParams
+from tests.servers import LocalIMAPServer, LocalSMTPServer, make_email
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+WORDS = (
+    'invoice report order delivery meeting schedule payment account update '
+    'project quarter review budget contract team office request reminder'
+).split()
+# Metrics compared with the baseline: True if a bigger value is better
+CHECKS = {
+    'relative_throughput': True,
+    'bytes_received': False,
+    'bytes_sent': False,
+    'peak_rss_mb': False,
+}
+
+
+def parse_sizes(value: str) -> list[tuple[int, int]]:
+    """Parse size mix like '2048:6,32768:3,262144:1'."""
+    sizes = []
+    for item in value.split(','):
+        size, _, weight = item.partition(':')
+        sizes.append((int(size), int(weight or 1)))
+    return sizes
+
+
+def generate_text(rnd: random.Random, size: int) -> str:
+    lines = []
+    length = 0
+    while length < size:
+        line = ' '.join(rnd.choices(WORDS, k=12))
+        lines.append(line)
+        length += len(line) + 1
+    return '\n'.join(lines)
+
+
+def generate_html(text: str) -> str:
+    rows = ''.join(
+        f'<tr><td style="padding:8px;font-family:Arial;">{line}</td></tr>'
+        for line in text.splitlines()
+    )
+    return (
+        '<html><head><style>td {color:#333333;}</style></head><body>'
+        f'<table width="600">{rows}</table></body></html>'
+    )
+
+
+def generate_messages(args: argparse.Namespace, count: int, seed: int):
+    """Generate parameters of messages: subject, text, html and
+    attachment payload.
+    """
+    rnd = random.Random(seed)
+    sizes, weights = zip(*args.sizes)
+    messages = []
+    for n in range(count):
+        text = generate_text(rnd, rnd.choices(sizes, weights)[0])
+        html = generate_html(text) if rnd.random() < args.html_ratio else None
+        attachment = None
+        if rnd.random() < args.attachment_ratio:
+            attachment = rnd.randbytes(args.attachment_size)
+        messages.append({
+            'subject': f'Message {n}',
+            'text': text,
+            'html': html,
+            'attachment': attachment
+        })
+    return messages
+
+
+def generate_mailbox(args: argparse.Namespace) -> list[bytes]:
+    """Generate raw emails of the IMAP mailbox."""
+    return [
+        make_email(
+            subject=message['subject'],
+            text=message['text'],
+            html=message['html'],
+            attachments=(
+                {'data.bin': message['attachment']}
+                if message['attachment'] else None
+            )
+        )
+        for message in generate_messages(args, args.messages, args.seed)
+    ]
+
+
+def peak_rss() -> float:
+    """Peak resident set size of the process, MB."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+
+
+def reset(server):
+    server.bytes_received = server.bytes_sent = 0
+
+
+def isolated(function, args: argparse.Namespace) -> dict:
+    """Run a benchmark in a new interpreter."""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(function, args).result()
+
+
+def bench_reference(args: argparse.Namespace) -> dict:
+    """Parse the generated mailbox with the email package and decode all
+    parts. The code of email_app is not used, so the result shows only
+    the speed of the machine.
+    """
+    messages = generate_mailbox(args)
+    elapsed = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for data in messages:
+            for part in email.message_from_bytes(data).walk():
+                part.get_payload(decode=True)
+        elapsed.append(time.perf_counter() - start)
+    return {'messages_per_second': len(messages) / min(elapsed)}
+
+
+def bench_read(args: argparse.Namespace) -> dict:
+    messages = generate_mailbox(args)
+    stages = dict.fromkeys(
+        ('connect', 'login', 'select', 'search', 'fetch', 'parse'), 0.0
+    )
+    with LocalIMAPServer(messages, latency=args.latency) as server:
+        elapsed = []
+        for _ in range(args.repeat):
+            reset(server)
+            start = time.perf_counter()
+            mails = read_email(
+                email='reader@local.test',
+                password='password',
+                criteria='ALL',
+                batch_size=args.batch_size,
+                host=server.host,
+                port=server.port
+            )
+            elapsed.append(time.perf_counter() - start)
+        elapsed = min(elapsed)
+        result = {
+            'messages': len(mails),
+            'messages_per_second': len(mails) / elapsed,
+            'bytes_received': server.bytes_received,
+            'bytes_sent': server.bytes_sent,
+        }
+        # The same reading step by step
+        reset(server)
+        clock = time.perf_counter()
+
+        def lap(stage):
+            nonlocal clock
+            now = time.perf_counter()
+            stages[stage] += now - clock
+            clock = now
+
+        client = imaplib.IMAP4_SSL(server.host, server.port)
+        lap('connect')
+        client.login('reader@local.test', 'password')
+        lap('login')
+        client.select('INBOX')
+        lap('select')
+        status, data = client.uid('search', None, 'ALL')
+        uids = data[0].split()
+        lap('search')
+        for start in range(0, len(uids), args.batch_size):
+            raw = fetch_raw(client, uids[start:start + args.batch_size])
+            lap('fetch')
+            parse_emails(raw)
+            lap('parse')
+        client.logout()
+    result['peak_rss_mb'] = peak_rss()
+    result['stages_ms'] = {
+        stage: seconds * 1000 for stage, seconds in stages.items()
+    }
+    return result
+
+
+def bench_send(args: argparse.Namespace) -> dict:
+    messages = generate_messages(args, args.sends, args.seed + 1)
+    stages = dict.fromkeys(('connect', 'login', 'build', 'data'), 0.0)
+    with tempfile.TemporaryDirectory() as folder:
+        for n, message in enumerate(messages):
+            if message['attachment']:
+                path = os.path.join(folder, f'data{n}.bin')
+                with open(path, 'wb') as f:
+                    f.write(message['attachment'])
+                message['attachment'] = path
+        kwargs = [
+            {
+                'email': 'sender@local.test',
+                'password': 'password',
+                'recievers': ['reciever@local.test'],
+                'subject': message['subject'],
+                'message_text': message['text'],
+                'attachments': (
+                    [message['attachment']] if message['attachment'] else []
+                )
+            }
+            for message in messages
+        ]
+        with LocalSMTPServer(latency=args.latency) as server:
+            elapsed = []
+            for _ in range(args.repeat):
+                reset(server)
+                start = time.perf_counter()
+                for message in kwargs:
+                    send_email(host=server.host, port=server.port, **message)
+                elapsed.append(time.perf_counter() - start)
+            elapsed = min(elapsed)
+            result = {
+                'messages': len(kwargs),
+                'messages_per_second': len(kwargs) / elapsed,
+                'bytes_received': server.bytes_received,
+                'bytes_sent': server.bytes_sent,
+            }
+            # The same sending step by step
+            reset(server)
+            for message in kwargs:
+                start = time.perf_counter()
+                client = smtplib.SMTP_SSL(server.host, server.port)
+                connected = time.perf_counter()
+                client.login(message['email'], message['password'])
+                logged_in = time.perf_counter()
+                data = build_message(SendEmailParams(**message))
+                built = time.perf_counter()
+                client.send_message(data)
+                sent = time.perf_counter()
+                client.quit()
+                stages['connect'] += connected - start
+                stages['login'] += logged_in - connected
+                stages['build'] += built - logged_in
+                stages['data'] += sent - built
+    result['peak_rss_mb'] = peak_rss()
+    result['stages_ms'] = {
+        stage: seconds * 1000 for stage, seconds in stages.items()
+    }
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Compare results with the baseline.
+
+    return    list of regressions.
+    """
+    regressions = []
+    for side, result in results.items():
+        for metric, bigger_is_better in CHECKS.items():
+            value = result.get(metric)
+            expected = baseline.get(side, {}).get(metric)
+            if value is None or not expected:
+                continue
+            change = (value - expected) / expected
+            if (-change if bigger_is_better else change) > tolerance:
+                regressions.append(
+                    f'{side} {metric}: {value:.1f} '
+                    f'(baseline {expected:.1f}, {change:+.0%})'
+                )
+    return regressions
+
+
+def report(results: dict, baseline: dict):
+    reference = results.pop('reference')
+    print(
+        f'reference: {reference["messages_per_second"]:.1f} messages/s'
+    )
+    for side, result in results.items():
+        print(
+            f'{side}: {result["messages"]} messages, '
+            f'{result["messages_per_second"]:.1f} messages/s '
+            f'({result["relative_throughput"]:.3f} of reference), '
+            f'received {result["bytes_received"] / 1024:.1f} KB, '
+            f'sent {result["bytes_sent"] / 1024:.1f} KB, '
+            f'peak RSS {result["peak_rss_mb"] or 0:.1f} MB'
+        )
+        expected = baseline.get(side, {}).get('stages_ms', {})
+        for stage, ms in result['stages_ms'].items():
+            line = f'  {stage:>8}: {ms:9.1f} ms'
+            if expected.get(stage):
+                line += f'  (baseline {expected[stage]:9.1f} ms)'
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200,
+                        help='number of emails in the mailbox')
+    parser.add_argument('--sends', type=int, default=50,
+                        help='number of sent messages')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='server reply delay, seconds')
+    parser.add_argument('--sizes', type=parse_sizes,
+                        default='2048:6,32768:3,262144:1',
+                        help='text size mix, bytes:weight')
+    parser.add_argument('--html-ratio', type=float, default=0.5)
+    parser.add_argument('--attachment-ratio', type=float, default=0.3)
+    parser.add_argument('--attachment-size', type=int, default=64 * 1024)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='the best of n runs is taken. Default: 3')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='allowed relative regression. Default: 0.3')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args()
+
+    config = {
+        key: value for key, value in vars(args).items()
+        if key not in (
+            'baseline', 'save_baseline', 'tolerance', 'json', 'repeat'
+        )
+    }
+    reference = isolated(bench_reference, args)
+    results = {
+        'read': isolated(bench_read, args),
+        'send': isolated(bench_send, args)
+    }
+    for result in results.values():
+        result['relative_throughput'] = (
+            result['messages_per_second'] / reference['messages_per_second']
+        )
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    if args.json:
+        print(json.dumps({'reference': reference} | results, indent=4))
+    else:
+        report({'reference': reference} | results, baseline)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(
+                {'config': config, 'reference': reference} | results,
+                f, indent=4
+            )
+            f.write('\n')
+        print(f'baseline saved to {args.baseline}')
+        return
+    # Sizes are saved as lists in JSON
+    if baseline and json.loads(json.dumps(config)) != baseline.get('config'):
+        print('the baseline was saved with other parameters, not compared')
+        return
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f'regression: {regression}')
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,67 @@
-from .send import send_email
-from .read import read_email
-from .utils import get_server
+from importlib import import_module
 
+# typing.TYPE_CHECKING without importing typing, type checkers treat
+# the name the same way
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from .send import send_email, send_emails, send_mail_merge, Mailer
+    from .pool import send_emails_pooled, MailerPool, IMAPPool
+    from .read import read_email, iter_emails
+    from .sync import sync_email, SyncState
+    from .idle import IdleListener
+    from .backfill import backfill_email
+    from .accounts import read_accounts, iter_accounts
+    from .store import AttachmentStore
+    from .cache import MessageCache
+    from .search import SearchIndex
+    from .aio import async_send_email, async_read_email
+    from .metrics import add_hook, remove_hook, Counters
+    from .utils import get_server
 
-__all__ = ('send_email', 'read_email', 'get_server')
+
+# Modules of the public names. A module is imported on the first access
+# to its name, so `import email_app` does not load smtplib, imaplib,
+# pydantic, jinja2 and bs4 until they are needed
+_MODULES = {
+    'send_email': 'send', 'send_emails': 'send', 'send_mail_merge': 'send',
+    'Mailer': 'send',
+    'send_emails_pooled': 'pool', 'MailerPool': 'pool', 'IMAPPool': 'pool',
+    'read_email': 'read', 'iter_emails': 'read',
+    'sync_email': 'sync', 'SyncState': 'sync',
+    'IdleListener': 'idle',
+    'backfill_email': 'backfill',
+    'read_accounts': 'accounts', 'iter_accounts': 'accounts',
+    'AttachmentStore': 'store',
+    'MessageCache': 'cache',
+    'SearchIndex': 'search',
+    'async_send_email': 'aio', 'async_read_email': 'aio',
+    'add_hook': 'metrics', 'remove_hook': 'metrics', 'Counters': 'metrics',
+    'get_server': 'utils'
+}
+
+__all__ = (
+    'send_email', 'send_emails', 'send_mail_merge', 'Mailer',
+    'send_emails_pooled',
+    'MailerPool', 'IMAPPool', 'read_email', 'iter_emails',
+    'async_send_email',
+    'async_read_email', 'sync_email', 'SyncState', 'IdleListener',
+    'backfill_email', 'read_accounts', 'iter_accounts', 'AttachmentStore',
+    'MessageCache', 'SearchIndex', 'add_hook', 'remove_hook', 'Counters',
+    'get_server'
+)
+
+
+def __getattr__(name: str):
+    module = _MODULES.get(name)
+    if module is None:
+        raise AttributeError(
+            f"module {__name__!r} has no attribute {name!r}"
+        )
+    value = getattr(import_module(f'.{module}', __name__), name)
+    # Later accesses do not call __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,278 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+import os
+from typing import Iterable, Iterator
+
+from .metrics import submit
+from .pool import IMAPPool
+from .read import fetch_batch, message_set, store_seen
+from .search import SearchIndex
+from .store import AttachmentStore
+from .types import ReadAccountParams
+from .utils import get_server
+
+
+class AccountReader:
+    """Reading state of one account and mailbox. Emails are read one batch
+    at a time, so accounts can take turns on the worker threads.
+
+    params    ReadAccountParams object.
+    """
+
+    def __init__(self, params: ReadAccountParams):
+        self.params = params
+        host, port = params.host, params.port
+        if host is None and port is None:
+            # Receiving the server host and port
+            host, port = get_server(domain=params.domain, server='imap')
+        self.host = host
+        self.port = port
+        # Accounts of one email service share its concurrency limit
+        self.provider = params.domain
+        self.uids = None
+        self.position = 0
+
+    @property
+    def done(self) -> bool:
+        return self.uids is not None and self.position >= len(self.uids)
+
+    def read_batch(
+        self,
+        pool: IMAPPool,
+        store: AttachmentStore = None,
+        index: SearchIndex = None,
+        close: bool = False
+    ) -> list[dict]:
+        """Read the next batch of emails with a session borrowed from pool.
+        Emails are searched with the first batch. Flags of all read emails
+        are changed with the last batch.
+
+        pool     IMAPPool object;
+        store    AttachmentStore object;
+        index    SearchIndex object;
+        close    log out of the session after the last batch instead of
+                 returning it to the pool;
+
+        return   list[dict].
+        """
+        params = self.params
+        server = pool.acquire(
+            params.email, params.password, self.host, self.port,
+            params.mailbox
+        )
+        try:
+            if self.uids is None:
+                status, data = server.uid('search', None, params.criteria)
+                self.uids = data[0].split()
+                if params.last:
+                    self.uids = self.uids[-params.last:]
+            batch = self.uids[self.position:self.position + params.batch_size]
+            # Nothing is found: an empty message set is answered with BAD,
+            # the reader is done and there are no flags to change
+            if not batch:
+                emails = []
+            else:
+                mailbox_index = None
+                if index is not None and server.uidvalidity is not None:
+                    mailbox_index = index.mailbox(
+                        params.email, params.mailbox, server.uidvalidity
+                    )
+                emails = fetch_batch(
+                    server=server,
+                    uids=batch,
+                    mode=params.mode,
+                    id_key=params.id_key,
+                    with_payload=params.with_payload,
+                    folder=params.folder,
+                    store=store,
+                    index=mailbox_index
+                )
+                self.position += len(batch)
+                if self.done:
+                    store_seen(server, message_set(self.uids), params.seen)
+        except BaseException:
+            pool.discard(server)
+            raise
+        if self.done and close:
+            pool.discard(server)
+        else:
+            pool.release(server)
+        return emails
+
+
+def generate_accounts(
+    readers: Iterable[AccountReader],
+    workers: int = 8,
+    limits: dict = None,
+    provider_limit: int = 4,
+    active: int = None,
+    pool: IMAPPool = None,
+    store: AttachmentStore = None,
+    index: SearchIndex = None
+) -> Iterator[dict]:
+    """Read batches of emails of many accounts on a bounded pool of worker
+    threads. Active accounts take turns: after a batch the account goes to
+    the end of the queue, so a big mailbox does not hold the workers. Not
+    more than limits[provider] (or provider_limit) batches of one email
+    service are read at once and not more than active accounts are read at
+    the same time. A new batch is started only when the consumer takes the
+    results, so at most workers batches are kept in memory. If pool is not
+    set, sessions of read accounts are logged out at once.
+
+    return    generator of dictionaries with account and mailbox keys.
+    """
+    logger = logging.getLogger(__name__)
+    limits = limits or {}
+    # With a limit of 0 the accounts of the service are never read
+    if any(limit < 1 for limit in [provider_limit, *limits.values()]):
+        raise ValueError('Limits of email services must be at least 1')
+    active = active or 2 * workers
+    pending = deque(readers)
+    ready = deque()
+    running = {}
+    busy = {}
+    executor = ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix='imap'
+    )
+    own_pool = pool is None
+    if own_pool:
+        pool = IMAPPool(max_idle=1)
+    try:
+        while pending or ready or running:
+            # Admit new accounts while there are free places
+            while pending and len(ready) + len(running) < active:
+                ready.append(pending.popleft())
+            # Start batches of the ready accounts in turn, skipping accounts
+            # of busy email services
+            for _ in range(len(ready)):
+                if len(running) >= workers:
+                    break
+                reader = ready.popleft()
+                limit = limits.get(reader.provider, provider_limit)
+                if busy.get(reader.provider, 0) >= limit:
+                    ready.append(reader)
+                    continue
+                busy[reader.provider] = busy.get(reader.provider, 0) + 1
+                future = submit(
+                    executor, reader.read_batch, pool, store, index, own_pool
+                )
+                running[future] = reader
+            if not running:
+                # wait would return at once, the loop would never end
+                raise RuntimeError('No batch of the accounts can be started')
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                reader = running.pop(future)
+                busy[reader.provider] -= 1
+                params = reader.params
+                tags = {'account': params.email, 'mailbox': params.mailbox}
+                try:
+                    emails = future.result()
+                except Exception as exp:
+                    logger.error(
+                        "Emails of '%s' are not read: %s",
+                        params.email, exp
+                    )
+                    yield tags | {'error': str(exp)}
+                    continue
+                for msg in emails:
+                    yield tags | msg
+                if not reader.done:
+                    ready.append(reader)
+                else:
+                    logger.info(
+                        "%s emails of '%s' in '%s' are read",
+                        len(reader.uids), params.email, params.mailbox
+                    )
+    finally:
+        executor.shutdown(cancel_futures=True)
+        if own_pool:
+            pool.close()
+
+
+def iter_accounts(
+    accounts: Iterable[dict],
+    workers: int = 8,
+    limits: dict = None,
+    provider_limit: int = 4,
+    active: int = None,
+    pool: IMAPPool = None,
+    store: AttachmentStore = None,
+    index: SearchIndex = None
+) -> Iterator[dict]:
+    """Read emails of many accounts concurrently. Emails are yielded as
+    soon as their batch is read, tagged with account and mailbox keys;
+    emails of one account are yielded in UID order.
+
+    accounts          iterable of dictionaries with read_email parameters:
+                      email, password, domain, mailbox, criteria, last,
+                      id_key, seen, with_payload, folder, host, port,
+                      batch_size, mode;
+    workers           number of worker threads. Default: 8;
+    limits            dictionary with the maximum number of batches of an
+                      email service (domain) read at once, at least 1.
+                      Example: {'gmail': 8, 'yandex': 2};
+    provider_limit    limit of the services missing in limits, at least 1.
+                      Default: 4;
+    active            number of accounts read at the same time, each of
+                      them keeps one IMAP session. Default: 2 * workers;
+    pool              IMAPPool object. Default: a new pool which is closed
+                      at the end;
+    store             AttachmentStore object which keeps saved files
+                      without duplicates;
+    index             SearchIndex object which is fed with read emails.
+
+    return            generator of dictionaries. If an account can not be
+                      read, a dictionary with account, mailbox and error
+                      keys is yielded.
+    """
+    logger = logging.getLogger(__name__)
+    readers = []
+    for account in accounts:
+        # Create folder, if not exist
+        folder = account.get('folder')
+        if folder and not os.path.exists(folder):
+            os.mkdir(folder)
+            logger.debug("Created a folder '%s'", folder)
+        # Check parameters
+        readers.append(AccountReader(ReadAccountParams(**account)))
+    yield from generate_accounts(
+        readers=readers,
+        workers=workers,
+        limits=limits,
+        provider_limit=provider_limit,
+        active=active,
+        pool=pool,
+        store=store,
+        index=index
+    )
+
+
+def read_accounts(
+    accounts: Iterable[dict],
+    workers: int = 8,
+    limits: dict = None,
+    provider_limit: int = 4,
+    active: int = None,
+    pool: IMAPPool = None,
+    store: AttachmentStore = None,
+    index: SearchIndex = None
+) -> list[dict]:
+    """Read emails of many accounts concurrently. Parameters are the same
+    as in iter_accounts function.
+
+    return    list[dict].
+    """
+    return list(
+        iter_accounts(
+            accounts=accounts,
+            workers=workers,
+            limits=limits,
+            provider_limit=provider_limit,
+            active=active,
+            pool=pool,
+            store=store,
+            index=index
+        )
+    )
@@ -0,0 +1,481 @@
+import asyncio
+import base64
+import contextvars
+import functools
+import imaplib
+import logging
+import os
+from pathlib import Path
+import re
+import smtplib
+import ssl
+
+from .metrics import report, timer
+from .read import fetch_batch, message_set
+from .send import build_message, message_bytes
+from .store import AttachmentStore
+from .types import ReadEmailParams, SendEmailParams
+from .utils import get_server
+
+
+CRLF = b'\r\n'
+LITERAL = re.compile(rb'\{(\d+)\}$')
+UNTAGGED_STATUS = re.compile(rb'\* (\d+) ([A-Z-]+)( (.*))?$')
+UNTAGGED_RESPONSE = re.compile(rb'\* ([A-Z-]+)( (.*))?$')
+
+
+class AsyncSMTP:
+    """SMTP client working over asyncio streams with implicit TLS.
+
+    host       SMTP-server host;
+    port       SMTP-server port;
+    context    ssl.SSLContext object. Default: ssl.create_default_context().
+    """
+
+    def __init__(self, host: str, port: int, context: ssl.SSLContext = None):
+        self.host = host
+        self.port = port
+        self.context = context or ssl.create_default_context()
+        self.reader = None
+        self.writer = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.quit()
+
+    async def connect(self):
+        """Open a connection and read the server greeting."""
+        started = timer()
+        self.reader, self.writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.context
+        )
+        # TLS handshake is a part of opening the connection
+        report('smtp.connect', started)
+        code, text = await self.getreply()
+        if code != 220:
+            await self.close()
+            raise smtplib.SMTPConnectError(code, text)
+        code, text = await self.command(b'EHLO ' + self.local_name())
+        if code != 250:
+            raise smtplib.SMTPHeloError(code, text)
+
+    def local_name(self) -> bytes:
+        sockname = self.writer.get_extra_info('sockname')
+        return f'[{sockname[0]}]'.encode()
+
+    async def getreply(self):
+        """Read a multiline server reply.
+
+        return    tuple with code and text.
+        """
+        lines = []
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise smtplib.SMTPServerDisconnected(
+                    'Connection unexpectedly closed'
+                )
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                break
+        try:
+            code = int(line[:3])
+        except ValueError:
+            code = -1
+        return code, b'\n'.join(lines)
+
+    async def command(self, line: bytes):
+        """Send a command and read the reply.
+
+        return    tuple with code and text.
+        """
+        self.writer.write(line + CRLF)
+        await self.writer.drain()
+        return await self.getreply()
+
+    async def login(self, user: str, password: str):
+        """Log in with AUTH PLAIN."""
+        credentials = base64.b64encode(
+            f'\0{user}\0{password}'.encode()
+        )
+        started = timer()
+        code, text = await self.command(b'AUTH PLAIN ' + credentials)
+        if code != 235:
+            raise smtplib.SMTPAuthenticationError(code, text)
+        report('smtp.login', started)
+
+    async def sendmail(self, sender: str, recievers: list[str], data: bytes):
+        """Send a message which is already flattened by message_bytes."""
+        code, text = await self.command(f'MAIL FROM:<{sender}>'.encode())
+        if code != 250:
+            await self.command(b'RSET')
+            raise smtplib.SMTPSenderRefused(code, text, sender)
+        refused = {}
+        for reciever in recievers:
+            code, text = await self.command(f'RCPT TO:<{reciever}>'.encode())
+            if code not in (250, 251):
+                refused[reciever] = (code, text)
+        if len(refused) == len(recievers):
+            await self.command(b'RSET')
+            raise smtplib.SMTPRecipientsRefused(refused)
+        started = timer()
+        code, text = await self.command(b'DATA')
+        if code != 354:
+            raise smtplib.SMTPDataError(code, text)
+        self.writer.write(data + b'.' + CRLF)
+        await self.writer.drain()
+        code, text = await self.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, text)
+        report('smtp.data', started, len(data))
+        return refused
+
+    async def quit(self):
+        """End SMTP session and close connection."""
+        try:
+            if self.writer is not None and not self.writer.is_closing():
+                await self.command(b'QUIT')
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            pass
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ssl.SSLError, ConnectionError):
+                pass
+            self.writer = None
+
+
+class AsyncIMAP:
+    """IMAP client working over asyncio streams with implicit TLS.
+    Command results have the same form as results of imaplib.IMAP4 methods.
+
+    host       IMAP-server host;
+    port       IMAP-server port;
+    context    ssl.SSLContext object. Default: ssl.create_default_context().
+    """
+
+    def __init__(self, host: str, port: int, context: ssl.SSLContext = None):
+        self.host = host
+        self.port = port
+        self.context = context or ssl.create_default_context()
+        self.reader = None
+        self.writer = None
+        self.tagnum = 0
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.logout()
+
+    async def connect(self):
+        """Open a connection and read the server greeting."""
+        started = timer()
+        self.reader, self.writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.context
+        )
+        # TLS handshake is a part of opening the connection
+        report('imap.connect', started)
+        line = await self.readline()
+        if not line.startswith((b'* OK', b'* PREAUTH')):
+            await self.close()
+            raise imaplib.IMAP4.error(line.decode())
+
+    async def readline(self) -> bytes:
+        line = await self.reader.readline()
+        if not line:
+            raise imaplib.IMAP4.abort('socket error: EOF')
+        return line.rstrip(CRLF)
+
+    async def command(self, name: str, *args):
+        """Send a command and read responses.
+
+        name      command name;
+        args      command arguments;
+
+        return    tuple with result type and list of untagged responses
+                  of the command type.
+        """
+        started = timer()
+        self.tagnum += 1
+        tag = f'A{self.tagnum:04d}'.encode()
+        line = b' '.join(
+            [tag, name.encode()]
+            + [arg if isinstance(arg, bytes) else str(arg).encode()
+               for arg in args if arg is not None]
+        )
+        self.writer.write(line + CRLF)
+        await self.writer.drain()
+        # The response type of UID commands is the type of the subcommand
+        typ = (args[0] if name == 'UID' else name).upper()
+        untagged = {}
+        size = 0
+        while True:
+            line = await self.readline()
+            if line.startswith(tag + b' '):
+                status, _, text = line[len(tag) + 1:].partition(b' ')
+                status = status.decode()
+                if status != 'OK':
+                    raise imaplib.IMAP4.error(
+                        f'{name} command error: {status} [{text.decode()}]'
+                    )
+                break
+            match = (
+                UNTAGGED_STATUS.match(line) or UNTAGGED_RESPONSE.match(line)
+            )
+            if not match:
+                continue
+            if match.re is UNTAGGED_STATUS:
+                key, data = match.group(2), match.group(1)
+                if match.group(4):
+                    data += b' ' + match.group(4)
+            else:
+                key, data = match.group(1), match.group(3) or b''
+            key = key.decode().upper()
+            responses = untagged.setdefault(key, [])
+            while literal := LITERAL.search(data):
+                body = await self.reader.readexactly(int(literal.group(1)))
+                size += len(body)
+                responses.append((data, body))
+                data = await self.readline()
+            responses.append(data)
+        if started is not None:
+            report(f'imap.{typ.lower()}', started, size)
+        return 'OK', untagged.get(typ, [None])
+
+    async def login(self, user: str, password: str):
+        return await self.command('LOGIN', quote(user), quote(password))
+
+    async def select(self, mailbox: str = 'INBOX'):
+        return await self.command('SELECT', mailbox)
+
+    async def search(self, criteria: str):
+        return await self.command('SEARCH', criteria)
+
+    async def fetch(self, message_set, message_parts: str):
+        return await self.command('FETCH', message_set, message_parts)
+
+    async def store(self, message_set, command: str, flags: str):
+        return await self.command('STORE', message_set, command, flags)
+
+    async def uid(self, command: str, *args):
+        return await self.command('UID', command.upper(), *args)
+
+    async def logout(self):
+        """End IMAP session and close connection."""
+        try:
+            if self.writer is not None and not self.writer.is_closing():
+                await self.command('LOGOUT')
+        except (imaplib.IMAP4.error, ConnectionError):
+            pass
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ssl.SSLError, ConnectionError):
+                pass
+            self.writer = None
+
+
+class BlockingIMAP:
+    """Blocking view of AsyncIMAP for the functions of read module which
+    are run with run_blocking. A command is run on the event loop, the
+    calling thread waits for its result.
+
+    server    AsyncIMAP object;
+    loop      event loop of the server.
+    """
+
+    def __init__(self, server: AsyncIMAP, loop: asyncio.AbstractEventLoop):
+        self.server = server
+        self.loop = loop
+
+    def uid(self, command: str, *args):
+        return asyncio.run_coroutine_threadsafe(
+            self.server.uid(command, *args), self.loop
+        ).result()
+
+
+async def run_blocking(function, *args, **kwargs):
+    """Run a blocking function (parsing, reading and writing files) in the
+    default executor of the event loop, so other coroutines are not
+    blocked. Stages are reported to the hooks of the calling task.
+
+    return    result of the function.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        None, functools.partial(context.run, function, *args, **kwargs)
+    )
+
+
+def quote(arg: str) -> str:
+    """Quote IMAP string argument."""
+    return '"' + arg.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+async def async_send_email(
+    email: str,
+    password: str,
+    recievers: list[str],
+    domain: str = None,
+    subject: str = None,
+    message_text: str = None,
+    message_template: Path = None,
+    template_kwargs: dict = None,
+    attachments: list[Path] = None,
+    host: str = None,
+    port: int = None,
+    context: ssl.SSLContext = None
+):
+    """Send email messages without blocking the event loop. Parameters are
+    the same as in send_email function.
+
+    context    ssl.SSLContext object. Default: ssl.create_default_context().
+
+    return     None.
+    """
+    logger = logging.getLogger(__name__)
+    # Check parameters
+    params = SendEmailParams(
+        email=email,
+        password=password,
+        domain=domain,
+        recievers=recievers,
+        subject=subject,
+        message_text=message_text,
+        message_template=message_template,
+        template_kwargs=template_kwargs,
+        attachments=attachments
+    )
+
+    if host is None and port is None:
+        # Receiving the server host and port
+        host, port = get_server(domain=params.domain, server='smtp')
+
+    # Attachments are read and encoded outside the event loop
+    message = await run_blocking(build_message, params)
+    data = await run_blocking(message_bytes, message)
+
+    # Set up a connection with the SMTP server
+    async with AsyncSMTP(host, port, context=context) as server:
+        logger.debug('SMTP session started')
+        await server.login(params.email, params.password)
+        logger.debug('Authorization completed')
+        # Send message
+        await server.sendmail(params.email, params.recievers, data)
+        logger.info(
+            'Email message sent from [%s] to [%s]',
+            params.email, ', '.join(params.recievers)
+        )
+        # End SMTP session and close connection
+        logger.debug('SMTP session ended')
+
+
+async def async_read_email(
+    email: str,
+    password: str,
+    domain: str = None,
+    mailbox='INBOX',
+    criteria: str = 'ALL',
+    last: int = None,
+    id_key: str = None,
+    seen: bool = None,
+    with_payload: bool = None,
+    folder: Path = None,
+    host: str = None,
+    port: int = None,
+    batch_size: int = 100,
+    mode: str = 'full',
+    context: ssl.SSLContext = None,
+    store: AttachmentStore = None
+):
+    """Read email messages without blocking the event loop. Parameters are
+    the same as in read_email function. Batches are fetched and parsed
+    by fetch_batch in the default executor, its IMAP commands are run on
+    the event loop.
+
+    context    ssl.SSLContext object. Default: ssl.create_default_context();
+    store      AttachmentStore object which keeps saved files
+               without duplicates.
+
+    return     list[dict].
+    """
+    logger = logging.getLogger(__name__)
+
+    # Create folder, if not exist
+    if folder:
+        if not os.path.exists(folder):
+            os.mkdir(folder)
+            logger.debug("Created a folder '%s'", folder)
+
+    # Check parameters
+    params = ReadEmailParams(
+        email=email,
+        password=password,
+        domain=domain,
+        mailbox=mailbox,
+        criteria=criteria,
+        last=last,
+        id_key=id_key,
+        seen=seen,
+        with_payload=with_payload,
+        folder=folder,
+        batch_size=batch_size,
+        mode=mode
+    )
+
+    if host is None and port is None:
+        # Receiving the server host and port
+        host, port = get_server(domain=params.domain, server='imap')
+
+    # Set up a connection with the IMAP server
+    async with AsyncIMAP(host, port, context=context) as server:
+        logger.debug('IMAP session started')
+        await server.login(params.email, params.password)
+        logger.debug('Authorization completed')
+        await server.select(params.mailbox)
+        status, data = await server.uid('search', params.criteria)
+        # Some servers send no untagged SEARCH response if nothing is found
+        uids = data[0].split() if data[0] else []
+        if params.last:
+            uids = uids[-params.last:]
+        blocking = BlockingIMAP(server, asyncio.get_running_loop())
+        emails = []
+        for start in range(0, len(uids), params.batch_size):
+            # Parsing, HTML to text and saving attachments run outside
+            # the event loop
+            emails.extend(await run_blocking(
+                fetch_batch,
+                server=blocking,
+                uids=uids[start:start + params.batch_size],
+                mode=params.mode,
+                id_key=params.id_key,
+                with_payload=params.with_payload,
+                folder=params.folder,
+                store=store
+            ))
+        # Flags of all read emails are changed with one command
+        if params.seen is not None and uids:
+            command = '+FLAGS.SILENT' if params.seen else '-FLAGS.SILENT'
+            uids_set = message_set(uids)
+            await server.uid('store', uids_set, command, '\\Seen')
+            state = 'seen' if params.seen else 'unseen'
+            logger.info("Emails '%s' marked as '%s'", uids_set, state)
+        # End IMAP session and close connection
+        logger.debug('IMAP session ended')
+    return emails
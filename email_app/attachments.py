@@ -0,0 +1,304 @@
+import base64
+import binascii
+from collections import OrderedDict
+import copy
+from email import encoders
+import email.message
+from email.mime.base import MIMEBase
+import hashlib
+import logging
+import mimetypes
+import os
+from pathlib import Path
+import threading
+from typing import Iterator, NamedTuple
+
+from .utils import build_filepath
+
+
+# Characters which are not a part of base64 data
+NOT_BASE64 = str.maketrans('', '', ' \t\r\n')
+
+
+def encode_attachment(filepath: Path) -> MIMEBase:
+    """Convert file into email.mime.base.MIMEBase object that can be
+    attached to a message object.
+
+    filepath    attachment file path;
+
+    return      email.mime.base.MIMEBase object.
+    """
+    ctype, encoding = mimetypes.guess_type(filepath)
+    if ctype is None or encoding is not None:
+        ctype = 'application/octet-stream'
+    maintype, subtype = ctype.split('/', 1)
+    # Subtype classes are imported only for files which need them
+    if maintype == 'text':
+        from email.mime.text import MIMEText
+
+        with open(filepath) as fp:
+            attachment = MIMEText(fp.read(), _subtype=subtype)
+    elif maintype == 'image':
+        from email.mime.image import MIMEImage
+
+        with open(filepath, 'rb') as fp:
+            attachment = MIMEImage(fp.read(), _subtype=subtype)
+    elif maintype == 'audio':
+        from email.mime.audio import MIMEAudio
+
+        with open(filepath, 'rb') as fp:
+            attachment = MIMEAudio(fp.read(), _subtype=subtype)
+    else:
+        with open(filepath, 'rb') as fp:
+            attachment = MIMEBase(maintype, subtype)
+            attachment.set_payload(fp.read())
+        encoders.encode_base64(attachment)
+    attachment.add_header(
+        'Content-Disposition',
+        'attachment',
+        filename=os.path.basename(filepath)
+    )
+    return attachment
+
+
+def stream_attachment(
+    filepath: Path,
+    chunk_size: int = 57 * 1024
+) -> Iterator[bytes]:
+    """Generate MIME part of the file for SMTP DATA command by chunks.
+    The file is read and base64-encoded chunk by chunk, so memory usage
+    does not depend on the file size.
+
+    filepath      attachment file path;
+    chunk_size    size of the file chunk, rounded down to a multiple
+                  of 57 bytes (one line of base64). Default: 57 KB;
+
+    return        generator of bytes with CRLF line endings.
+    """
+    ctype, encoding = mimetypes.guess_type(filepath)
+    if ctype is None or encoding is not None:
+        ctype = 'application/octet-stream'
+    attachment = MIMEBase(*ctype.split('/', 1))
+    attachment['Content-Transfer-Encoding'] = 'base64'
+    attachment.add_header(
+        'Content-Disposition',
+        'attachment',
+        filename=os.path.basename(filepath)
+    )
+    attachment.set_payload('')
+    yield attachment.as_bytes(policy=attachment.policy.clone(linesep='\r\n'))
+    chunk_size = max(chunk_size - chunk_size % 57, 57)
+    with open(filepath, 'rb') as fp:
+        while chunk := fp.read(chunk_size):
+            yield base64.encodebytes(chunk).replace(b'\n', b'\r\n')
+
+
+class AttachmentCache:
+    """Process-wide LRU cache of encoded attachments. Attachments are
+    keyed by path, size and modification time, so a file is encoded once
+    and every message gets a copy of the already encoded part.
+
+    max_bytes    memory budget for encoded payloads. Files which are larger
+                 than the budget are not cached. Default: 64 MB.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._parts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._parts)
+
+    def get(self, filepath: Path) -> MIMEBase:
+        """Get an encoded attachment from the cache or encode the file.
+
+        filepath    attachment file path;
+
+        return      email.mime.base.MIMEBase object.
+        """
+        abspath = os.path.abspath(filepath)
+        stat = os.stat(abspath)
+        key = (abspath, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._parts.get(key)
+            if entry is not None:
+                self._parts.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[0])
+            self.misses += 1
+        attachment = encode_attachment(filepath)
+        size = len(attachment.get_payload())
+        if size > self.max_bytes:
+            return attachment
+        with self._lock:
+            # Old versions of the file are not needed any more
+            self._remove(abspath)
+            self._parts[key] = (attachment, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, old_size) = self._parts.popitem(last=False)
+                self.size -= old_size
+        return copy.deepcopy(attachment)
+
+    def _remove(self, abspath: str):
+        for key in [k for k in self._parts if k[0] == abspath]:
+            self.size -= self._parts.pop(key)[1]
+
+    def invalidate(self, filepath: Path = None):
+        """Remove the attachment from the cache.
+
+        filepath    attachment file path. If None, the whole cache is
+                    cleared.
+        """
+        logger = logging.getLogger(__name__)
+        with self._lock:
+            if filepath is None:
+                self._parts.clear()
+                self.size = 0
+                logger.debug('Attachment cache cleared')
+                return
+            self._remove(os.path.abspath(filepath))
+            logger.debug('Attachment (%s) removed from cache', filepath)
+
+
+ATTACHMENTS = AttachmentCache()
+
+
+def invalidate_attachments(filepath: Path = None):
+    """Remove the attachment from the process-wide cache.
+
+    filepath    attachment file path. If None, the whole cache is cleared.
+    """
+    ATTACHMENTS.invalidate(filepath)
+
+
+class AttachmentFile(NamedTuple):
+    """Received attachment saved to disk. File content is read only
+    on demand.
+
+    path      file path;
+    size      file size in bytes;
+    sha256    hex digest of the file content.
+    """
+
+    path: str
+    size: int
+    sha256: str
+
+    def open(self, mode: str = 'rb'):
+        """Open the saved file."""
+        return open(self.path, mode)
+
+    def read_bytes(self) -> bytes:
+        """Read the whole file content."""
+        with self.open() as f:
+            return f.read()
+
+
+def encode_payload(payload: str) -> bytes:
+    try:
+        return payload.encode('ascii', 'surrogateescape')
+    except UnicodeError:
+        return payload.encode('raw-unicode-escape')
+
+
+def decode_payload(
+    message: email.message.Message,
+    chunk_size: int = 64 * 1024
+) -> Iterator[bytes]:
+    """Decode base64 or quoted-printable payload of the email part chunk
+    by chunk, so the decoded file is never kept in memory as a whole.
+    Payloads with other transfer encodings are decoded at once.
+
+    message       email.message.Message object;
+    chunk_size    number of payload characters decoded at once.
+                  Default: 64 KB;
+
+    return        generator of bytes.
+    """
+    encoding = str(message.get('Content-Transfer-Encoding', '')).lower()
+    payload = message.get_payload()
+    if message.is_multipart() or not isinstance(payload, str):
+        return
+    if encoding == 'base64':
+        rest = ''
+        for start in range(0, len(payload), chunk_size):
+            data = rest + payload[start:start + chunk_size].translate(
+                NOT_BASE64
+            )
+            # Only whole groups of 4 characters can be decoded
+            end = len(data) - len(data) % 4
+            data, rest = data[:end], data[end:]
+            if data:
+                yield binascii.a2b_base64(data)
+        if rest.rstrip('='):
+            # Broken padding is completed as get_payload(decode=True) does
+            yield binascii.a2b_base64(rest.rstrip('=') + '===')
+    elif encoding == 'quoted-printable':
+        start = 0
+        while start < len(payload):
+            # Chunks end at line breaks, so soft line breaks and escaped
+            # characters are never split
+            end = payload.find('\n', start + chunk_size)
+            end = len(payload) if end == -1 else end + 1
+            yield binascii.a2b_qp(encode_payload(payload[start:end]))
+            start = end
+    else:
+        yield message.get_payload(decode=True) or b''
+
+
+def save_attachment(
+    message: email.message.Message,
+    folder: Path,
+    filename: str,
+    chunk_size: int = 64 * 1024
+) -> AttachmentFile:
+    """Decode the attachment into a new file of the folder chunk by chunk.
+    If a file with the same name exists, a number is added to the name.
+
+    message       email.message.Message object;
+    folder        folder path where the file is saved;
+    filename      file name;
+    chunk_size    number of payload characters decoded at once.
+                  Default: 64 KB;
+
+    return        AttachmentFile object.
+    """
+    filepath = os.path.join(folder, os.path.basename(filename))
+    while True:
+        try:
+            # Exclusive creation: another process may save a file with
+            # the same name at the same time
+            f = open(build_filepath(filepath), 'xb')
+            break
+        except FileExistsError:
+            continue
+    with f:
+        size, sha256 = write_payload(message, f, chunk_size)
+    return AttachmentFile(path=f.name, size=size, sha256=sha256)
+
+
+def write_payload(
+    message: email.message.Message,
+    f,
+    chunk_size: int = 64 * 1024
+) -> tuple[int, str]:
+    """Decode the payload into the binary file object chunk by chunk.
+
+    message       email.message.Message object;
+    f             file object opened for writing;
+    chunk_size    number of payload characters decoded at once;
+
+    return        tuple with size and SHA-256 hex digest of the payload.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in decode_payload(message, chunk_size):
+        f.write(chunk)
+        digest.update(chunk)
+        size += len(chunk)
+    return size, digest.hexdigest()
@@ -0,0 +1,284 @@
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+import imaplib
+import logging
+import os
+from pathlib import Path
+import threading
+from typing import Iterator
+
+from .read import (
+    fetch_batch, fetch_raw, get_response_number, message_set, parse_emails,
+    store_seen
+)
+from .metrics import IMAPClient, submit
+from .search import MailboxIndex, SearchIndex
+from .store import AttachmentStore
+from .types import BackfillEmailParams
+from .utils import get_connection_limit, get_server
+
+
+class Sessions:
+    """Authenticated IMAP sessions, one for each worker thread.
+
+    params    BackfillEmailParams object;
+    host      IMAP-server host;
+    port      IMAP-server port.
+    """
+
+    def __init__(self, params: BackfillEmailParams, host: str, port: int):
+        self.params = params
+        self.host = host
+        self.port = port
+        self._local = threading.local()
+        self._servers = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get(self) -> imaplib.IMAP4_SSL:
+        """Get the session of the current thread or open a new one."""
+        logger = logging.getLogger(__name__)
+        server = getattr(self._local, 'server', None)
+        if server is None:
+            server = IMAPClient(self.host, self.port)
+            with self._lock:
+                self._servers.append(server)
+            server.login(self.params.email, self.params.password)
+            server.select(self.params.mailbox)
+            logger.debug('IMAP session %s started', len(self._servers))
+            self._local.server = server
+        return server
+
+    def close(self):
+        """Log out of all sessions."""
+        logger = logging.getLogger(__name__)
+        with self._lock:
+            servers, self._servers = self._servers, []
+        for server in servers:
+            try:
+                server.logout()
+            except (OSError, imaplib.IMAP4.error):
+                pass
+        logger.debug('IMAP sessions ended')
+
+
+def fetch_partition(
+    sessions: Sessions,
+    uids: list[bytes],
+    parser: Executor = None,
+    store: AttachmentStore = None,
+    index: MailboxIndex = None
+):
+    """Fetch a partition of emails with the session of the current thread.
+    Whole emails are parsed with parser.
+
+    return    concurrent.futures.Future object or list[dict].
+    """
+    params = sessions.params
+    server = sessions.get()
+    if params.mode == 'full' and parser is not None:
+        result = submit(
+            parser,
+            parse_emails,
+            messages=fetch_raw(server, uids),
+            id_key=params.id_key,
+            with_payload=params.with_payload,
+            folder=params.folder,
+            store=store,
+            index=index
+        )
+    else:
+        result = fetch_batch(
+            server=server,
+            uids=uids,
+            mode=params.mode,
+            id_key=params.id_key,
+            with_payload=params.with_payload,
+            folder=params.folder,
+            store=store,
+            index=index
+        )
+    return result
+
+
+def store_flags(sessions: Sessions, uids: list[bytes]):
+    """Change flags of all read emails with one UID STORE command, with
+    the session of the current thread.
+    """
+    store_seen(sessions.get(), message_set(uids), sessions.params.seen)
+
+
+def search_uids(sessions: Sessions) -> tuple[list[bytes], int]:
+    """Search UIDs of emails with the session of the current thread.
+
+    return    tuple with UIDs and UIDVALIDITY of the mailbox.
+    """
+    params = sessions.params
+    server = sessions.get()
+    uidvalidity = get_response_number(server, 'UIDVALIDITY')
+    status, data = server.uid('search', None, params.criteria)
+    uids = data[0].split()
+    if params.last:
+        uids = uids[-params.last:]
+    return uids, uidvalidity
+
+
+def generate_backfill(
+    params: BackfillEmailParams,
+    host: str,
+    port: int,
+    store: AttachmentStore = None,
+    index: SearchIndex = None
+) -> Iterator[dict]:
+    """Fetch partitions of emails concurrently and yield the emails in UID
+    order. Parameters are checked by backfill_email function.
+
+    return    generator of dictionaries.
+    """
+    logger = logging.getLogger(__name__)
+    connections = params.connections
+    limit = get_connection_limit(params.domain, 'imap')
+    if limit is not None and connections > limit:
+        logger.warning(
+            '%s connections are more than %s allowed by %s, '
+            '%s connections are used',
+            connections, limit, params.domain, limit
+        )
+        connections = limit
+    fetcher = ThreadPoolExecutor(
+        max_workers=connections, thread_name_prefix='imap'
+    )
+    parser = None
+    with Sessions(params, host, port) as sessions:
+        try:
+            # Search with the session of a fetching thread, so not more
+            # than the allowed number of connections is opened
+            uids, uidvalidity = submit(fetcher, search_uids, sessions).result()
+            mailbox_index = None
+            if index is not None and uidvalidity is not None:
+                mailbox_index = index.mailbox(
+                    params.email, params.mailbox, uidvalidity
+                )
+            partitions = [
+                uids[start:start + params.batch_size]
+                for start in range(0, len(uids), params.batch_size)
+            ]
+            logger.info(
+                '%s emails are fetched in %s partitions with %s connections',
+                len(uids), len(partitions), connections
+            )
+            if params.mode == 'full' and params.processes != 0:
+                parser = ProcessPoolExecutor(max_workers=params.processes)
+            # Not more than two partitions for each connection are kept
+            # in memory at once
+            window = 2 * connections
+            futures = [
+                submit(
+                    fetcher,
+                    fetch_partition,
+                    sessions,
+                    partition,
+                    parser,
+                    store,
+                    mailbox_index
+                )
+                for partition in partitions[:window]
+            ]
+            for position in range(len(partitions)):
+                if position + window < len(partitions):
+                    futures.append(
+                        submit(
+                            fetcher,
+                            fetch_partition,
+                            sessions,
+                            partitions[position + window],
+                            parser,
+                            store,
+                            mailbox_index
+                        )
+                    )
+                result = futures[position].result()
+                futures[position] = None
+                if parser is not None:
+                    result = result.result()
+                yield from result
+            if params.seen is not None:
+                submit(fetcher, store_flags, sessions, uids).result()
+        finally:
+            fetcher.shutdown(cancel_futures=True)
+            if parser is not None:
+                parser.shutdown(cancel_futures=True)
+
+
+def backfill_email(
+    email: str,
+    password: str,
+    domain: str = None,
+    mailbox='INBOX',
+    criteria: str = 'ALL',
+    last: int = None,
+    id_key: str = None,
+    seen: bool = None,
+    with_payload: bool = None,
+    folder: Path = None,
+    host: str = None,
+    port: int = None,
+    batch_size: int = 100,
+    mode: str = 'full',
+    connections: int = 4,
+    processes: int = None,
+    store: AttachmentStore = None,
+    index: SearchIndex = None
+):
+    """Read a big mailbox with several IMAP connections. Found UIDs are
+    split into partitions of batch_size emails, the partitions are fetched
+    concurrently and the emails are returned in UID order. Whole emails are
+    parsed in a pool of processes. Parameters are the same as in read_email
+    function.
+
+    connections    number of IMAP connections. It is limited by the number
+                   of connections allowed by the email service. Default: 4;
+    processes      number of parsing processes. If 0, emails are parsed
+                   in the fetching threads. Default: number of CPUs;
+    store          AttachmentStore object which keeps saved files
+                   without duplicates;
+    index          SearchIndex object which is fed with read emails.
+
+    return         list[dict].
+    """
+    logger = logging.getLogger(__name__)
+
+    # Create folder, if not exist
+    if folder:
+        if not os.path.exists(folder):
+            os.mkdir(folder)
+            logger.debug("Created a folder '%s'", folder)
+
+    # Check parameters
+    params = BackfillEmailParams(
+        email=email,
+        password=password,
+        domain=domain,
+        mailbox=mailbox,
+        criteria=criteria,
+        last=last,
+        id_key=id_key,
+        seen=seen,
+        with_payload=with_payload,
+        folder=folder,
+        batch_size=batch_size,
+        mode=mode,
+        connections=connections,
+        processes=processes
+    )
+
+    if host is None and port is None:
+        # Receiving the server host and port
+        host, port = get_server(domain=params.domain, server='imap')
+
+    return list(generate_backfill(params, host, port, store, index))
@@ -0,0 +1,269 @@
+from contextlib import closing
+import hashlib
+import logging
+import os
+from pathlib import Path
+import pickle
+import sqlite3
+import time
+
+
+class MessageCache:
+    """Local cache of received emails. Raw emails (RFC822) are kept in
+    a Maildir-style directory (written into tmp and moved into cur), parsed
+    emails and the index are kept in SQLite. Emails are keyed by account,
+    mailbox, UIDVALIDITY and UID, so a changed UIDVALIDITY makes old
+    emails unreachable. Least recently used emails are removed when the
+    cache is larger than max_bytes.
+
+    root         cache directory;
+    max_bytes    maximum size of raw and parsed emails. Default: 1 GB.
+
+    Example:
+        cache = MessageCache('path/to/cache')
+        mails = read_email(email, password, criteria='ALL', cache=cache)
+    """
+
+    def __init__(self, root: Path, max_bytes: int = 1024 ** 3):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.tmp = os.path.join(self.root, 'tmp')
+        self.cur = os.path.join(self.root, 'cur')
+        self.index = os.path.join(self.root, 'cache.sqlite')
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.tmp, exist_ok=True)
+        os.makedirs(self.cur, exist_ok=True)
+        with closing(self._connect()) as db, db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS messages ('
+                'account TEXT, mailbox TEXT, uidvalidity INTEGER, '
+                'uid INTEGER, filename TEXT NOT NULL, size INTEGER NOT NULL, '
+                'options TEXT, parsed BLOB, accessed REAL NOT NULL, '
+                'PRIMARY KEY (account, mailbox, uidvalidity, uid))'
+            )
+            db.execute(
+                'CREATE INDEX IF NOT EXISTS messages_accessed '
+                'ON messages (accessed)'
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.index, timeout=30)
+
+    @property
+    def size(self) -> int:
+        """Size of cached raw and parsed emails in bytes."""
+        with closing(self._connect()) as db:
+            return db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM messages'
+            ).fetchone()[0]
+
+    def __len__(self):
+        with closing(self._connect()) as db:
+            return db.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def mailbox(self, account: str, mailbox: str, uidvalidity: int):
+        """Get the cache of one mailbox.
+
+        return    MailboxCache object.
+        """
+        return MailboxCache(self, account, mailbox, uidvalidity)
+
+    def get(
+        self,
+        account: str,
+        mailbox: str,
+        uidvalidity: int,
+        uids: list[int],
+        options: str = None
+    ) -> dict:
+        """Get cached emails. Parsed email is returned if it was parsed with
+        the same options, otherwise raw email is returned.
+
+        account        email address;
+        mailbox        mailbox name;
+        uidvalidity    UIDVALIDITY of the mailbox;
+        uids           email UIDs;
+        options        parsing options of the parsed emails;
+
+        return         dict of UIDs and parsed emails (dict) or raw
+                       emails (bytes).
+        """
+        found = {}
+        with closing(self._connect()) as db, db:
+            for start in range(0, len(uids), 500):
+                part = uids[start:start + 500]
+                rows = db.execute(
+                    'SELECT uid, filename, options, parsed FROM messages '
+                    'WHERE account = ? AND mailbox = ? AND uidvalidity = ? '
+                    f'AND uid IN ({", ".join("?" * len(part))})',
+                    (account, mailbox, uidvalidity, *part)
+                ).fetchall()
+                for uid, filename, parsed_options, parsed in rows:
+                    if parsed is not None and parsed_options == options:
+                        found[uid] = pickle.loads(parsed)
+                        continue
+                    try:
+                        with open(os.path.join(self.cur, filename), 'rb') as f:
+                            found[uid] = f.read()
+                    except FileNotFoundError:
+                        pass
+            db.executemany(
+                'UPDATE messages SET accessed = ? WHERE account = ? '
+                'AND mailbox = ? AND uidvalidity = ? AND uid = ?',
+                [
+                    (time.time(), account, mailbox, uidvalidity, uid)
+                    for uid in found
+                ]
+            )
+        self.hits += len(found)
+        self.misses += len(uids) - len(found)
+        return found
+
+    def put(
+        self,
+        account: str,
+        mailbox: str,
+        uidvalidity: int,
+        uid: int,
+        data: bytes = None,
+        parsed: dict = None,
+        options: str = None
+    ):
+        """Add an email to the cache. If data is None, only the parsed email
+        of the cached email is replaced. The cache size is not checked,
+        evict should be called after adding emails.
+
+        account        email address;
+        mailbox        mailbox name;
+        uidvalidity    UIDVALIDITY of the mailbox;
+        uid            email UID;
+        data           raw email (RFC822);
+        parsed         parsed email;
+        options        parsing options of the parsed email.
+        """
+        key = f'{account}\0{mailbox}\0{uidvalidity}\0{uid}'
+        filename = hashlib.sha1(key.encode()).hexdigest() + '.eml'
+        parsed = None if parsed is None else pickle.dumps(parsed)
+        parsed_size = 0 if parsed is None else len(parsed)
+        with closing(self._connect()) as db, db:
+            if data is None:
+                db.execute(
+                    'UPDATE messages SET options = ?, parsed = ?, '
+                    'size = size - COALESCE(LENGTH(parsed), 0) + ?, '
+                    'accessed = ? WHERE account = ? AND mailbox = ? '
+                    'AND uidvalidity = ? AND uid = ?',
+                    (
+                        options, parsed, parsed_size, time.time(),
+                        account, mailbox, uidvalidity, uid
+                    )
+                )
+            else:
+                tmp_path = os.path.join(self.tmp, f'{filename}.{os.getpid()}')
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, os.path.join(self.cur, filename))
+                db.execute(
+                    'INSERT OR REPLACE INTO messages (account, mailbox, '
+                    'uidvalidity, uid, filename, size, options, parsed, '
+                    'accessed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        account, mailbox, uidvalidity, uid, filename,
+                        len(data) + parsed_size, options, parsed, time.time()
+                    )
+                )
+
+    def evict(self):
+        """Remove least recently used emails while the cache is larger
+        than max_bytes.
+        """
+        logger = logging.getLogger(__name__)
+        with closing(self._connect()) as db, db:
+            size = db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM messages'
+            ).fetchone()[0]
+            removed = 0
+            while size > self.max_bytes:
+                rows = db.execute(
+                    'SELECT rowid, filename, size FROM messages '
+                    'ORDER BY accessed LIMIT 100'
+                ).fetchall()
+                if not rows:
+                    break
+                for rowid, filename, row_size in rows:
+                    if size <= self.max_bytes:
+                        break
+                    self._remove_file(filename)
+                    db.execute(
+                        'DELETE FROM messages WHERE rowid = ?', (rowid,)
+                    )
+                    size -= row_size
+                    removed += 1
+        if removed:
+            logger.debug('%s emails removed from cache', removed)
+
+    def clear(self, account: str = None, mailbox: str = None):
+        """Remove emails from the cache.
+
+        account    email address. If None, the whole cache is cleared;
+        mailbox    mailbox name. If None, all mailboxes of the account
+                   are cleared.
+        """
+        logger = logging.getLogger(__name__)
+        where, args = '', ()
+        if account is not None:
+            where, args = ' WHERE account = ?', (account,)
+            if mailbox is not None:
+                where, args = where + ' AND mailbox = ?', args + (mailbox,)
+        with closing(self._connect()) as db, db:
+            rows = db.execute(
+                f'SELECT filename FROM messages{where}', args
+            ).fetchall()
+            for filename, in rows:
+                self._remove_file(filename)
+            db.execute(f'DELETE FROM messages{where}', args)
+        logger.debug('%s emails removed from cache', len(rows))
+
+    def _remove_file(self, filename: str):
+        try:
+            os.remove(os.path.join(self.cur, filename))
+        except FileNotFoundError:
+            pass
+
+
+class MailboxCache:
+    """Cache of one mailbox, see MessageCache.
+
+    cache          MessageCache object;
+    account        email address;
+    mailbox        mailbox name;
+    uidvalidity    UIDVALIDITY of the mailbox.
+    """
+
+    def __init__(
+        self,
+        cache: MessageCache,
+        account: str,
+        mailbox: str,
+        uidvalidity: int
+    ):
+        self.cache = cache
+        self.key = (account, mailbox, uidvalidity)
+
+    def get(self, uids: list[int], options: str = None) -> dict:
+        """Get cached emails, see MessageCache.get."""
+        return self.cache.get(*self.key, uids, options)
+
+    def put(
+        self,
+        uid: int,
+        data: bytes = None,
+        parsed: dict = None,
+        options: str = None
+    ):
+        """Add an email to the cache, see MessageCache.put."""
+        self.cache.put(*self.key, uid, data, parsed, options)
+
+    def evict(self):
+        """Remove least recently used emails, see MessageCache.evict."""
+        self.cache.evict()
@@ -0,0 +1,359 @@
+import imaplib
+import logging
+import os
+from pathlib import Path
+import queue
+import re
+import select
+import ssl
+import threading
+import time
+from typing import Callable
+
+from .read import (
+    fetch_batch, get_response_number, message_set, search_new, store_seen
+)
+from .metrics import IMAPClient
+from .search import MailboxIndex, SearchIndex
+from .store import AttachmentStore
+from .types import ReadEmailParams
+from .utils import get_server
+
+
+EXISTS = re.compile(rb'\* \d+ EXISTS')
+
+
+class IdleListener:
+    """Long-lived IMAP connection which waits for new emails with IDLE
+    command and hands them to a callback or a queue. IDLE is re-issued
+    before the server timeout, the connection is restored with exponential
+    backoff. If the server does not support IDLE, the mailbox is polled.
+
+    email            email address which is read;
+    password         email app password;
+    callback         function called with each new email (dict);
+    queue            queue.Queue object which new emails are put into.
+                     One of callback and queue must be defined;
+    domain           domain of the email service.
+                     If None, will be received from email;
+    mailbox          mailbox section or folder name. Default: INBOX;
+
+    Additional parameters:
+    id_key           email ID key. Example: "Message-ID" - for Yandex;
+    seen             mark new emails as "read" (True) or "unread" (False).
+                     Default: None, flags are not changed;
+    with_payload     add payload for attached files;
+    folder           folder path where attached files are saved;
+    host             IMAP-server host;
+    port             IMAP-server port;
+    mode             read mode: 'full', 'headers' or 'text'. Default: 'full';
+    idle_timeout     seconds after which IDLE is re-issued. Default: 29 min;
+    poll_interval    seconds between checks if IDLE is not supported.
+                     Default: 60;
+    max_backoff      maximum delay between reconnections, seconds.
+                     Default: 300;
+    store            AttachmentStore object which keeps saved files
+                     without duplicates;
+    index            SearchIndex object which is fed with new emails.
+
+    Example:
+        listener = IdleListener(email, password, callback=print)
+        listener.start()
+        ...
+        listener.stop()
+    """
+
+    def __init__(
+        self,
+        email: str,
+        password: str,
+        callback: Callable[[dict], None] = None,
+        queue: queue.Queue = None,
+        domain: str = None,
+        mailbox: str = 'INBOX',
+        id_key: str = None,
+        seen: bool = None,
+        with_payload: bool = None,
+        folder: Path = None,
+        host: str = None,
+        port: int = None,
+        mode: str = 'full',
+        idle_timeout: float = 29 * 60,
+        poll_interval: float = 60,
+        max_backoff: float = 300,
+        store: AttachmentStore = None,
+        index: SearchIndex = None
+    ):
+        logger = logging.getLogger(__name__)
+        if callback is None and queue is None:
+            raise ValueError("One of 'callback' and 'queue' must be defined")
+        # Create folder, if not exist
+        if folder:
+            if not os.path.exists(folder):
+                os.mkdir(folder)
+                logger.debug("Created a folder '%s'", folder)
+        # Check parameters
+        self.params = ReadEmailParams(
+            email=email,
+            password=password,
+            domain=domain,
+            mailbox=mailbox,
+            id_key=id_key,
+            seen=seen,
+            with_payload=with_payload,
+            folder=folder,
+            mode=mode
+        )
+        if host is None and port is None:
+            # Receiving the server host and port
+            host, port = get_server(domain=self.params.domain, server='imap')
+        self.host = host
+        self.port = port
+        self.callback = callback
+        self.queue = queue
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self.store = store
+        self.index = index
+        self.last_uid = None
+        self.uidvalidity = None
+        self.idling = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._established = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """Start listening in a background thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """Stop listening and close the connection."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run(self):
+        """Listen for new emails until stop is called. Reconnect with
+        exponential backoff if the connection fails.
+        """
+        logger = logging.getLogger(__name__)
+        backoff = 1
+        while not self._stop.is_set():
+            self._established = False
+            try:
+                with IMAPClient(self.host, self.port) as server:
+                    self._listen(server)
+                continue
+            except (OSError, imaplib.IMAP4.error) as exp:
+                logger.warning('IMAP connection lost: %s', exp)
+            except Exception:
+                # The listener must not end silently, it reconnects as
+                # after a connection loss
+                logger.exception('IMAP listener failed')
+            self.idling.clear()
+            if self._established:
+                # The connection has worked (IDLE has been accepted or
+                # the mailbox has been polled), a new series of delays
+                # starts. A failure right after login keeps growing delays
+                backoff = 1
+            delay = min(backoff, self.max_backoff)
+            logger.warning('Reconnecting in %s s', delay)
+            self._stop.wait(delay)
+            backoff = delay * 2
+
+    def _listen(self, server: imaplib.IMAP4_SSL):
+        """Wait for new emails in the selected mailbox until stop is
+        called.
+        """
+        logger = logging.getLogger(__name__)
+        server.login(self.params.email, self.params.password)
+        server.select(self.params.mailbox)
+        logger.debug('IMAP session started')
+        uidvalidity = get_response_number(server, 'UIDVALIDITY')
+        uidnext = get_response_number(server, 'UIDNEXT')
+        if self.last_uid is None or uidvalidity != self.uidvalidity:
+            # Only emails which arrive after the start are read
+            self.last_uid = uidnext - 1 if uidnext else max(
+                [int(uid) for uid in search_new(server)] or [0]
+            )
+            self.uidvalidity = uidvalidity
+        else:
+            # Emails which have arrived while disconnected
+            self._fetch_new(server)
+        idle = 'IDLE' in server.capabilities
+        while not self._stop.is_set():
+            if idle:
+                new = self._idle(server)
+            else:
+                self._stop.wait(self.poll_interval)
+                server.noop()
+                self._established = True
+                new = True
+            if new and not self._stop.is_set():
+                self._fetch_new(server)
+
+    def _fetch(
+        self,
+        server: imaplib.IMAP4_SSL,
+        uids: list[bytes],
+        index: MailboxIndex = None
+    ) -> list[dict]:
+        """Fetch emails in the read mode of the listener."""
+        return fetch_batch(
+            server=server,
+            uids=uids,
+            mode=self.params.mode,
+            id_key=self.params.id_key,
+            with_payload=self.params.with_payload,
+            folder=self.params.folder,
+            store=self.store,
+            index=index
+        )
+
+    def _fetch_new(self, server: imaplib.IMAP4_SSL):
+        """Fetch emails newer than the last UID and hand them over. Emails
+        which can not be parsed are logged and skipped.
+        """
+        logger = logging.getLogger(__name__)
+        uids = search_new(server, self.last_uid)
+        index = None
+        if self.index is not None and self.uidvalidity is not None:
+            index = self.index.mailbox(
+                self.params.email, self.params.mailbox, self.uidvalidity
+            )
+        received = []
+        for start in range(0, len(uids), self.params.batch_size):
+            batch = uids[start:start + self.params.batch_size]
+            try:
+                emails = self._fetch(server, batch, index)
+            except (OSError, imaplib.IMAP4.error):
+                raise
+            except Exception:
+                # One bad email fails the whole batch, so the emails are
+                # fetched again one by one
+                emails = []
+                for uid in batch:
+                    try:
+                        emails.extend(self._fetch(server, [uid], index))
+                    except (OSError, imaplib.IMAP4.error):
+                        raise
+                    except Exception as exp:
+                        logger.error(
+                            "Email '%s' is not read: %s", uid.decode(), exp
+                        )
+            # Bad emails are not fetched again after a reconnection
+            self.last_uid = int(batch[-1])
+            for msg in emails:
+                self._hand_over(msg)
+                received.append(msg['uid'])
+        # Flags of all new emails are changed with one command
+        store_seen(server, message_set(received), self.params.seen)
+
+    def _hand_over(self, msg: dict):
+        """Pass the email to the callback and the queue. Their errors are
+        logged, so they do not stop the listener.
+        """
+        logger = logging.getLogger(__name__)
+        handlers = []
+        if self.callback is not None:
+            handlers.append(self.callback)
+        if self.queue is not None:
+            handlers.append(self.queue.put)
+        for handler in handlers:
+            try:
+                handler(msg)
+            except Exception as exp:
+                logger.error(
+                    "Email '%s' is not handed over: %s", msg.get('uid'), exp
+                )
+
+    def _idle(self, server: imaplib.IMAP4_SSL) -> bool:
+        """Wait for new emails in IDLE state.
+
+        return    True if the server has sent EXISTS response.
+        """
+        tag = server._new_tag()
+        server.send(tag + b' IDLE\r\n')
+        new = False
+        while True:
+            line = self._readline(server, timeout=30)
+            if line is None:
+                raise imaplib.IMAP4.abort('IDLE command timeout')
+            if line.startswith(b'+'):
+                break
+            if not line.startswith(b'* '):
+                raise imaplib.IMAP4.error(f'IDLE command error: {line}')
+            # Untagged responses which have arrived before IDLE
+            new = new or bool(EXISTS.match(line))
+        self.idling.set()
+        self._established = True
+        deadline = time.monotonic() + self.idle_timeout
+        while not new and not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Wake up every second to check the stop flag
+            line = self._readline(server, timeout=min(remaining, 1))
+            if line is None:
+                continue
+            if line.startswith(b'* BYE'):
+                raise imaplib.IMAP4.abort(line.decode())
+            new = bool(EXISTS.match(line))
+        self.idling.clear()
+        server.send(b'DONE\r\n')
+        while True:
+            line = self._readline(server, timeout=30)
+            if line is None:
+                raise imaplib.IMAP4.abort('IDLE termination timeout')
+            if line.startswith(tag):
+                if not line[len(tag):].strip().startswith(b'OK'):
+                    raise imaplib.IMAP4.error(line.decode())
+                return new
+            new = new or bool(EXISTS.match(line))
+
+    def _readline(self, server: imaplib.IMAP4_SSL, timeout: float):
+        """Read a response line through the buffered file of imaplib. The
+        line is read only when data is available, so a read is never
+        interrupted by a timeout.
+
+        return    bytes or None if nothing has been received in timeout.
+        """
+        if not self._readable(server):
+            ready, _, _ = select.select([server.sock], [], [], timeout)
+            if not ready:
+                return None
+        line = server.readline()
+        if not line:
+            raise imaplib.IMAP4.abort('socket error: EOF')
+        return line.rstrip(b'\r\n')
+
+    @staticmethod
+    def _readable(server: imaplib.IMAP4_SSL) -> bool:
+        """Check without blocking if imaplib has buffered data, TLS has
+        decrypted data or the connection is closed.
+        """
+        if server.sock.pending():
+            return True
+        timeout = server.sock.gettimeout()
+        # Peek reads the socket only if the buffer is empty. Without data
+        # a non-blocking TLS socket raises SSLWantReadError, an empty
+        # result is the end of the stream
+        server.sock.setblocking(False)
+        try:
+            server.file.peek(1)
+            return True
+        except (ssl.SSLWantReadError, BlockingIOError):
+            return False
+        finally:
+            server.sock.settimeout(timeout)
@@ -0,0 +1,275 @@
+import contextvars
+from contextvars import ContextVar
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+
+# Hooks of all calls and hooks of the current context (Counters blocks)
+_hooks = []
+_scoped = ContextVar('email_app_hooks', default=())
+# Stages measured in a worker process by collect function
+_collected = ContextVar('email_app_collected', default=None)
+
+Hook = Callable[[str, float, Optional[int]], None]
+
+
+def add_hook(hook: Hook):
+    """Add a function which is called after each measured stage with stage
+    name, duration in seconds and size in bytes (or None). Stages:
+    imap.connect, imap.tls, imap.login, imap.select, imap.search,
+    imap.fetch, imap.store, smtp.connect, smtp.tls, smtp.login, smtp.data,
+    parse, html_to_text, attachment, render.
+
+    hook    callable(stage, seconds, size).
+
+    Example:
+        add_hook(lambda stage, seconds, size: statsd.timing(stage, seconds))
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook: Hook):
+    """Remove the hook added with add_hook."""
+    _hooks.remove(hook)
+
+
+def timer() -> Optional[float]:
+    """Start measuring a stage.
+
+    return    start time or None if there are no hooks, then report does
+              nothing.
+    """
+    if _hooks or _scoped.get() or _collected.get() is not None:
+        return time.perf_counter()
+
+
+def report(stage: str, started: Optional[float], size: int = None):
+    """Pass duration of the stage started with timer function to the hooks.
+
+    stage      stage name;
+    started    start time returned by timer function;
+    size       size of the stage data, bytes.
+    """
+    if started is None:
+        return
+    emit(stage, time.perf_counter() - started, size)
+
+
+def emit(stage: str, seconds: float, size: int = None):
+    """Pass measured stage to the hooks of the current context."""
+    events = _collected.get()
+    if events is not None:
+        # The stage is passed to the hooks by the caller of collect
+        events.append((stage, seconds, size))
+        return
+    for hook in (*_hooks, *_scoped.get()):
+        try:
+            hook(stage, seconds, size)
+        except Exception as exp:
+            logger = logging.getLogger(__name__)
+            logger.warning('Metrics hook failed: %s', exp)
+
+
+def collect(function: Callable, *args, **kwargs) -> tuple:
+    """Run the function and collect its stages instead of passing them to
+    the hooks. Used in worker processes, where hooks of the caller are not
+    available.
+
+    return    tuple with the result and list of (stage, seconds, size).
+    """
+    events = []
+    token = _collected.set(events)
+    try:
+        result = function(*args, **kwargs)
+    finally:
+        _collected.reset(token)
+    return result, events
+
+
+def submit(executor, function: Callable, *args, **kwargs):
+    """Submit the function to the executor, so that its stages are reported
+    to the hooks of the caller, including Counters blocks. Thread pools run
+    the function in a copy of the caller's context. Other executors (process
+    pools) run it with collect, and the stages are passed to the hooks when
+    the result is received.
+
+    executor    concurrent.futures.Executor object;
+    function    callable and its arguments;
+
+    return      concurrent.futures.Future object.
+    """
+    from concurrent.futures import Future, ThreadPoolExecutor
+
+    context = contextvars.copy_context()
+    if isinstance(executor, ThreadPoolExecutor):
+        return executor.submit(context.run, function, *args, **kwargs)
+    if not (_hooks or _scoped.get()):
+        return executor.submit(function, *args, **kwargs)
+    result = Future()
+
+    def done(future):
+        try:
+            value, events = future.result()
+        except BaseException as exp:
+            result.set_exception(exp)
+            return
+        for event in events:
+            context.run(emit, *event)
+        result.set_result(value)
+
+    executor.submit(collect, function, *args, **kwargs).add_done_callback(
+        done
+    )
+    return result
+
+
+def response_size(data: list) -> int:
+    """Get size of IMAP response data (lines and literals), bytes."""
+    size = 0
+    for item in data or ():
+        if isinstance(item, tuple):
+            size += sum(len(part) for part in item)
+        elif isinstance(item, bytes):
+            size += len(item)
+    return size
+
+
+class Counters:
+    """Hook which counts calls, seconds and bytes of each stage. Inside
+    a with block it counts the stages of the current thread (or asyncio
+    task) and of the worker threads and processes started by it, so it can
+    measure one call. It can also be added for all calls with add_hook.
+
+    Example:
+        with Counters() as counters:
+            read_email(...)
+        counters['imap.fetch']  # {'count': 2, 'seconds': 0.31, 'bytes': ...}
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._token = None
+        self._lock = threading.Lock()
+
+    def __call__(self, stage: str, seconds: float, size: int = None):
+        with self._lock:
+            counter = self.stages.setdefault(
+                stage, {'count': 0, 'seconds': 0.0, 'bytes': 0}
+            )
+            counter['count'] += 1
+            counter['seconds'] += seconds
+            counter['bytes'] += size or 0
+
+    def __getitem__(self, stage: str) -> dict:
+        return self.stages[stage]
+
+    def __contains__(self, stage: str) -> bool:
+        return stage in self.stages
+
+    def __enter__(self):
+        self._token = _scoped.set((*_scoped.get(), self))
+        return self
+
+    def __exit__(self, *args):
+        _scoped.reset(self._token)
+        self._token = None
+
+
+def imap_client() -> type:
+    """Create IMAPClient class: imaplib.IMAP4_SSL which reports durations
+    of connect, TLS handshake, login, select and UID commands to the hooks.
+    """
+    import imaplib
+
+    class IMAPClient(imaplib.IMAP4_SSL):
+        """imaplib.IMAP4_SSL which reports stage durations to the hooks."""
+
+        def _create_socket(self, timeout):
+            started = timer()
+            sock = imaplib.IMAP4._create_socket(self, timeout)
+            report('imap.connect', started)
+            started = timer()
+            sock = self.ssl_context.wrap_socket(
+                sock, server_hostname=self.host
+            )
+            report('imap.tls', started)
+            return sock
+
+        def login(self, user: str, password: str):
+            started = timer()
+            result = super().login(user, password)
+            report('imap.login', started)
+            return result
+
+        def select(self, mailbox: str = 'INBOX', readonly: bool = False):
+            started = timer()
+            result = super().select(mailbox, readonly)
+            report('imap.select', started)
+            return result
+
+        def fetch(self, message_set, message_parts):
+            started = timer()
+            result = super().fetch(message_set, message_parts)
+            if started is not None:
+                report('imap.fetch', started, response_size(result[1]))
+            return result
+
+        def uid(self, command: str, *args):
+            started = timer()
+            result = super().uid(command, *args)
+            if started is not None:
+                size = response_size(result[1])
+                report(f'imap.{command.lower()}', started, size)
+            return result
+
+    return IMAPClient
+
+
+def smtp_client() -> type:
+    """Create SMTPClient class: smtplib.SMTP_SSL which reports durations of
+    connect, TLS handshake, login and DATA to the hooks.
+    """
+    import smtplib
+
+    class SMTPClient(smtplib.SMTP_SSL):
+        """smtplib.SMTP_SSL which reports stage durations to the hooks."""
+
+        def _get_socket(self, host, port, timeout):
+            started = timer()
+            sock = smtplib.SMTP._get_socket(self, host, port, timeout)
+            report('smtp.connect', started)
+            started = timer()
+            sock = self.context.wrap_socket(sock, server_hostname=self._host)
+            report('smtp.tls', started)
+            return sock
+
+        def login(self, user: str, password: str, **kwargs):
+            started = timer()
+            result = super().login(user, password, **kwargs)
+            report('smtp.login', started)
+            return result
+
+        def data(self, msg):
+            started = timer()
+            result = super().data(msg)
+            report('smtp.data', started, len(msg))
+            return result
+
+    return SMTPClient
+
+
+# Client classes are created on the first import, so sending does not load
+# imaplib and reading does not load smtplib
+_CLIENTS = {'IMAPClient': imap_client, 'SMTPClient': smtp_client}
+
+
+def __getattr__(name: str):
+    factory = _CLIENTS.get(name)
+    if factory is None:
+        raise AttributeError(
+            f"module {__name__!r} has no attribute {name!r}"
+        )
+    value = globals()[name] = factory()
+    return value
@@ -0,0 +1,402 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import imaplib
+import logging
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING, Iterable
+
+from .metrics import IMAPClient, submit
+from .types import Email
+from .utils import get_server
+
+if TYPE_CHECKING:
+    from .send import Mailer
+
+
+class MailerPool:
+    """Pool of authenticated SMTP sessions of one account. Messages are put
+    into one dispatch queue and sent concurrently by worker threads, each
+    worker borrows a free session from the pool.
+
+    email                  sender email address;
+    password               email app password;
+    domain                 domain of the email service.
+                           If None, will be received from email;
+    host                   SMTP-server host;
+    port                   SMTP-server port;
+    connections            number of SMTP connections. Default: 4;
+    connection_messages    number of messages sent through one connection
+                           before it is reopened. Default: no limit;
+    max_pending            number of messages which are queued or being
+                           sent at once. Default: 10 * connections.
+
+    Example:
+        with MailerPool(email, password, connections=8) as pool:
+            results = pool.send_emails(messages)
+    """
+
+    def __init__(
+        self,
+        email: str,
+        password: str,
+        domain: str = None,
+        host: str = None,
+        port: int = None,
+        connections: int = 4,
+        connection_messages: int = None,
+        max_pending: int = None
+    ):
+        # Check parameters
+        params = Email(email=email, password=password, domain=domain)
+        if host is None and port is None:
+            # Receiving the server host and port
+            host, port = get_server(domain=params.domain, server='smtp')
+        self.params = params
+        self.host = host
+        self.port = port
+        self.connections = connections
+        self.connection_messages = connection_messages
+        self._mailers = []
+        self._free = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._pending = threading.BoundedSemaphore(
+            max_pending or 10 * connections
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=connections, thread_name_prefix='smtp'
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _acquire(self) -> 'Mailer':
+        """Take a free session or create a new one."""
+        # Imported here, so reading through IMAPPool does not load send
+        from .send import Mailer
+
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._mailers) < self.connections:
+                mailer = Mailer(
+                    email=self.params.email,
+                    password=self.params.password,
+                    domain=self.params.domain,
+                    host=self.host,
+                    port=self.port
+                )
+                self._mailers.append(mailer)
+                return mailer
+        return self._free.get()
+
+    def _release(self, mailer: 'Mailer'):
+        """Return the session to the pool."""
+        logger = logging.getLogger(__name__)
+        limit = self.connection_messages
+        if limit and mailer.sent >= limit:
+            logger.debug('SMTP connection message limit reached')
+            mailer.close()
+        self._free.put(mailer)
+
+    def _send(self, message: dict) -> dict:
+        mailer = self._acquire()
+        try:
+            return mailer.try_send_email(message)
+        finally:
+            self._release(mailer)
+
+    def submit(self, message: dict) -> Future:
+        """Put a message into the dispatch queue. Blocks while the number
+        of pending messages is at the max_pending limit.
+
+        message    dictionary with send_email parameters;
+
+        return     concurrent.futures.Future object with the result dict.
+        """
+        self._pending.acquire()
+        try:
+            future = submit(self._executor, self._send, message)
+        except Exception:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        return future
+
+    def send_emails(self, messages: Iterable[dict]) -> list[dict]:
+        """Send many email messages concurrently.
+
+        messages    iterable of dictionaries with send_email parameters;
+
+        return      list[dict] with recievers, sent flag and error
+                    for each message in the order of messages.
+        """
+        futures = [self.submit(message) for message in messages]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """Wait for the queued messages and close all connections."""
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for mailer in self._mailers:
+                mailer.close()
+            self._mailers = []
+
+
+def send_emails_pooled(
+    email: str,
+    password: str,
+    messages: Iterable[dict],
+    domain: str = None,
+    host: str = None,
+    port: int = None,
+    connections: int = 4,
+    connection_messages: int = None
+) -> list[dict]:
+    """Send many email messages concurrently through several SMTP
+    connections.
+
+    email                  sender email address;
+    password               email app password;
+    messages               iterable of dictionaries with send_email
+                           parameters;
+    domain                 domain of the email service.
+                           If None, will be received from email;
+
+    Additional parameters:
+    host                   SMTP-server host;
+    port                   SMTP-server port;
+    connections            number of SMTP connections. Default: 4;
+    connection_messages    number of messages sent through one connection
+                           before it is reopened.
+
+    return                 list[dict] with recievers, sent flag and error
+                           for each message.
+    """
+    with MailerPool(
+        email=email,
+        password=password,
+        domain=domain,
+        host=host,
+        port=port,
+        connections=connections,
+        connection_messages=connection_messages
+    ) as pool:
+        return pool.send_emails(messages)
+
+
+class IMAPSession(IMAPClient):
+    """IMAP session of IMAPPool. Keeps the selected mailbox, its
+    UIDVALIDITY and the time when the session was returned to the pool.
+
+    host    IMAP-server host;
+    port    IMAP-server port;
+    key     pool key of the session: email, host and port.
+    """
+
+    def __init__(self, host: str, port: int, key: tuple = None):
+        super().__init__(host, port)
+        self.key = key
+        self.mailbox = None
+        self.uidvalidity = None
+        self.released = time.monotonic()
+
+    def select(self, mailbox: str = 'INBOX', readonly: bool = False):
+        result = super().select(mailbox, readonly)
+        # UIDVALIDITY response is read without taking it, so it is still
+        # available with response method
+        data = self.untagged_responses.get('UIDVALIDITY')
+        self.uidvalidity = int(data[-1].split()[0]) if data else None
+        self.mailbox = mailbox
+        return result
+
+
+class IMAPPool:
+    """Pool of authenticated IMAP sessions, keyed by account, host and
+    port. Borrowed sessions are logged in and have the mailbox selected;
+    a returned session is checked with NOOP before it is borrowed again,
+    a broken one is replaced with a new login. Sessions which are not used
+    for ttl seconds are logged out.
+
+    ttl            seconds an unused session is kept open. Default: 300;
+    max_idle       number of unused sessions kept for each key. Default: 4.
+
+    Example:
+        pool = IMAPPool()
+        mails = read_email(email, password, pool=pool)
+        with pool.session(email, password, host, port) as server:
+            mails = get_emails(server, criteria='UNSEEN')
+        pool.close()
+    """
+
+    def __init__(self, ttl: float = 300, max_idle: int = 4):
+        self.ttl = ttl
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(sessions) for sessions in self._idle.values())
+
+    def _open(
+        self, email: str, password: str, host: str, port: int, mailbox: str
+    ) -> IMAPSession:
+        """Open a new session, log in and select the mailbox."""
+        logger = logging.getLogger(__name__)
+        server = IMAPSession(host, port, key=(email, host, port))
+        try:
+            server.login(email, password)
+            server.select(mailbox)
+        except Exception:
+            self._logout(server)
+            raise
+        self.opened += 1
+        logger.debug('IMAP session started')
+        return server
+
+    @staticmethod
+    def _logout(server: IMAPSession):
+        try:
+            server.logout()
+        except (OSError, imaplib.IMAP4.error):
+            pass
+
+    def _evict(self) -> list[IMAPSession]:
+        """Take sessions which are not used for ttl seconds out of the
+        pool. Called with the lock held.
+        """
+        expired = []
+        deadline = time.monotonic() - self.ttl
+        for key, sessions in list(self._idle.items()):
+            expired += [s for s in sessions if s.released <= deadline]
+            sessions[:] = [s for s in sessions if s.released > deadline]
+            if not sessions:
+                del self._idle[key]
+        return expired
+
+    def acquire(
+        self,
+        email: str,
+        password: str,
+        host: str,
+        port: int,
+        mailbox: str = 'INBOX'
+    ) -> IMAPSession:
+        """Borrow a session of the account with the mailbox selected.
+
+        email       email address;
+        password    email app password;
+        host        IMAP-server host;
+        port        IMAP-server port;
+        mailbox     mailbox which is selected. Default: INBOX;
+
+        return      IMAPSession object.
+        """
+        logger = logging.getLogger(__name__)
+        key = (email, host, port)
+        while True:
+            with self._lock:
+                expired = self._evict()
+                sessions = self._idle.get(key)
+                server = sessions.pop() if sessions else None
+            for session in expired:
+                self._logout(session)
+            if server is None:
+                return self._open(email, password, host, port, mailbox)
+            try:
+                if server.mailbox == mailbox:
+                    # Health check, also reports changes of the mailbox
+                    server.noop()
+                else:
+                    server.select(mailbox)
+            except (OSError, imaplib.IMAP4.error) as exp:
+                # The connection is broken, try the next session or log in
+                # again
+                logger.debug('IMAP session is dropped: %s', exp)
+                self._logout(server)
+                continue
+            self.reused += 1
+            return server
+
+    def release(self, server: IMAPSession, broken: bool = False):
+        """Return the session to the pool.
+
+        server    IMAPSession object;
+        broken    the session is in unknown state and is logged out.
+        """
+        if broken or server.state != 'SELECTED':
+            self.discard(server)
+            return
+        # Responses of the previous user are not passed to the next one
+        server.untagged_responses.clear()
+        server.released = time.monotonic()
+        with self._lock:
+            sessions = self._idle.setdefault(server.key, [])
+            if len(sessions) < self.max_idle:
+                sessions.append(server)
+                server = None
+        if server is not None:
+            self._logout(server)
+
+    def discard(self, server: IMAPSession):
+        """Log out of a borrowed session instead of returning it."""
+        self._logout(server)
+
+    def session(
+        self,
+        email: str,
+        password: str,
+        host: str,
+        port: int,
+        mailbox: str = 'INBOX'
+    ) -> 'PooledSession':
+        """Borrow a session for a with block. Parameters are the same as in
+        acquire method. The session is returned to the pool at the end of
+        the block, or logged out if the block raised an exception.
+
+        return    PooledSession context manager.
+        """
+        return PooledSession(self, email, password, host, port, mailbox)
+
+    def close(self):
+        """Log out of all unused sessions."""
+        logger = logging.getLogger(__name__)
+        with self._lock:
+            sessions = [s for idle in self._idle.values() for s in idle]
+            self._idle = {}
+        for server in sessions:
+            self._logout(server)
+        logger.debug('IMAP sessions ended')
+
+
+class PooledSession:
+    """Context manager which borrows a session from IMAPPool."""
+
+    def __init__(self, pool: IMAPPool, *args):
+        self.pool = pool
+        self.args = args
+        self.server = None
+
+    def __enter__(self) -> IMAPSession:
+        self.server = self.pool.acquire(*self.args)
+        return self.server
+
+    def __exit__(self, exc_type, *args):
+        # A generator closed early leaves the session in a known state
+        broken = exc_type is not None and exc_type is not GeneratorExit
+        self.pool.release(self.server, broken=broken)
+        self.server = None
@@ -1,17 +1,42 @@
 import base64
+from concurrent.futures import Executor
+import contextvars
 import email
 from email.header import decode_header, make_header
 from datetime import datetime
+from functools import cache
 import imaplib
 import logging
 import os
 from pathlib import Path
+import queue
 import quopri
+import re
+import threading
+from typing import TYPE_CHECKING, Iterator
 
-from bs4 import BeautifulSoup
-
+from .attachments import save_attachment
+from .cache import MailboxCache, MessageCache
+from .metrics import IMAPClient, report, submit, timer
+from .search import MailboxIndex, SearchIndex
+from .store import AttachmentStore
+from .text import html_to_text
 from .types import ReadEmailParams
-from .utils import get_server, build_filepath
+from .utils import get_server
+
+if TYPE_CHECKING:
+    from .pool import IMAPPool
+
+
+HEADER_FIELDS = ('SUBJECT', 'FROM', 'DATE')
+LITERAL = re.compile(rb'\{\d+\}$')
+# Characters removed or replaced in email text
+TEXT_TABLE = str.maketrans({'<': None, '>': None, '\xa0': ' '})
+QUOTED_CHAR = re.compile(rb'\\(.)')
+TOKEN = re.compile(
+    rb'(\()|(\))|"((?:[^"\\]|\\.)*)"'
+    rb'|([^\s()"\[]+(?:\[[^\]]*\](?:<[\d.]+>)?)?)'
+)
 
 
 def get_header(message_header: str):
@@ -51,20 +76,66 @@ def get_headers(message: email.message.Message):
     return subject, From, date
 
 
-def get_html_text(body: str):
+@cache
+def load_beautiful_soup():
+    """Import bs4 on the first call: it takes longer to import than the rest
+    of the package and is only used by the 'bs4' engine.
+
+    return    bs4.BeautifulSoup class or None if bs4 is not installed.
+    """
+    try:
+        from bs4 import BeautifulSoup
+    except ImportError:
+        return None
+    return BeautifulSoup
+
+
+def get_html_text(body: str, engine: str = 'fast'):
     """Get email HTML body text.
 
     body      email HTML body;
+    engine    'fast' - one pass html_to_text extractor (default),
+              'bs4' - BeautifulSoup, if installed. It is also used
+              if the fast extractor fails;
 
     return    str.
     """
     logger = logging.getLogger(__name__)
+    started = timer()
+    if engine == 'fast':
+        try:
+            text = html_to_text(body)
+            report('html_to_text', started, len(body))
+            return text
+        except Exception as exp:
+            logger.warning('Fast text extraction failed: %s', exp)
+    BeautifulSoup = load_beautiful_soup()
+    if BeautifulSoup is None:
+        logger.error('Text from HTML is not received: bs4 is not installed')
+        return ''
     try:
         soup = BeautifulSoup(body, 'html.parser')
-        return soup.get_text().replace('\xa0', ' ')
-    except (Exception) as exp:
-        logger.error('text from html err:', exp)
-        return False
+        text = soup.get_text().replace('\xa0', ' ')
+        report('html_to_text', started, len(body))
+        return text
+    except Exception as exp:
+        logger.error('Text from HTML is not received: %s', exp)
+        return ''
+
+
+def decode_payload(data: bytes, charset: str = None) -> str:
+    """Decode text payload. A missing or unknown charset is replaced with
+    utf-8, bytes which can not be decoded are replaced with U+FFFD.
+
+    data       payload bytes;
+    charset    charset of the part;
+
+    return     str.
+    """
+    try:
+        return data.decode(charset or 'utf-8', 'replace')
+    except LookupError:
+        return data.decode('utf-8', 'replace')
 
 
 def decode_text(message: email.message.Message):
@@ -79,11 +150,15 @@ def decode_text(message: email.message.Message):
     ):
         return message.get_payload()
     elif message['Content-Transfer-Encoding'] == 'base64':
-        encoding = message.get_content_charset()
-        return base64.b64decode(message.get_payload()).decode(encoding)
+        return decode_payload(
+            base64.b64decode(message.get_payload()),
+            message.get_content_charset()
+        )
     elif message['Content-Transfer-Encoding'] == 'quoted-printable':
-        encoding = message.get_content_charset()
-        return quopri.decodestring(message.get_payload()).decode(encoding)
+        return decode_payload(
+            quopri.decodestring(message.get_payload()),
+            message.get_content_charset()
+        )
     else:
         # all possible types: quoted-printable, base64, 7bit, 8bit, and binary
         return message.get_payload()
@@ -101,45 +176,113 @@ def get_text(message: email.message.Message):
         text = get_html_text(extract_part)
     else:
         text = extract_part.rstrip().lstrip()
-    return text.replace('<', '').replace('>', '').replace('\xa0', ' ')
+    return text.translate(TEXT_TABLE)
 
 
 def get_attachment(
     message: email.message.Message,
     with_payload: bool = False,
-    folder: Path = None
+    folder: Path = None,
+    store: AttachmentStore = None
 ):
-    """Get email attachment files as a dictionary with name, path, payload.
+    """Get email attachment files as a dictionary with name, path, file,
+    payload. The file is decoded into the folder chunk by chunk, file key
+    is AttachmentFile object with path, size, sha256 and open method.
+    Payload is decoded into memory only if with_payload is set.
 
     message         email.message.Message object;
     with_payload    add payload to the attached files;
     folder          folder path where attached files are saved;
+    store           AttachmentStore object which keeps saved files
+                    without duplicates;
 
     return          dict.
     """
     logger = logging.getLogger(__name__)
     filename = message.get_filename()
-    payload = message.get_payload(decode=True)
     if filename:
         result = {'name': filename}
         if folder:
-            filepath = build_filepath(os.path.join(folder, filename))
-            # Save file
-            open(filepath, "wb").write(payload)
-            logger.info(f"Attached file '{filename}' saved")
-            result.update({'path': filepath})
+            started = timer()
+            if store is not None:
+                file = store.save(message, folder, filename)
+            else:
+                file = save_attachment(message, folder, filename)
+            report('attachment', started, file.size)
+            logger.info("Attached file '%s' saved", filename)
+            result.update({'path': file.path, 'file': file})
         if with_payload:
-            result.update({'payload': payload})
+            result.update({'payload': message.get_payload(decode=True)})
         return result
 
 
+def parse_email(
+    data: bytes,
+    num: bytes = None,
+    id_key: str = None,
+    with_payload: bool = False,
+    folder: Path = None,
+    store: AttachmentStore = None
+):
+    """Parse raw email as a dictinary with subject, from, date, body,
+    attachments keys.
+
+    data            raw email (RFC822);
+    num             email number, used in logs;
+    id_key          email ID key. Example: "Message-ID" - for Yandex;
+    with_payload    add payload for attached files;
+    folder          folder path where attached files are saved;
+    store           AttachmentStore object which keeps saved files
+                    without duplicates;
+
+    return          dict.
+    """
+    logger = logging.getLogger(__name__)
+    started = timer()
+    message = email.message_from_bytes(data)
+    subject, From, date = get_headers(message)
+    msg = {} if id_key is None else {'id': str(message.get(id_key))}
+    msg = msg | {'subject': subject, 'from': From, 'date': date}
+    logger.debug('Email %s object received', num)
+    if message.is_multipart():
+        logger.info("Email '%s' is multipart", num)
+        # count = 0
+        for part in message.walk():
+            if part.get_content_maintype() == 'text':  # and count==0:
+                text = get_text(part)
+                msg['body'] = text
+                logger.debug('Email text received')
+                # count += 1
+            if 'attachment' in str(part.get('Content-Disposition')):
+                file = get_attachment(
+                    message=part,
+                    with_payload=with_payload,
+                    folder=folder,
+                    store=store
+                )
+                if msg.get('attachments', None):
+                    msg['attachments'].append(file)
+                else:
+                    msg['attachments'] = [file]
+    else:
+        # Email containes only text
+        if message.get_content_maintype() == 'text':
+            logger.info("Email '%s' contains only text", num)
+            text = get_text(message)
+            msg['body'] = text
+            logger.debug('Email text received')
+    report('parse', started, len(data))
+    return msg
+
+
 def get_email(
     server: imaplib.IMAP4_SSL,
     num: bytes,
     id_key: str = None,
     seen: bool = True,
     with_payload: bool = False,
-    folder: Path = None
+    folder: Path = None,
+    store: AttachmentStore = None
 ):
     """Get email as a dictinary with subject, from, date, body, attachments
     keys.
@@ -147,69 +290,710 @@ def get_email(
     server          imaplib.IMAP4_SSL object;
     num             email number;
     id_key          email ID key. Example: "Message-ID" - for Yandex;
-    seen            mark the email as "read." Default: True;
+    seen            mark the email as "read" (True) or "unread" (False).
+                    If None, the email is fetched with BODY.PEEK[] and
+                    its flags are not changed. Default: True;
     with_payload    add payload for attached files;
     folder          folder path where attached files are saved;
+    store           AttachmentStore object which keeps saved files
+                    without duplicates;
 
     return          dict.
     """
-    logger = logging.getLogger(__name__)
-    result, data = server.fetch(num, '(RFC822)')
+    result, data = server.fetch(
+        num, '(BODY.PEEK[])' if seen is None else '(RFC822)'
+    )
     for response in data:
         if isinstance(response, tuple):
-            message = email.message_from_bytes(response[1])
-            subject, From, date = get_headers(message)
-            msg = {} if id_key is None else {'id': str(message.get(id_key))}
-            msg = msg | {'subject': subject, 'from': From, 'date': date}
-            logger.debug(f"Email {num} object received")
-            if message.is_multipart():
-                logger.info(f"Email '{num}' is multipart")
-                # count = 0
-                for part in message.walk():
-                    if part.get_content_maintype() == 'text':  # and count==0:
-                        text = get_text(part)
-                        msg['body'] = text
-                        logger.debug('Email text received')
-                        # count += 1
-                    if 'attachment' in str(part.get('Content-Disposition')):
-                        file = get_attachment(
-                            message=part,
-                            with_payload=with_payload,
-                            folder=folder
-                        )
-                        if msg.get('attachments', None):
-                            msg['attachments'].append(file)
-                        else:
-                            msg['attachments'] = [file]
+            msg = parse_email(
+                data=response[1],
+                num=num,
+                id_key=id_key,
+                with_payload=with_payload,
+                folder=folder,
+                store=store
+            )
+    if seen is not None:
+        store_seen(server, num, seen, uid=False)
+    return msg
+
+
+def message_set(uids: list[bytes]) -> str:
+    """Build compact IMAP message set from sorted email UIDs.
+    Example: [1, 2, 3, 5] - '1:3,5'.
+
+    uids      email UIDs;
+
+    return    str.
+    """
+    ranges = []
+    for uid in map(int, uids):
+        if ranges and ranges[-1][1] == uid - 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(
+        str(start) if start == end else f'{start}:{end}'
+        for start, end in ranges
+    )
+
+
+def parse_fetch(data: list) -> dict:
+    """Parse the response of UID FETCH command.
+
+    data      response data of imaplib.IMAP4.uid('fetch', ...);
+
+    return    dict with email UIDs (bytes) and dictionaries of fetched items.
+              Example: {b'12': {'UID': b'12', 'RFC822': b'...'}}.
+    """
+    messages = {}
+    segments = []
+    for response in data:
+        if isinstance(response, tuple):
+            segments.append(LITERAL.sub(b'', response[0]))
+            segments.append(Literal(response[1]))
+            continue
+        if response is not None:
+            segments.append(response)
+        if not segments:
+            continue
+        tokens = parse_list(segments)
+        segments = []
+        if len(tokens) < 2 or not isinstance(tokens[1], list):
+            continue
+        items = tokens[1]
+        items = {
+            bytes(key).decode().upper(): value
+            for key, value in zip(items[::2], items[1::2])
+        }
+        if 'UID' in items:
+            messages[bytes(items['UID'])] = items
+    return messages
+
+
+def fetch_messages(data: list) -> dict:
+    """Get raw emails from the response of UID FETCH command.
+
+    data      response data of imaplib.IMAP4.uid('fetch', ...);
+
+    return    dict with email UIDs (bytes) and raw emails, the same bytes
+              objects as in the response data.
+    """
+    messages = {}
+    for uid, items in parse_fetch(data).items():
+        raw = items.get('RFC822', items.get('BODY[]'))
+        if raw is not None:
+            messages[uid] = raw
+    return messages
+
+
+class Literal:
+    """IMAP literal string of FETCH response. It keeps the bytes object
+    of imaplib instead of copying it, so a large email is not copied
+    while it is parsed.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value: bytes):
+        self.value = value
+
+
+def parse_list(segments: list) -> list:
+    """Parse IMAP response with parenthesized lists into nested lists.
+    Strings are returned as bytes, NIL as None.
+
+    segments    response lines (bytes) and literals (Literal);
+
+    return      list.
+    """
+    stack = [[]]
+    for segment in segments:
+        if isinstance(segment, Literal):
+            stack[-1].append(segment.value)
+            continue
+        for match in TOKEN.finditer(segment):
+            opening, closing, quoted, atom = match.groups()
+            if opening:
+                stack[-1].append([])
+                stack.append(stack[-1][-1])
+            elif closing:
+                if len(stack) > 1:
+                    stack.pop()
+            elif quoted is not None:
+                stack[-1].append(QUOTED_CHAR.sub(rb'\1', quoted))
             else:
-                # Email containes only text
-                if message.get_content_maintype() == 'text':
-                    logger.info(f"Email '{num}' contains only text")
-                    text = get_text(message)
-                    msg['body'] = text
-                    logger.debug('Email text received')
-    if seen:
-        server.store(num, '+FLAGS', '\\Seen')
-        logger.info(f"Email '{num}' marked as 'unseen'")
+                stack[-1].append(None if atom.upper() == b'NIL' else atom)
+    return stack[0]
+
+
+def get_string(value) -> str:
+    return '' if value is None else bytes(value).decode('utf-8', 'replace')
+
+
+def get_params(values) -> dict:
+    """Get parameters of BODYSTRUCTURE list as a dictionary."""
+    if not isinstance(values, list):
+        return {}
+    return {
+        get_string(key).lower(): get_string(value)
+        for key, value in zip(values[::2], values[1::2])
+    }
+
+
+def walk_structure(structure: list, section: str = '') -> Iterator[dict]:
+    """Generate body parts of BODYSTRUCTURE with section number, content
+    type, charset, encoding, size, disposition and filename.
+
+    structure    parsed BODYSTRUCTURE list;
+    section      section number of the structure;
+
+    return       generator of dictionaries.
+    """
+    if structure and isinstance(structure[0], list):
+        # Multipart: body parts are followed by the subtype
+        parts = []
+        for item in structure:
+            if not isinstance(item, list):
+                break
+            parts.append(item)
+        for num, part in enumerate(parts, 1):
+            yield from walk_structure(
+                part, f'{section}.{num}' if section else str(num)
+            )
+        return
+    maintype = get_string(structure[0]).lower()
+    subtype = get_string(structure[1]).lower()
+    params = get_params(structure[2])
+    # Disposition follows the type-specific fields
+    if maintype == 'text':
+        index = 9
+    elif (maintype, subtype) == ('message', 'rfc822'):
+        index = 11
     else:
-        server.store(num, '-FLAGS', '\\Seen')
-        logger.info(f"Email '{num}' marked as 'unseen'")
-    return msg
+        index = 8
+    disposition = structure[index] if len(structure) > index else None
+    if isinstance(disposition, list) and disposition:
+        disposition_type = get_string(disposition[0]).lower()
+        disposition_params = get_params(
+            disposition[1] if len(disposition) > 1 else None
+        )
+    else:
+        disposition_type, disposition_params = None, {}
+    filename = None
+    for name_params, name in (
+        (disposition_params, 'filename'), (params, 'name')
+    ):
+        if name + '*' in name_params:
+            filename = email.utils.collapse_rfc2231_value(
+                email.utils.decode_rfc2231(name_params[name + '*'])
+            )
+            break
+        if name in name_params:
+            filename = get_header(name_params[name])
+            break
+    yield {
+        'section': section or '1',
+        'type': f'{maintype}/{subtype}',
+        'charset': params.get('charset'),
+        'encoding': get_string(structure[5]).lower() or '7bit',
+        'size': int(structure[6] or 0),
+        'disposition': disposition_type,
+        'filename': filename
+    }
 
 
-def get_emails(
+def get_part_text(part: dict, body: bytes) -> str:
+    """Get text of the body part fetched by section number.
+
+    part      body part of walk_structure;
+    body      fetched body part;
+
+    return    str.
+    """
+    charset = part['charset'] or 'utf-8'
+    message = email.message.Message()
+    message['Content-Type'] = part['type']
+    message.set_param('charset', charset)
+    message['Content-Transfer-Encoding'] = part['encoding']
+    if part['encoding'] in ('base64', 'quoted-printable'):
+        message.set_payload(body.decode('ascii', 'replace'))
+    else:
+        message.set_payload(decode_payload(body, charset))
+    return get_text(message)
+
+
+def header_fields(id_key: str = None) -> str:
+    """Build BODY.PEEK[HEADER.FIELDS (...)] fetch item."""
+    fields = HEADER_FIELDS + ((id_key.upper(),) if id_key else ())
+    return f'BODY.PEEK[HEADER.FIELDS ({" ".join(fields)})]'
+
+
+def get_item(items: dict, prefix: str):
+    """Get fetched item by the beginning of its name."""
+    for key, value in items.items():
+        if key.startswith(prefix):
+            return value
+
+
+def parse_headers(uid: bytes, data: bytes, id_key: str = None) -> dict:
+    """Parse email header fields as a dictinary with uid, subject, from,
+    date keys.
+    """
+    message = email.message_from_bytes(data or b'')
+    subject, From, date = get_headers(message)
+    msg = {'uid': uid.decode()}
+    if id_key is not None:
+        msg['id'] = str(message.get(id_key))
+    return msg | {'subject': subject, 'from': From, 'date': date}
+
+
+def fetch_full(
+    server: imaplib.IMAP4_SSL,
+    uids: list[bytes],
+    id_key: str = None,
+    with_payload: bool = False,
+    folder: Path = None,
+    store: AttachmentStore = None,
+    index: MailboxIndex = None
+) -> list[dict]:
+    """Fetch whole emails with one UID FETCH command. BODY.PEEK[] is used,
+    so fetching does not mark the emails as "read".
+
+    return    list[dict] with uid key in the order of uids.
+    """
+    return parse_emails(
+        messages=fetch_raw(server, uids),
+        id_key=id_key,
+        with_payload=with_payload,
+        folder=folder,
+        store=store,
+        index=index
+    )
+
+
+def fetch_raw(
+    server: imaplib.IMAP4_SSL,
+    uids: list[bytes]
+) -> list[tuple[bytes, bytes]]:
+    """Fetch raw emails (RFC822) with one UID FETCH command without
+    marking them as "read".
+
+    return    list of (uid, data) tuples in the order of uids.
+    """
+    status, data = server.uid(
+        'fetch', message_set(uids), '(UID BODY.PEEK[])'
+    )
+    messages = fetch_messages(data)
+    return [(uid, messages[uid]) for uid in uids if uid in messages]
+
+
+def parse_emails(
+    messages: list[tuple[bytes, bytes]],
+    id_key: str = None,
+    with_payload: bool = False,
+    folder: Path = None,
+    store: AttachmentStore = None,
+    index: MailboxIndex = None
+) -> list[dict]:
+    """Parse raw emails fetched with fetch_raw. The function can be run
+    in a separate process. Emails have uid key, as in 'headers' and 'text'
+    modes.
+
+    messages        list of (uid, data) tuples;
+    id_key          email ID key. Example: "Message-ID" - for Yandex;
+    with_payload    add payload for attached files;
+    folder          folder path where attached files are saved;
+    store           AttachmentStore object which keeps saved files
+                    without duplicates;
+    index           MailboxIndex object which is fed with read emails;
+
+    return          list[dict].
+    """
+    emails = [
+        {'uid': uid.decode()} | parse_email(
+            data=data,
+            num=uid,
+            id_key=id_key,
+            with_payload=with_payload,
+            folder=folder,
+            store=store
+        )
+        for uid, data in messages
+    ]
+    if index is not None:
+        index.add([(uid, msg) for (uid, data), msg in zip(messages, emails)])
+    return emails
+
+
+def fetch_headers(
+    server: imaplib.IMAP4_SSL,
+    uids: list[bytes],
+    id_key: str = None
+) -> list[dict]:
+    """Fetch only subject, from, date (and id_key) header fields of emails
+    with one UID FETCH command.
+
+    return    list[dict] with uid, subject, from, date keys in the order
+              of uids.
+    """
+    status, data = server.uid(
+        'fetch', message_set(uids), f'(UID {header_fields(id_key)})'
+    )
+    messages = parse_fetch(data)
+    return [
+        parse_headers(uid, get_item(messages[uid], 'BODY[HEADER'), id_key)
+        for uid in uids if uid in messages
+    ]
+
+
+def fetch_text(
+    server: imaplib.IMAP4_SSL,
+    uids: list[bytes],
+    id_key: str = None
+) -> list[dict]:
+    """Fetch header fields and text parts of emails without attachments.
+    BODYSTRUCTURE is fetched first, then the text parts of emails with the
+    same structure are fetched with one UID FETCH command.
+
+    return    list[dict] with uid, subject, from, date, body, attachments
+              keys in the order of uids. Attachments contain name, part
+              and size (encoded size) keys, payload can be fetched with
+              fetch_attachment.
+    """
+    status, data = server.uid(
+        'fetch',
+        message_set(uids),
+        f'(UID BODYSTRUCTURE {header_fields(id_key)})'
+    )
+    structures = parse_fetch(data)
+    emails = {}
+    groups = {}
+    for uid in uids:
+        if uid not in structures:
+            continue
+        items = structures[uid]
+        msg = parse_headers(uid, get_item(items, 'BODY[HEADER'), id_key)
+        text_parts = []
+        for part in walk_structure(items.get('BODYSTRUCTURE') or []):
+            if part['disposition'] == 'attachment' or (
+                part['filename'] and not part['type'].startswith('text/')
+            ):
+                msg.setdefault('attachments', []).append({
+                    'name': part['filename'],
+                    'part': part['section'],
+                    'size': part['size']
+                })
+            elif part['type'].startswith('text/'):
+                text_parts.append(part)
+        emails[uid] = (msg, text_parts)
+        sections = tuple(part['section'] for part in text_parts)
+        if sections:
+            groups.setdefault(sections, []).append(uid)
+    for sections, group in groups.items():
+        items = ' '.join(f'BODY.PEEK[{section}]' for section in sections)
+        status, data = server.uid(
+            'fetch', message_set(group), f'(UID {items})'
+        )
+        bodies = parse_fetch(data)
+        for uid in group:
+            msg, text_parts = emails[uid]
+            for part in text_parts:
+                body = bodies.get(uid, {}).get(f'BODY[{part["section"]}]')
+                if body is not None:
+                    msg['body'] = get_part_text(part, bytes(body))
+    return [emails[uid][0] for uid in uids if uid in emails]
+
+
+def fetch_attachment(
+    server: imaplib.IMAP4_SSL,
+    uid: str,
+    part: str
+) -> bytes:
+    """Fetch decoded payload of one attached file. The email is not marked
+    as "read".
+
+    server    imaplib.IMAP4_SSL object;
+    uid       email UID;
+    part      section number of the attachment (from 'part' key);
+
+    return    bytes.
+    """
+    status, data = server.uid(
+        'fetch', str(uid), f'(UID BODY.PEEK[{part}.MIME] BODY.PEEK[{part}])'
+    )
+    items = parse_fetch(data).get(str(uid).encode(), {})
+    message = email.message_from_bytes(
+        bytes(items.get(f'BODY[{part}.MIME]') or b'')
+        + bytes(items.get(f'BODY[{part}]') or b'')
+    )
+    return message.get_payload(decode=True)
+
+
+def get_response_number(server: imaplib.IMAP4_SSL, code: str):
+    """Get number of the untagged response (UIDVALIDITY, UIDNEXT, etc.)."""
+    typ, data = server.response(code)
+    if data and data[-1] is not None:
+        return int(data[-1].split()[0])
+
+
+def search_new(server: imaplib.IMAP4_SSL, last_uid: int = 0) -> list[bytes]:
+    """Search UIDs of emails which have arrived after the email with
+    last_uid.
+
+    server      imaplib.IMAP4_SSL object;
+    last_uid    UID of the last known email;
+
+    return      list[bytes].
+    """
+    status, data = server.uid('search', None, f'UID {last_uid + 1}:*')
+    # "n:*" contains the last email even if its UID is less than n
+    return [uid for uid in data[0].split() if int(uid) > last_uid]
+
+
+def fetch_batch(
+    server: imaplib.IMAP4_SSL,
+    uids: list[bytes],
+    mode: str = 'full',
+    id_key: str = None,
+    with_payload: bool = False,
+    folder: Path = None,
+    store: AttachmentStore = None,
+    index: MailboxIndex = None
+) -> list[dict]:
+    """Fetch a batch of emails in the read mode.
+
+    server          imaplib.IMAP4_SSL object;
+    uids            email UIDs;
+    mode            read mode: 'full', 'headers' or 'text'. Default: 'full';
+    id_key          email ID key. Example: "Message-ID" - for Yandex;
+    with_payload    add payload for attached files;
+    folder          folder path where attached files are saved;
+    store           AttachmentStore object which keeps saved files
+                    without duplicates;
+    index           MailboxIndex object which is fed with read emails;
+
+    return          list[dict] in the order of uids.
+    """
+    if mode == 'headers':
+        return fetch_headers(server=server, uids=uids, id_key=id_key)
+    if mode == 'text':
+        emails = fetch_text(server=server, uids=uids, id_key=id_key)
+        if index is not None:
+            index.add([(msg['uid'], msg) for msg in emails])
+        return emails
+    return fetch_full(
+        server=server,
+        uids=uids,
+        id_key=id_key,
+        with_payload=with_payload,
+        folder=folder,
+        store=store,
+        index=index
+    )
+
+
+def fetch_cached(
+    server: imaplib.IMAP4_SSL,
+    uids: list[bytes],
+    cache: MailboxCache,
+    id_key: str = None,
+    with_payload: bool = False,
+    folder: Path = None,
+    store: AttachmentStore = None,
+    parser: Executor = None,
+    index: MailboxIndex = None
+) -> list[dict]:
+    """Get whole emails from the cache, only missing emails are fetched.
+    Fetched emails are added to the cache, cached raw emails parsed with
+    other options are parsed again.
+
+    server          imaplib.IMAP4_SSL object;
+    uids            email UIDs;
+    cache           MailboxCache object;
+    id_key          email ID key. Example: "Message-ID" - for Yandex;
+    with_payload    add payload for attached files;
+    folder          folder path where attached files are saved;
+    store           AttachmentStore object which keeps saved files
+                    without duplicates;
+    index           MailboxIndex object which is fed with read emails;
+    parser          concurrent.futures.Executor object which parses emails;
+
+    return          list[dict] in the order of uids.
+    """
+    logger = logging.getLogger(__name__)
+    options = repr((
+        id_key,
+        bool(with_payload),
+        None if folder is None else os.path.abspath(folder),
+        None if store is None else store.root
+    ))
+    cached = cache.get([int(uid) for uid in uids], options)
+    missing = [uid for uid in uids if int(uid) not in cached]
+    fetched = fetch_raw(server, missing) if missing else []
+    logger.debug(
+        '%s emails from cache, %s fetched',
+        len(uids) - len(missing), len(fetched)
+    )
+    raw = fetched + [
+        (uid, cached[int(uid)]) for uid in uids
+        if isinstance(cached.get(int(uid)), bytes)
+    ]
+    kwargs = {
+        'messages': raw,
+        'id_key': id_key,
+        'with_payload': with_payload,
+        'folder': folder,
+        'store': store,
+        'index': index
+    }
+    if not raw:
+        parsed = []
+    elif parser is not None:
+        parsed = submit(parser, parse_emails, **kwargs).result()
+    else:
+        parsed = parse_emails(**kwargs)
+    for position, ((uid, data), msg) in enumerate(zip(raw, parsed)):
+        # Raw emails from the cache are not written again
+        cache.put(
+            int(uid),
+            data if position < len(fetched) else None,
+            msg,
+            options
+        )
+        cached[int(uid)] = msg
+    cache.evict()
+    # Emails cached before uid was added to the result have no uid key
+    return [
+        {'uid': uid.decode()} | cached[int(uid)]
+        for uid in uids if int(uid) in cached
+    ]
+
+
+def store_seen(
+    server: imaplib.IMAP4_SSL,
+    uids: str,
+    seen: bool = True,
+    uid: bool = True
+):
+    """Add or remove "read" flag of emails with one STORE command.
+    Nothing is sent if seen is None or the message set is empty.
+
+    server    imaplib.IMAP4_SSL object;
+    uids      message set of email UIDs;
+    seen      mark the emails as "read" (True) or "unread" (False).
+              Default: True;
+    uid       uids are UIDs (UID STORE), not sequence numbers. Default: True.
+    """
+    logger = logging.getLogger(__name__)
+    if seen is None or not uids:
+        return
+    # Server does not send new flags of each email back
+    command = '+FLAGS.SILENT' if seen else '-FLAGS.SILENT'
+    if uid:
+        server.uid('store', uids, command, '\\Seen')
+    else:
+        server.store(uids, command, '\\Seen')
+    state = 'seen' if seen else 'unseen'
+    logger.info("Emails '%s' marked as '%s'", uids, state)
+
+
+def pipeline_emails(
+    server: imaplib.IMAP4_SSL,
+    batches: list[list[bytes]],
+    parser: Executor,
+    prefetch: int = 2,
+    id_key: str = None,
+    with_payload: bool = False,
+    folder: Path = None,
+    store: AttachmentStore = None,
+    index: MailboxIndex = None
+) -> Iterator[dict]:
+    """Fetch batches of whole emails in a separate thread and parse them
+    with the parser. The fetching thread and the parser are connected by
+    a queue of prefetch batches, so fetching waits if parsing is slower.
+    Raw emails are passed to the parser as they are received.
+
+    return    generator of dictionaries in the order of batches.
+    """
+    results = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fetch():
+        try:
+            for batch in batches:
+                messages = fetch_raw(server, batch)
+                future = submit(
+                    parser,
+                    parse_emails,
+                    messages=messages,
+                    id_key=id_key,
+                    with_payload=with_payload,
+                    folder=folder,
+                    store=store,
+                    index=index
+                )
+                if not put(future):
+                    return
+        except Exception as exp:
+            put(exp)
+        else:
+            put(None)
+
+    # The thread runs in the context of the caller, so stages are reported
+    # to the hooks of the call
+    thread = threading.Thread(
+        target=contextvars.copy_context().run, args=(fetch,), daemon=True
+    )
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield from item.result()
+    finally:
+        stop.set()
+        thread.join()
+
+
+def generate_emails(
     server: imaplib.IMAP4_SSL,
     criteria: str = 'ALL',
     last: int = None,
     id_key: str = None,
     seen: bool = True,
     with_payload: bool = False,
-    folder: Path = None
-):
-    """Get emails as a list of dictinaries with subject, from, date, body,
-    attachments.
+    folder: Path = None,
+    batch_size: int = 100,
+    mode: str = 'full',
+    parser: Executor = None,
+    prefetch: int = 2,
+    store: AttachmentStore = None,
+    cache: MailboxCache = None,
+    index: MailboxIndex = None
+) -> Iterator[dict]:
+    """Generate emails as dictinaries with subject, from, date, body,
+    attachments keys. Emails are searched by UID and fetched in batches,
+    one UID FETCH command for each batch, with BODY.PEEK[], so fetching does
+    not change flags. If seen is not None, flags of the yielded emails are
+    changed with one UID STORE command after reading, also if the generator
+    is closed early. Emails of a batch are
+    yielded as soon as the batch is fetched and parsed. If parser is defined,
+    whole emails are fetched in a separate thread and parsed with the parser
+    while the next batches are fetched. If cache is defined, whole emails
+    are taken from the cache and only missing emails are fetched.
 
-    keys.
     server          imaplib.IMAP4_SSL object;
     criteria        email search criteria. Examples:
                     'ALL' - all emails,
@@ -218,32 +1002,133 @@ def get_emails(
                     'UNSEEN SINCE 12-Dec-2022' - several criteria;
     last            read the last n emails;
     id_key          email ID key. Example: "Message-ID" - for Yandex;
-    seen            mark the email as "read." Default: True;
+    seen            mark the emails as "read" (True) or "unread" (False),
+                    None - do not change flags. Default: True;
     with_payload    add payload for attached files;
     folder          folder path where attached files are saved;
+    store           AttachmentStore object which keeps saved files
+                    without duplicates;
+    index           MailboxIndex object which is fed with read emails;
+    batch_size      number of emails fetched with one command. Default: 100;
+    mode            read mode:
+                    'full' - whole emails with attachments (default),
+                    'headers' - only subject, from, date,
+                    'text' - headers and text without attachments;
+    parser          concurrent.futures.Executor object which parses whole
+                    emails, for example ProcessPoolExecutor;
+    prefetch        number of fetched batches waiting for parsing.
+                    Default: 2;
+    cache           MailboxCache object of the selected mailbox;
 
-    return          list[dict].
+    return          generator of dictionaries.
     """
-    status, data = server.search(None, criteria)
-    nums = data[0].split()
-    emails = []
+    status, data = server.uid('search', None, criteria)
+    uids = data[0].split()
     if last:
-        nums = nums[-last:]
-    for num in nums:
-        emails.append(
-            get_email(
+        uids = uids[-last:]
+    batches = [
+        uids[start:start + batch_size]
+        for start in range(0, len(uids), batch_size)
+    ]
+    # Flags of the yielded emails are changed with one command at the end,
+    # also if reading is stopped early. Emails which are fetched (or
+    # prefetched by the pipeline) but not yielded keep their flags
+    received = []
+
+    def deliver(emails: Iterator[dict]) -> Iterator[dict]:
+        for msg in emails:
+            # The email is received by the caller once it is yielded
+            received.append(msg['uid'])
+            yield msg
+
+    try:
+        if cache is not None and mode == 'full':
+            for batch in batches:
+                emails = fetch_cached(
+                    server=server,
+                    uids=batch,
+                    cache=cache,
+                    id_key=id_key,
+                    with_payload=with_payload,
+                    folder=folder,
+                    store=store,
+                    index=index,
+                    parser=parser
+                )
+                yield from deliver(emails)
+        elif parser is not None and mode == 'full':
+            yield from deliver(pipeline_emails(
                 server=server,
-                num=num,
+                batches=batches,
+                parser=parser,
+                prefetch=prefetch,
                 id_key=id_key,
-                seen=seen,
                 with_payload=with_payload,
-                folder=folder
-            )
+                folder=folder,
+                store=store,
+                index=index
+            ))
+        else:
+            for batch in batches:
+                emails = fetch_batch(
+                    server=server,
+                    uids=batch,
+                    mode=mode,
+                    id_key=id_key,
+                    with_payload=with_payload,
+                    folder=folder,
+                    store=store,
+                    index=index
+                )
+                yield from deliver(emails)
+    except GeneratorExit:
+        store_seen(server, message_set(received), seen)
+        raise
+    store_seen(server, message_set(received), seen)
+
+
+def get_emails(
+    server: imaplib.IMAP4_SSL,
+    criteria: str = 'ALL',
+    last: int = None,
+    id_key: str = None,
+    seen: bool = True,
+    with_payload: bool = False,
+    folder: Path = None,
+    batch_size: int = 100,
+    mode: str = 'full',
+    parser: Executor = None,
+    prefetch: int = 2,
+    store: AttachmentStore = None,
+    cache: MailboxCache = None,
+    index: MailboxIndex = None
+):
+    """Get emails as a list of dictinaries with subject, from, date, body,
+    attachments keys. Parameters are the same as in generate_emails function.
+
+    return          list[dict].
+    """
+    return list(
+        generate_emails(
+            server=server,
+            criteria=criteria,
+            last=last,
+            id_key=id_key,
+            seen=seen,
+            with_payload=with_payload,
+            folder=folder,
+            store=store,
+            index=index,
+            batch_size=batch_size,
+            mode=mode,
+            parser=parser,
+            prefetch=prefetch,
+            cache=cache
         )
-    return emails
+    )
 
 
-def read_email(
+def iter_emails(
     email: str,
     password: str,
     domain: str = None,
@@ -251,38 +1136,25 @@ def read_email(
     criteria: str = 'ALL',
     last: int = None,
     id_key: str = None,
-    seen: str = None,
+    seen: bool = None,
     with_payload: bool = None,
     folder: Path = None,
     host: str = None,
-    port: int = None
-):
-    """Read email message and get attachment files with or without payload.
-
-    email           email address which is read;
-    password        email app password;
-    domain          domain of the email service.
-                    If None, will be received from email;
-                    Examples: google, yandex
-    mailbox         mailbox section or folder name from which emails are read.
-                    Default: INBOX (incoming).
-                    Examples: Drafts, INBOX, Outbox, Sent, Spam, Trash, etc.;
-    criteria        email search criteria. Examples:
-                    'ALL' - all emails,
-                    'UNSEEN' - only unseen emails,
-                    'SINCE 12-Dec-2022' - from date in format %d-%b-%Y,
-                    'UNSEEN SINCE 12-Dec-2022' - several criteria;
-
-    Additional parameters:
-    last            read the last n emails;
-    id_key          email ID key.. Example: "Message-ID" - for Yandex;
-    seen            mark the email as "read." Default: True;
-    with_payload    add payload for attached files;
-    folder          folder path where attached files are saved;
-    host            IMAP-server host;
-    port            IMAP-server port.
+    port: int = None,
+    batch_size: int = 100,
+    mode: str = 'full',
+    parser: Executor = None,
+    store: AttachmentStore = None,
+    cache: MessageCache = None,
+    index: SearchIndex = None,
+    pool: 'IMAPPool' = None
+) -> Iterator[dict]:
+    """Read emails one by one. Each email is yielded as soon as its batch
+    is fetched and parsed. IMAP session is kept open during the iteration
+    and is closed when the generator is exhausted or closed. Parameters are
+    the same as in read_email function.
 
-    return          list[dict].
+    return    generator of dictionaries.
     """
     logger = logging.getLogger(__name__)
 
@@ -290,7 +1162,7 @@ def read_email(
     if folder:
         if not os.path.exists(folder):
             os.mkdir(folder)
-            logger.debug(f"Created a folder '{folder}'")
+            logger.debug("Created a folder '%s'", folder)
 
     # Check parameters
     params = ReadEmailParams(
@@ -303,29 +1175,152 @@ def read_email(
         id_key=id_key,
         seen=seen,
         with_payload=with_payload,
-        folder=folder
+        folder=folder,
+        batch_size=batch_size,
+        mode=mode
     )
 
     if host is None and port is None:
         # Receiving the server host and port
         host, port = get_server(domain=params.domain, server='imap')
 
-    # Set up a connection with the SMTP server
-    with imaplib.IMAP4_SSL(host, port) as server:
+    if pool is not None:
+        # Borrow a logged in session with the selected mailbox
+        connection = pool.session(
+            params.email, params.password, host, port, params.mailbox
+        )
+    else:
+        # Set up a connection with the IMAP server
+        connection = IMAPClient(host, port)
+    with connection as server:
         logger.debug('IMAP session started')
-        server.login(params.email, params.password)
-        logger.debug('Authorization completed')
-        server.select(params.mailbox)
+        if pool is None:
+            server.login(params.email, params.password)
+            logger.debug('Authorization completed')
+            server.select(params.mailbox)
+        mailbox_cache = mailbox_index = None
+        if cache is not None or index is not None:
+            if pool is not None:
+                uidvalidity = server.uidvalidity
+            else:
+                uidvalidity = get_response_number(server, 'UIDVALIDITY')
+            if uidvalidity is not None and cache is not None:
+                mailbox_cache = cache.mailbox(
+                    params.email, params.mailbox, uidvalidity
+                )
+            if uidvalidity is not None and index is not None:
+                mailbox_index = index.mailbox(
+                    params.email, params.mailbox, uidvalidity
+                )
         # Get emails
-        emails = get_emails(
+        yield from generate_emails(
             server=server,
             criteria=params.criteria,
             last=params.last,
             id_key=params.id_key,
             seen=params.seen,
             with_payload=params.with_payload,
-            folder=params.folder
+            folder=params.folder,
+            store=store,
+            batch_size=params.batch_size,
+            mode=params.mode,
+            parser=parser,
+            cache=mailbox_cache,
+            index=mailbox_index
         )
         # End IMAP session and close connection
         logger.debug('IMAP session ended')
-    return emails
+
+
+def read_email(
+    email: str,
+    password: str,
+    domain: str = None,
+    mailbox='INBOX',
+    criteria: str = 'ALL',
+    last: int = None,
+    id_key: str = None,
+    seen: bool = None,
+    with_payload: bool = None,
+    folder: Path = None,
+    host: str = None,
+    port: int = None,
+    batch_size: int = 100,
+    mode: str = 'full',
+    parser: Executor = None,
+    store: AttachmentStore = None,
+    cache: MessageCache = None,
+    index: SearchIndex = None,
+    pool: 'IMAPPool' = None
+):
+    """Read email message and get attachment files with or without payload.
+
+    email           email address which is read;
+    password        email app password;
+    domain          domain of the email service.
+                    If None, will be received from email;
+                    Examples: google, yandex
+    mailbox         mailbox section or folder name from which emails are read.
+                    Default: INBOX (incoming).
+                    Examples: Drafts, INBOX, Outbox, Sent, Spam, Trash, etc.;
+    criteria        email search criteria. Examples:
+                    'ALL' - all emails,
+                    'UNSEEN' - only unseen emails,
+                    'SINCE 12-Dec-2022' - from date in format %d-%b-%Y,
+                    'UNSEEN SINCE 12-Dec-2022' - several criteria;
+
+    Additional parameters:
+    last            read the last n emails;
+    id_key          email ID key.. Example: "Message-ID" - for Yandex;
+    seen            mark the emails as "read" (True) or "unread" (False)
+                    with one UID STORE command. Default: None - emails are
+                    read with BODY.PEEK[] and flags are not changed;
+    with_payload    add payload for attached files;
+    folder          folder path where attached files are saved;
+    store           AttachmentStore object which keeps saved files
+                    without duplicates;
+    host            IMAP-server host;
+    port            IMAP-server port;
+    batch_size      number of emails fetched with one command. Default: 100;
+    mode            read mode:
+                    'full' - whole emails with attachments (default),
+                    'headers' - only subject, from, date,
+                    'text' - headers and text, attachments are listed with
+                    name, part and size and can be fetched with
+                    fetch_attachment;
+    parser          concurrent.futures.Executor object which parses whole
+                    emails while the next batches are fetched, for example
+                    ProcessPoolExecutor;
+    cache           MessageCache object. Whole emails are read from the
+                    cache, only missing emails are fetched;
+    index           SearchIndex object which is fed with read emails in
+                    'full' and 'text' modes;
+    pool            IMAPPool object. A logged in session is borrowed from
+                    the pool and returned to it, instead of a new
+                    connection for each call.
+
+    return          list[dict].
+    """
+    return list(
+        iter_emails(
+            email=email,
+            password=password,
+            domain=domain,
+            mailbox=mailbox,
+            criteria=criteria,
+            last=last,
+            id_key=id_key,
+            seen=seen,
+            with_payload=with_payload,
+            folder=folder,
+            store=store,
+            host=host,
+            port=port,
+            batch_size=batch_size,
+            mode=mode,
+            parser=parser,
+            cache=cache,
+            index=index,
+            pool=pool
+        )
+    )
@@ -0,0 +1,295 @@
+from contextlib import closing
+from datetime import datetime
+import os
+from pathlib import Path
+import re
+import sqlite3
+
+
+# Query fields and indexed columns
+FIELDS = {
+    'from': 'sender',
+    'subject': 'subject',
+    'body': 'body',
+    'attachment': 'attachments',
+    'filename': 'attachments'
+}
+QUERY_TOKEN = re.compile(r'(?:(\w+):)?(?:"([^"]*)"|(\S+))')
+QUERY_DATE = re.compile(r'^\d{4}(-\d{2}(-\d{2})?)?$')
+
+
+def get_sortable_date(date: str) -> str:
+    """Convert email date (dd.mm.YYYY HH:MM:SS) into sortable form
+    YYYY-mm-dd HH:MM:SS.
+    """
+    if not date:
+        return None
+    try:
+        parsed = datetime.strptime(date, '%d.%m.%Y %H:%M:%S')
+    except ValueError:
+        return None
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def quote_term(term: str) -> str:
+    """Quote full-text search term. Trailing * makes a prefix search."""
+    prefix = term.endswith('*') and len(term) > 1
+    if prefix:
+        term = term[:-1]
+    return '"' + term.replace('"', '""') + '"' + ('*' if prefix else '')
+
+
+def parse_query(query: str) -> tuple[str, dict]:
+    """Parse search query into FTS5 MATCH expression and date filters.
+    Example: 'invoice from:acme since:2025-01'.
+
+    Terms:
+        word, "some phrase"      - any of subject, from, body, attachments;
+        from:, subject:, body:,
+        attachment: (filename:)  - the field only;
+        since:YYYY[-mm[-dd]]     - emails sent since the date;
+        before:YYYY[-mm[-dd]]    - emails sent before the date.
+
+    return    tuple with MATCH expression (or None) and dict with since
+              and before keys.
+    """
+    terms = []
+    dates = {'since': None, 'before': None}
+    for match in QUERY_TOKEN.finditer(query):
+        field, phrase, word = match.groups()
+        value = phrase if phrase is not None else word
+        field = field.lower() if field else None
+        if field in dates:
+            if not QUERY_DATE.match(value):
+                raise ValueError(
+                    f"Invalid date '{value}', use YYYY, YYYY-mm or YYYY-mm-dd"
+                )
+            dates[field] = value
+        elif field in FIELDS:
+            terms.append(f'{FIELDS[field]} : {quote_term(value)}')
+        elif field is not None:
+            # Not a known field, search the whole token
+            terms.append(quote_term(match.group(0).strip('"')))
+        elif value:
+            terms.append(quote_term(value))
+    return (' '.join(terms) or None), dates
+
+
+class SearchIndex:
+    """Local full-text index of read emails in SQLite FTS5. Subject, sender,
+    body text and attachment names are indexed, emails are keyed by
+    account, mailbox, UIDVALIDITY and UID. The index is fed by readers
+    incrementally and can be used from several processes.
+
+    path    index file path.
+
+    Example:
+        index = SearchIndex('path/to/index.sqlite')
+        read_email(email, password, criteria='ALL', index=index)
+        uids = index.uids('invoice from:acme since:2025-01', email)
+    """
+
+    def __init__(self, path: Path):
+        self.path = os.path.abspath(path)
+        with closing(self._connect()) as db, db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS messages ('
+                'id INTEGER PRIMARY KEY, account TEXT, mailbox TEXT, '
+                'uidvalidity INTEGER, uid INTEGER, date TEXT, '
+                'UNIQUE (account, mailbox, uidvalidity, uid))'
+            )
+            db.execute(
+                'CREATE INDEX IF NOT EXISTS messages_date '
+                'ON messages (date)'
+            )
+            db.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS emails USING fts5('
+                'subject, sender, body, attachments, '
+                "tokenize = 'unicode61 remove_diacritics 2')"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def __len__(self):
+        with closing(self._connect()) as db:
+            return db.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def mailbox(self, account: str, mailbox: str, uidvalidity: int):
+        """Get the index of one mailbox.
+
+        return    MailboxIndex object.
+        """
+        return MailboxIndex(self, account, mailbox, uidvalidity)
+
+    def add(
+        self,
+        account: str,
+        mailbox: str,
+        uidvalidity: int,
+        emails: list[tuple]
+    ):
+        """Add emails to the index or replace indexed ones in one
+        transaction.
+
+        account        email address;
+        mailbox        mailbox name;
+        uidvalidity    UIDVALIDITY of the mailbox;
+        emails         list of (uid, email) tuples, email is a dictionary
+                       returned by readers.
+        """
+        with closing(self._connect()) as db, db:
+            for uid, msg in emails:
+                uid = int(uid)
+                row = db.execute(
+                    'SELECT id FROM messages WHERE account = ? '
+                    'AND mailbox = ? AND uidvalidity = ? AND uid = ?',
+                    (account, mailbox, uidvalidity, uid)
+                ).fetchone()
+                date = get_sortable_date(msg.get('date'))
+                if row is None:
+                    rowid = db.execute(
+                        'INSERT INTO messages (account, mailbox, '
+                        'uidvalidity, uid, date) VALUES (?, ?, ?, ?, ?)',
+                        (account, mailbox, uidvalidity, uid, date)
+                    ).lastrowid
+                else:
+                    rowid = row[0]
+                    db.execute(
+                        'UPDATE messages SET date = ? WHERE id = ?',
+                        (date, rowid)
+                    )
+                    db.execute('DELETE FROM emails WHERE rowid = ?', (rowid,))
+                db.execute(
+                    'INSERT INTO emails (rowid, subject, sender, body, '
+                    'attachments) VALUES (?, ?, ?, ?, ?)',
+                    (
+                        rowid,
+                        msg.get('subject') or '',
+                        msg.get('from') or '',
+                        msg.get('body') or '',
+                        ' '.join(
+                            attachment['name']
+                            for attachment in msg.get('attachments') or []
+                            if attachment and attachment.get('name')
+                        )
+                    )
+                )
+
+    def search(
+        self,
+        query: str,
+        account: str = None,
+        mailbox: str = None,
+        limit: int = None
+    ) -> list[dict]:
+        """Search emails, see parse_query for the query syntax.
+
+        query      search query. Example: 'invoice from:acme since:2025-01';
+        account    email address. If None, all accounts are searched;
+        mailbox    mailbox name. If None, all mailboxes are searched;
+        limit      maximum number of found emails;
+
+        return     list[dict] with account, mailbox, uidvalidity, uid,
+                   subject, from, date keys sorted by date.
+        """
+        match, dates = parse_query(query)
+        where, args = [], []
+        if match is not None:
+            where.append('emails MATCH ?')
+            args.append(match)
+        for column, value in (('account', account), ('mailbox', mailbox)):
+            if value is not None:
+                where.append(f'm.{column} = ?')
+                args.append(value)
+        if dates['since']:
+            where.append('m.date >= ?')
+            args.append(dates['since'])
+        if dates['before']:
+            where.append('m.date < ?')
+            args.append(dates['before'])
+        sql = (
+            'SELECT m.account, m.mailbox, m.uidvalidity, m.uid, '
+            'emails.subject, emails.sender, m.date '
+            'FROM emails JOIN messages m ON m.id = emails.rowid'
+            + (' WHERE ' + ' AND '.join(where) if where else '')
+            + ' ORDER BY m.date, m.uid'
+            + (f' LIMIT {int(limit)}' if limit else '')
+        )
+        with closing(self._connect()) as db:
+            rows = db.execute(sql, args).fetchall()
+        keys = (
+            'account', 'mailbox', 'uidvalidity', 'uid', 'subject', 'from',
+            'date'
+        )
+        return [dict(zip(keys, row)) for row in rows]
+
+    def uids(
+        self,
+        query: str,
+        account: str,
+        mailbox: str = 'INBOX',
+        uidvalidity: int = None
+    ) -> list[int]:
+        """Search UIDs of emails of one mailbox. The found emails can be
+        read with criteria 'UID ' + message_set(uids).
+
+        query          search query, see parse_query;
+        account        email address;
+        mailbox        mailbox name. Default: INBOX;
+        uidvalidity    UIDVALIDITY of the mailbox. If None, the last
+                       indexed UIDVALIDITY is used;
+
+        return         sorted list[int].
+        """
+        found = self.search(query, account=account, mailbox=mailbox)
+        if uidvalidity is None and found:
+            uidvalidity = max(msg['uidvalidity'] for msg in found)
+        return sorted(
+            msg['uid'] for msg in found if msg['uidvalidity'] == uidvalidity
+        )
+
+    def clear(self, account: str = None, mailbox: str = None):
+        """Remove emails from the index.
+
+        account    email address. If None, the whole index is cleared;
+        mailbox    mailbox name. If None, all mailboxes of the account
+                   are cleared.
+        """
+        where, args = '', ()
+        if account is not None:
+            where, args = ' WHERE account = ?', (account,)
+            if mailbox is not None:
+                where, args = where + ' AND mailbox = ?', args + (mailbox,)
+        with closing(self._connect()) as db, db:
+            db.execute(
+                'DELETE FROM emails WHERE rowid IN '
+                f'(SELECT id FROM messages{where})',
+                args
+            )
+            db.execute(f'DELETE FROM messages{where}', args)
+
+
+class MailboxIndex:
+    """Index of one mailbox, see SearchIndex.
+
+    index          SearchIndex object;
+    account        email address;
+    mailbox        mailbox name;
+    uidvalidity    UIDVALIDITY of the mailbox.
+    """
+
+    def __init__(
+        self,
+        index: SearchIndex,
+        account: str,
+        mailbox: str,
+        uidvalidity: int
+    ):
+        self.index = index
+        self.key = (account, mailbox, uidvalidity)
+
+    def add(self, emails: list[tuple]):
+        """Add emails to the index, see SearchIndex.add."""
+        if emails:
+            self.index.add(*self.key, emails)
@@ -1,20 +1,25 @@
-from email import encoders
-from email.mime.audio import MIMEAudio
-from email.mime.base import MIMEBase
-from email.mime.image import MIMEImage
+from email.generator import BytesGenerator
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from io import BytesIO
 import logging
 import os
-import mimetypes
 from pathlib import Path
+import re
 import smtplib
-import string
+from typing import Callable, Iterable, Iterator
+import uuid
+
+from .attachments import ATTACHMENTS, stream_attachment
+from .metrics import SMTPClient, report, timer
+from .templates import (
+    TEMPLATES, compile_html_template, compile_txt_template
+)
+from .types import Email, SendEmailParams, valid_email
+from .utils import get_server
 
-from jinja2 import Environment, FileSystemLoader
 
-from .types import SendEmailParams
-from .utils import get_server
+CRLF = b'\r\n'
 
 
 def create_message(sender: str, reciever: str, subject: str = None):
@@ -38,7 +43,8 @@ def create_message(sender: str, reciever: str, subject: str = None):
 
 
 def read_txt_template(filepath: Path):
-    """Read message template txt-file.
+    """Read message template txt-file. The template is compiled once and
+    then taken from the template cache until the file changes.
 
     filepath    template file path;
 
@@ -46,30 +52,25 @@ def read_txt_template(filepath: Path):
     """
     logger = logging.getLogger(__name__)
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
+        template = TEMPLATES.get(filepath, compile_txt_template)
         logger.debug('Template file read')
-        return string.Template(content)
+        return template
     except FileNotFoundError:
-        logger.error(f'Template file ({filepath}) not exists')
+        logger.error('Template file (%s) not exists', filepath)
 
 
 def read_html_template(filepath: Path):
-    """Read message template html-file.
+    """Read message template html-file. The template is compiled once and
+    then taken from the template cache until the file changes.
 
     filepath    template file path;
 
     return      jinja2.environment.Template object.
     """
-    template_path = filepath.split(os.sep)
-    template_dir = (
-        os.sep.join(template_path[:-1]) if len(template_path) > 1
-        else os.path.dirname(__file__)
-    )
-    loader = FileSystemLoader(template_dir)
-    env = Environment(loader=loader)
-    template = env.get_template(template_path[-1])
-    return template
+    filepath = str(filepath)
+    if not os.path.dirname(filepath):
+        filepath = os.path.join(os.path.dirname(__file__), filepath)
+    return TEMPLATES.get(filepath, compile_html_template)
 
 
 def create_message_text(template_path: Path, template_kwargs: dict = {}):
@@ -82,7 +83,7 @@ def create_message_text(template_path: Path, template_kwargs: dict = {}):
     """
     logger = logging.getLogger(__name__)
     # Definiton the template file type
-    file_extention = template_path.split('.')[-1]
+    file_extention = str(template_path).split('.')[-1]
 
     if file_extention == 'txt':
         logger.debug('Template file recognized as txt')
@@ -91,8 +92,10 @@ def create_message_text(template_path: Path, template_kwargs: dict = {}):
         if not template:
             return
         # Substitution of values in the template
+        started = timer()
         try:
             message_text = template.substitute(template_kwargs)
+            report('render', started, len(message_text))
             logger.debug('Template substituted')
         except KeyError as err:
             error_message = (
@@ -113,7 +116,9 @@ def create_message_text(template_path: Path, template_kwargs: dict = {}):
         if not template:
             return
         # Substitution of values in the template
+        started = timer()
         message_text = template.render(data=template_kwargs)
+        report('render', started, len(message_text))
         # Creation of a message content object
         message_text = MIMEText(message_text, 'html')
         logger.debug('Message text rendered')
@@ -130,7 +135,8 @@ def create_message_text(template_path: Path, template_kwargs: dict = {}):
 
 def get_attachments(filepaths: list[Path]) -> list:
     """Convert files into email.mime.base.MIMEBase objects
-    that can be attached to a message object.
+    that can be attached to a message object. Each file is encoded once
+    and then taken from the attachment cache until the file changes.
 
     filepaths    attachment file paths;
 
@@ -140,37 +146,485 @@ def get_attachments(filepaths: list[Path]) -> list:
     # Parsing each file
     attachments = []
     for filepath in filepaths:
-        ctype, encoding = mimetypes.guess_type(filepath)
-        if ctype is None or encoding is not None:
-            ctype = 'application/octet-stream'
-        maintype, subtype = ctype.split('/', 1)
-        if maintype == 'text':
-            with open(filepath) as fp:
-                attachment = MIMEText(fp.read(), _subtype=subtype)
-        elif maintype == 'image':
-            with open(filepath, 'rb') as fp:
-                attachment = MIMEImage(fp.read(), _subtype=subtype)
-        elif maintype == 'audio':
-            with open(filepath, 'rb') as fp:
-                attachment = MIMEAudio(fp.read(), _subtype=subtype)
-        else:
-            with open(filepath, 'rb') as fp:
-                attachment = MIMEBase(maintype, subtype)
-                attachment.set_payload(fp.read())
-            encoders.encode_base64(attachment)
-        attachment.add_header(
-            'Content-Disposition',
-            'attachment',
-            filename=os.path.basename(filepath)
-        )
-        attachments.append(attachment)
+        attachments.append(ATTACHMENTS.get(filepath))
         logger.debug(
-            'File processed as attachment '
-            f'({os.path.basename(filepath)})'
+            'File processed as attachment (%s)',
+            os.path.basename(filepath)
         )
     return attachments
 
 
+def build_message(params: SendEmailParams):
+    """Create a message object with text and attachments.
+
+    params    checked parameters of the message;
+
+    return    email.mime.multipart.MIMEMultipart object.
+    """
+    logger = logging.getLogger(__name__)
+    # Create message object
+    message_to = ', '.join(params.recievers)
+    message = create_message(
+        sender=params.email, reciever=message_to, subject=params.subject
+    )
+
+    # Process template and add text
+    logger.debug('Rendering message text')
+    if params.message_text:
+        message_text = MIMEText(params.message_text, 'plain')
+        message.attach(message_text)
+    elif params.message_template:
+        message_text = create_message_text(
+            template_path=params.message_template,
+            template_kwargs=params.template_kwargs
+        )
+        message.attach(message_text)
+    logger.debug('Message text attached')
+
+    # Process and add attachments
+    if params.attachments:
+        attachments = get_attachments(params.attachments)
+        for attachment in attachments:
+            message.attach(attachment)
+        logger.debug('All files attached')
+    return message
+
+
+def message_bytes(message: MIMEMultipart) -> bytes:
+    """Flatten a message object with CRLF line endings and dot-stuffing
+    for the SMTP DATA command.
+
+    message    email.message.Message object;
+
+    return     bytes.
+    """
+    buffer = BytesIO()
+    generator = BytesGenerator(
+        buffer, policy=message.policy.clone(linesep='\r\n')
+    )
+    generator.flatten(message)
+    data = re.sub(rb'(?m)^\.', b'..', buffer.getvalue())
+    if not data.endswith(CRLF):
+        data += CRLF
+    return data
+
+
+def stream_message(
+    params: SendEmailParams,
+    chunk_size: int = 57 * 1024
+) -> Iterator[bytes]:
+    """Generate message data for the SMTP DATA command by chunks.
+    Attachments are read and base64-encoded from disk chunk by chunk,
+    so memory usage does not depend on the attachment size.
+
+    params        checked parameters of the message;
+    chunk_size    size of the attachment file chunk. Default: 57 KB;
+
+    return        generator of bytes with CRLF line endings and
+                  dot-stuffing.
+    """
+    message = build_message(params.copy(update={'attachments': []}))
+    boundary = f'==============={uuid.uuid4().hex}=='
+    message.set_boundary(boundary)
+    data = message_bytes(message)
+    # Drop the close-delimiter, the attachments are added after the text
+    close_delimiter = f'--{boundary}--'.encode() + CRLF
+    yield data[:-len(close_delimiter)]
+    for filepath in params.attachments or []:
+        yield f'--{boundary}'.encode() + CRLF
+        yield from stream_attachment(filepath, chunk_size=chunk_size)
+    yield close_delimiter
+
+
+def send_data(
+    server: smtplib.SMTP,
+    sender: str,
+    recievers: list[str],
+    chunks: Iterable[bytes]
+) -> dict:
+    """Send message data by chunks with MAIL, RCPT and DATA commands.
+    The connection is closed if sending of the data fails.
+
+    server       smtplib.SMTP object;
+    sender       email sender;
+    recievers    email recievers;
+    chunks       message data chunks prepared by stream_message;
+
+    return       dict with refused recievers.
+    """
+    server.ehlo_or_helo_if_needed()
+    code, resp = server.mail(sender)
+    if code != 250:
+        server.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, sender)
+    refused = {}
+    for reciever in recievers:
+        code, resp = server.rcpt(reciever)
+        if code not in (250, 251):
+            refused[reciever] = (code, resp)
+    if len(refused) == len(recievers):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    started = timer()
+    code, resp = server.docmd('DATA')
+    if code != 354:
+        raise smtplib.SMTPDataError(code, resp)
+    size = 0
+    try:
+        for chunk in chunks:
+            server.send(chunk)
+            size += len(chunk)
+        server.send(b'.' + CRLF)
+    except Exception:
+        # The server waits for the end of data, the session is broken
+        server.close()
+        raise
+    code, resp = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+    report('smtp.data', started, size)
+    return refused
+
+
+def merge_messages(
+    params: SendEmailParams,
+    rows: Iterable[tuple[str, dict]]
+) -> Iterator[tuple[str, MIMEMultipart]]:
+    """Generate personalized messages for mail merge one by one.
+    Attachments are encoded once and shared by all messages.
+
+    params    checked parameters with message_template, subject and
+              attachments;
+    rows      iterable of (reciever, template_kwargs) pairs;
+
+    return    generator of (reciever, message object or exception) pairs.
+    """
+    attachments = get_attachments(params.attachments or [])
+    for reciever, template_kwargs in rows:
+        try:
+            valid_email(reciever)
+            message_text = create_message_text(
+                template_path=params.message_template,
+                template_kwargs=template_kwargs
+            )
+            if message_text is None:
+                raise ValueError('Could not render message template')
+        except (Exception) as exp:
+            yield reciever, exp
+            continue
+        message = create_message(
+            sender=params.email, reciever=reciever, subject=params.subject
+        )
+        message.attach(message_text)
+        for attachment in attachments:
+            message.attach(attachment)
+        yield reciever, message
+
+
+class Mailer:
+    """SMTP session which logs in once and sends many messages through
+    the same connection. The connection is restored if the server
+    disconnects.
+
+    email       sender email address;
+    password    email app password;
+    domain      domain of the email service.
+                If None, will be received from email;
+    host        SMTP-server host;
+    port        SMTP-server port;
+    retries     number of reconnections for one message. Default: 1.
+
+    Example:
+        with Mailer(email, password) as mailer:
+            results = mailer.send_emails(messages)
+    """
+
+    def __init__(
+        self,
+        email: str,
+        password: str,
+        domain: str = None,
+        host: str = None,
+        port: int = None,
+        retries: int = 1
+    ):
+        # Check parameters
+        self.params = Email(email=email, password=password, domain=domain)
+        if host is None and port is None:
+            # Receiving the server host and port
+            host, port = get_server(domain=self.params.domain, server='smtp')
+        self.host = host
+        self.port = port
+        self.retries = retries
+        self.server = None
+        # Number of messages sent through the current connection
+        self.sent = 0
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def connect(self):
+        """Set up a connection with the SMTP server and log in."""
+        logger = logging.getLogger(__name__)
+        self.server = SMTPClient(self.host, self.port)
+        self.sent = 0
+        logger.debug('SMTP session started')
+        try:
+            self.server.login(self.params.email, self.params.password)
+        except Exception:
+            self.server.close()
+            self.server = None
+            raise
+        logger.debug('Authorization completed')
+
+    def close(self):
+        """End SMTP session and close connection."""
+        logger = logging.getLogger(__name__)
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except smtplib.SMTPServerDisconnected:
+            pass
+        finally:
+            self.server.close()
+            self.server = None
+        logger.debug('SMTP session ended')
+
+    def send(self, message: MIMEMultipart):
+        """Send a message object. Reconnect and repeat sending if the server
+        has disconnected.
+
+        message    email.message.Message object;
+
+        return     dict with refused recievers.
+        """
+        return self._send(lambda server: server.send_message(message))
+
+    def send_stream(self, params: SendEmailParams):
+        """Send a message streaming attachments from disk by chunks.
+        Reconnect and repeat sending if the server has disconnected.
+
+        params    checked parameters of the message;
+
+        return    dict with refused recievers.
+        """
+        return self._send(
+            lambda server: send_data(
+                server=server,
+                sender=params.email,
+                recievers=params.recievers,
+                chunks=stream_message(params)
+            )
+        )
+
+    def _send(self, send: Callable[[smtplib.SMTP], dict]):
+        logger = logging.getLogger(__name__)
+        attempt = 0
+        while True:
+            if self.server is None:
+                self.connect()
+            try:
+                refused = send(self.server)
+                self.sent += 1
+                return refused
+            except smtplib.SMTPServerDisconnected:
+                self.server.close()
+                self.server = None
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                logger.warning('SMTP server disconnected, reconnecting')
+
+    def send_email(
+        self,
+        recievers: list[str],
+        subject: str = None,
+        message_text: str = None,
+        message_template: Path = None,
+        template_kwargs: dict = None,
+        attachments: list[Path] = None,
+        stream: bool = False
+    ):
+        """Send one email message through the session. Parameters are the
+        same as in send_email function.
+
+        return    None.
+        """
+        logger = logging.getLogger(__name__)
+        params = SendEmailParams(
+            email=self.params.email,
+            password=self.params.password,
+            domain=self.params.domain,
+            recievers=recievers,
+            subject=subject,
+            message_text=message_text,
+            message_template=message_template,
+            template_kwargs=template_kwargs,
+            attachments=attachments
+        )
+        if stream:
+            self.send_stream(params)
+        else:
+            self.send(build_message(params))
+        logger.info(
+            'Email message sent from [%s] to [%s]',
+            params.email, ', '.join(params.recievers)
+        )
+
+    def send_emails(self, messages: Iterable[dict]) -> list[dict]:
+        """Send many email messages through the session. An error in one
+        message does not stop sending of the others.
+
+        messages    iterable of dictionaries with send_email parameters:
+                    recievers, subject, message_text, message_template,
+                    template_kwargs, attachments, stream;
+
+        return      list[dict] with recievers, sent flag and error
+                    for each message.
+        """
+        return [self.try_send_email(message) for message in messages]
+
+    def try_send_email(self, message: dict) -> dict:
+        """Send one email message given as a dictionary with send_email
+        parameters. Errors are returned instead of being raised.
+
+        message    dictionary with send_email parameters;
+
+        return     dict with recievers, sent flag and error.
+        """
+        logger = logging.getLogger(__name__)
+        result = {'recievers': message.get('recievers')}
+        try:
+            self.send_email(**message)
+            result.update({'sent': True, 'error': None})
+        except (Exception) as exp:
+            logger.error('Email message was not sent: %s', exp)
+            result.update({'sent': False, 'error': exp})
+        return result
+
+    def send_mail_merge(
+        self,
+        message_template: Path,
+        rows: Iterable[tuple[str, dict]],
+        subject: str = None,
+        attachments: list[Path] = None
+    ) -> list[dict]:
+        """Send a personalized message to each reciever through the session.
+        Parameters are the same as in send_mail_merge function.
+
+        return    list[dict] with recievers, sent flag and error
+                  for each row.
+        """
+        logger = logging.getLogger(__name__)
+        params = SendEmailParams(
+            email=self.params.email,
+            password=self.params.password,
+            domain=self.params.domain,
+            recievers=[],
+            subject=subject,
+            message_template=message_template,
+            template_kwargs={},
+            attachments=attachments
+        )
+        results = []
+        for reciever, message in merge_messages(params, rows):
+            result = {'recievers': [reciever]}
+            try:
+                if isinstance(message, Exception):
+                    raise message
+                self.send(message)
+                result.update({'sent': True, 'error': None})
+                logger.info(
+                    'Email message sent from [%s] to [%s]',
+                    params.email, reciever
+                )
+            except (Exception) as exp:
+                logger.error('Email message was not sent: %s', exp)
+                result.update({'sent': False, 'error': exp})
+            results.append(result)
+        return results
+
+
+def send_emails(
+    email: str,
+    password: str,
+    messages: Iterable[dict],
+    domain: str = None,
+    host: str = None,
+    port: int = None
+) -> list[dict]:
+    """Send many email messages using one SMTP session.
+
+    email       sender email address;
+    password    email app password;
+    messages    iterable of dictionaries with send_email parameters:
+                recievers, subject, message_text, message_template,
+                template_kwargs, attachments, stream;
+    domain      domain of the email service.
+                If None, will be received from email.
+                Examples: google, yandex;
+
+    Additional parameters:
+    host        SMTP-server host;
+    port        SMTP-server port.
+
+    return      list[dict] with recievers, sent flag and error
+                for each message.
+    """
+    with Mailer(
+        email=email, password=password, domain=domain, host=host, port=port
+    ) as mailer:
+        return mailer.send_emails(messages)
+
+
+def send_mail_merge(
+    email: str,
+    password: str,
+    message_template: Path,
+    rows: Iterable[tuple[str, dict]],
+    domain: str = None,
+    subject: str = None,
+    attachments: list[Path] = None,
+    host: str = None,
+    port: int = None
+) -> list[dict]:
+    """Render one template for many recievers and send a personalized
+    message to each of them using one SMTP session. Messages are rendered
+    one by one and attachments are encoded once.
+
+    email               sender email address;
+    password            email app password;
+    message_template    template file path (txt or html);
+    rows                iterable of (reciever, template_kwargs) pairs;
+    domain              domain of the email service.
+                        If None, will be received from email.
+                        Examples: google, yandex;
+
+    Additional parameters:
+    subject             email subject;
+    attachments         attachment file paths shared by all messages;
+    host                SMTP-server host;
+    port                SMTP-server port.
+
+    return              list[dict] with recievers, sent flag and error
+                        for each row.
+    """
+    with Mailer(
+        email=email, password=password, domain=domain, host=host, port=port
+    ) as mailer:
+        return mailer.send_mail_merge(
+            message_template=message_template,
+            rows=rows,
+            subject=subject,
+            attachments=attachments
+        )
+
+
 def send_email(
     email: str,
     password: str,
@@ -182,7 +636,8 @@ def send_email(
     template_kwargs: dict = None,
     attachments: list[Path] = None,
     host: str = None,
-    port: int = None
+    port: int = None,
+    stream: bool = False
 ):
     """Send email messages. The text of the message can be transmitted
     a string or use a message template. You can attach files to the message.
@@ -201,7 +656,10 @@ def send_email(
     template_kwargs     dictionary with values for template substitution;
     attachments         attachment file paths;
     host                SMTP-server host;
-    port                SMTP-server port.
+    port                SMTP-server port;
+    stream              read and encode attachments from disk by chunks
+                        while sending, memory usage does not depend on
+                        the attachment size. Default: False.
 
     return              None.
     """
@@ -218,48 +676,24 @@ def send_email(
         template_kwargs=template_kwargs,
         attachments=attachments
     )
-
-    if host is None and port is None:
-        # Receiving the server host and port
-        host, port = get_server(domain=params.domain, server='smtp')
+    if not stream:
+        message = build_message(params)
 
     # Set up a connection with the SMTP server
-    # context = ssl.create_default_context()
-    with smtplib.SMTP_SSL(host, port) as server:
-        logger.debug('SMTP session started')
-        server.login(params.email, params.password)
-        logger.debug('Authorization completed')
-
-        # Create message object
-        message_to = ', '.join(params.recievers)
-        message = create_message(
-            sender=params.email, reciever=message_to, subject=params.subject
-        )
-
-        # Process template and add text
-        logger.debug('Rendering message text')
-        if params.message_text:
-            message_text = MIMEText(params.message_text, 'plain')
-            message.attach(message_text)
-        elif params.message_template:
-            message_text = create_message_text(
-                template_path=params.message_template,
-                template_kwargs=params.template_kwargs
-            )
-            message.attach(message_text)
-        logger.debug('Message text attached')
-
-        # Process and add attachments
-        if params.attachments:
-            attachments = get_attachments(params.attachments)
-            for attachment in attachments:
-                message.attach(attachment)
-            logger.debug('All files attached')
-
+    with Mailer(
+        email=params.email,
+        password=params.password,
+        domain=params.domain,
+        host=host,
+        port=port,
+        retries=0
+    ) as mailer:
         # Send message
-        server.send_message(message)
+        if stream:
+            mailer.send_stream(params)
+        else:
+            mailer.send(message)
         logger.info(
-            f'Email message sent from [{params.email}] to [{message_to}]'
+            'Email message sent from [%s] to [%s]',
+            params.email, ', '.join(params.recievers)
         )
-        # End SMTP session and close connection
-        logger.debug('SMTP session ended')
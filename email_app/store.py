@@ -0,0 +1,157 @@
+from contextlib import closing
+import email.message
+import logging
+import os
+from pathlib import Path
+import sqlite3
+import tempfile
+
+from .attachments import AttachmentFile, write_payload
+from .utils import build_filepath
+
+
+class AttachmentStore:
+    """Content-addressed store of received attachments. Each file content
+    is saved once as a blob named by its SHA-256 digest, friendly names in
+    the attachment folders are hard or symbolic links to the blobs. Blobs
+    and names are kept in a small SQLite index, so the store can be used
+    from several processes.
+
+    root    store directory with blobs and index;
+    link    'hard' - hard links (default), 'symlink' - symbolic links.
+            If hard links are not possible, symbolic links are used.
+
+    Example:
+        store = AttachmentStore('path/to/store')
+        mails = read_email(email, password, folder='path/to/folder',
+                           store=store)
+    """
+
+    def __init__(self, root: Path, link: str = 'hard'):
+        if link not in ('hard', 'symlink'):
+            raise ValueError("'link' must be 'hard' or 'symlink'")
+        self.root = os.path.abspath(root)
+        self.link = link
+        self.blobs = os.path.join(self.root, 'blobs')
+        self.index = os.path.join(self.root, 'index.sqlite')
+        os.makedirs(self.blobs, exist_ok=True)
+        with closing(self._connect()) as db, db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS blobs ('
+                'sha256 TEXT PRIMARY KEY, size INTEGER NOT NULL)'
+            )
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS names ('
+                'path TEXT PRIMARY KEY, sha256 TEXT NOT NULL)'
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.index, timeout=30)
+
+    def blob_path(self, sha256: str) -> str:
+        """Get the blob path of the content digest."""
+        return os.path.join(self.blobs, sha256[:2], sha256)
+
+    def lookup(self, sha256: str) -> dict:
+        """Get the blob size and friendly names of the content digest.
+
+        return    dict with size and names keys or None if there is
+                  no such blob.
+        """
+        with closing(self._connect()) as db:
+            row = db.execute(
+                'SELECT size FROM blobs WHERE sha256 = ?', (sha256,)
+            ).fetchone()
+            if row is None:
+                return None
+            names = db.execute(
+                'SELECT path FROM names WHERE sha256 = ? ORDER BY path',
+                (sha256,)
+            ).fetchall()
+        return {'size': row[0], 'names': [name for name, in names]}
+
+    def save(
+        self,
+        message: email.message.Message,
+        folder: Path,
+        filename: str,
+        chunk_size: int = 64 * 1024
+    ) -> AttachmentFile:
+        """Save the attachment into the store and link the friendly name
+        in the folder to the blob. A duplicate costs one hash and no disk
+        space.
+
+        message       email.message.Message object;
+        folder        folder path where the friendly name is linked;
+        filename      file name;
+        chunk_size    number of payload characters decoded at once.
+                      Default: 64 KB;
+
+        return        AttachmentFile object with the friendly path.
+        """
+        logger = logging.getLogger(__name__)
+        fd, tmp_path = tempfile.mkstemp(dir=self.blobs, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                size, sha256 = write_payload(message, f, chunk_size)
+            blob = self.blob_path(sha256)
+            if os.path.exists(blob):
+                logger.debug('Blob %s exists', sha256)
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.replace(tmp_path, blob)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        path = self._link(blob, folder, os.path.basename(filename), sha256)
+        with closing(self._connect()) as db, db:
+            db.execute(
+                'INSERT OR IGNORE INTO blobs (sha256, size) VALUES (?, ?)',
+                (sha256, size)
+            )
+            db.execute(
+                'INSERT OR REPLACE INTO names (path, sha256) VALUES (?, ?)',
+                (path, sha256)
+            )
+        return AttachmentFile(path=path, size=size, sha256=sha256)
+
+    def _link(self, blob: str, folder: Path, filename: str, sha256: str):
+        """Link the friendly name to the blob. If the name is taken by
+        other content, the short digest is added to the name, so naming
+        does not depend on the number of files with the same name.
+
+        return    friendly path.
+        """
+        name, extension = os.path.splitext(filename)
+        candidates = [
+            os.path.join(folder, filename),
+            os.path.join(folder, f'{name} ({sha256[:12]}){extension}')
+        ]
+        for path in candidates:
+            try:
+                self._make_link(blob, path)
+                return os.path.abspath(path)
+            except FileExistsError:
+                try:
+                    if os.path.samefile(path, blob):
+                        return os.path.abspath(path)
+                except OSError:
+                    # Broken symbolic link
+                    pass
+        # Very unlikely: both names are taken by other content
+        path = build_filepath(candidates[-1])
+        self._make_link(blob, path)
+        return os.path.abspath(path)
+
+    def _make_link(self, blob: str, path: str):
+        if self.link == 'hard':
+            try:
+                os.link(blob, path)
+                return
+            except FileExistsError:
+                raise
+            except OSError:
+                # Hard links are not supported or the folder is on
+                # another device
+                pass
+        os.symlink(blob, path)
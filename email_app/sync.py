@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+
+from .read import (
+    fetch_batch, get_response_number, message_set, search_new, store_seen
+)
+from .metrics import IMAPClient
+from .search import SearchIndex
+from .store import AttachmentStore
+from .types import ReadEmailParams
+from .utils import get_server
+
+
+class SyncState:
+    """Local JSON file with the mailbox state of each account: UIDVALIDITY,
+    last read UID, UIDNEXT and HIGHESTMODSEQ (if the server supports
+    CONDSTORE).
+
+    path    state file path. The file is created on the first save.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self._state = json.load(f)
+
+    def get(self, account: str, mailbox: str) -> dict:
+        """Get the mailbox state.
+
+        return    dict with uidvalidity, last_uid, uidnext, highestmodseq
+                  keys or empty dict.
+        """
+        with self._lock:
+            return dict(self._state.get(account, {}).get(mailbox, {}))
+
+    def set(self, account: str, mailbox: str, **state):
+        """Update the mailbox state and save the file."""
+        with self._lock:
+            mailbox_state = self._state.setdefault(account, {}).setdefault(
+                mailbox, {}
+            )
+            mailbox_state.update(state)
+            self._save()
+
+    def reset(self, account: str, mailbox: str = None):
+        """Remove the state of the mailbox or of all account mailboxes,
+        the next sync reads them from the beginning.
+        """
+        with self._lock:
+            if mailbox is None:
+                self._state.pop(account, None)
+            else:
+                self._state.get(account, {}).pop(mailbox, None)
+            self._save()
+
+    def _save(self):
+        # Write to a temporary file first, so the state is never broken
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+
+def sync_email(
+    email: str,
+    password: str,
+    state: SyncState,
+    domain: str = None,
+    mailbox: str = 'INBOX',
+    id_key: str = None,
+    seen: bool = None,
+    with_payload: bool = None,
+    folder: Path = None,
+    host: str = None,
+    port: int = None,
+    batch_size: int = 100,
+    mode: str = 'full',
+    store: AttachmentStore = None,
+    index: SearchIndex = None
+) -> list[dict]:
+    """Read only emails which have arrived since the previous sync. The last
+    read UID of the mailbox is kept in the state file. If UIDVALIDITY of the
+    mailbox has changed, the whole mailbox is read again. If UIDNEXT or
+    HIGHESTMODSEQ (CONDSTORE) has not changed, no search is made.
+
+    email           email address which is read;
+    password        email app password;
+    state           SyncState object;
+    domain          domain of the email service.
+                    If None, will be received from email;
+    mailbox         mailbox section or folder name. Default: INBOX;
+
+    Additional parameters:
+    id_key          email ID key. Example: "Message-ID" - for Yandex;
+    seen            mark the emails as "read" (True) or "unread" (False).
+                    Default: None, flags are not changed;
+    with_payload    add payload for attached files;
+    folder          folder path where attached files are saved;
+    host            IMAP-server host;
+    port            IMAP-server port;
+    batch_size      number of emails fetched with one command. Default: 100;
+    mode            read mode: 'full', 'headers' or 'text'. Default: 'full';
+    store           AttachmentStore object which keeps saved files
+                    without duplicates;
+    index           SearchIndex object which is fed with new emails.
+
+    return          list[dict].
+    """
+    logger = logging.getLogger(__name__)
+
+    # Create folder, if not exist
+    if folder:
+        if not os.path.exists(folder):
+            os.mkdir(folder)
+            logger.debug("Created a folder '%s'", folder)
+
+    # Check parameters
+    params = ReadEmailParams(
+        email=email,
+        password=password,
+        domain=domain,
+        mailbox=mailbox,
+        id_key=id_key,
+        seen=seen,
+        with_payload=with_payload,
+        folder=folder,
+        batch_size=batch_size,
+        mode=mode
+    )
+
+    if host is None and port is None:
+        # Receiving the server host and port
+        host, port = get_server(domain=params.domain, server='imap')
+
+    previous = state.get(params.email, params.mailbox)
+    emails = []
+    with IMAPClient(host, port) as server:
+        logger.debug('IMAP session started')
+        server.login(params.email, params.password)
+        logger.debug('Authorization completed')
+        condstore = 'CONDSTORE' in server.capabilities
+        if condstore and 'ENABLE' in server.capabilities:
+            server.enable('CONDSTORE')
+        server.select(params.mailbox)
+        uidvalidity = get_response_number(server, 'UIDVALIDITY')
+        uidnext = get_response_number(server, 'UIDNEXT')
+        highestmodseq = get_response_number(server, 'HIGHESTMODSEQ')
+        current = {
+            'uidvalidity': uidvalidity,
+            'uidnext': uidnext,
+            'highestmodseq': highestmodseq
+        }
+
+        last_uid = previous.get('last_uid', 0)
+        if previous and previous.get('uidvalidity') != uidvalidity:
+            logger.warning(
+                "UIDVALIDITY of '%s' has changed, reading the whole mailbox",
+                params.mailbox
+            )
+            last_uid = 0
+        elif previous and (
+            (uidnext is not None and previous.get('uidnext') == uidnext)
+            or (
+                highestmodseq is not None
+                and previous.get('highestmodseq') == highestmodseq
+            )
+        ):
+            logger.debug("No new emails in '%s'", params.mailbox)
+            return emails
+
+        uids = search_new(server, last_uid)
+        logger.info("%s new emails in '%s'", len(uids), params.mailbox)
+        mailbox_index = None
+        if index is not None and uidvalidity is not None:
+            mailbox_index = index.mailbox(
+                params.email, params.mailbox, uidvalidity
+            )
+        for start in range(0, len(uids), params.batch_size):
+            batch = uids[start:start + params.batch_size]
+            emails += fetch_batch(
+                server=server,
+                uids=batch,
+                mode=params.mode,
+                id_key=params.id_key,
+                with_payload=params.with_payload,
+                folder=params.folder,
+                store=store,
+                index=mailbox_index
+            )
+            # Save progress after each batch. UIDNEXT and HIGHESTMODSEQ
+            # are saved at the end, so an interrupted sync is continued
+            state.set(
+                params.email,
+                params.mailbox,
+                uidvalidity=uidvalidity,
+                uidnext=None,
+                highestmodseq=None,
+                last_uid=int(batch[-1])
+            )
+        # Flags of all new emails are changed with one command
+        store_seen(server, message_set(uids), params.seen)
+        if uids:
+            last_uid = int(uids[-1])
+        state.set(params.email, params.mailbox, **current, last_uid=last_uid)
+        logger.debug('IMAP session ended')
+    return emails
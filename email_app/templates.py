@@ -0,0 +1,116 @@
+from collections import OrderedDict
+import logging
+import os
+from pathlib import Path
+import string
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from jinja2 import Environment
+
+
+class TemplateCache:
+    """Process-wide LRU cache of compiled message templates. Templates are
+    keyed by path and modification time, so a changed file is compiled
+    again on the next use. HTML templates of one directory share one
+    jinja2.Environment object.
+
+    maxsize    maximum number of cached templates. Default: 128.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._templates = OrderedDict()
+        self._environments = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._templates)
+
+    def environment(self, template_dir: str) -> 'Environment':
+        """Get the shared jinja2.Environment object of the directory.
+        jinja2 is imported on the first call.
+        """
+        from jinja2 import Environment, FileSystemLoader
+
+        with self._lock:
+            env = self._environments.get(template_dir)
+            if env is None:
+                env = Environment(loader=FileSystemLoader(template_dir))
+                self._environments[template_dir] = env
+            return env
+
+    def get(self, filepath: Path, compile):
+        """Get a compiled template from the cache or compile it.
+
+        filepath    template file path;
+        compile     function which compiles the template from filepath;
+
+        return      compiled template.
+        """
+        filepath = os.path.abspath(filepath)
+        key = (filepath, os.stat(filepath).st_mtime_ns)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                self.hits += 1
+                return template
+            self.misses += 1
+        template = compile(filepath)
+        with self._lock:
+            # Old versions of the file are not needed any more
+            for old_key in [k for k in self._templates if k[0] == filepath]:
+                del self._templates[old_key]
+            self._templates[key] = template
+            while len(self._templates) > self.maxsize:
+                self._templates.popitem(last=False)
+        return template
+
+    def invalidate(self, filepath: Path = None):
+        """Remove the template from the cache.
+
+        filepath    template file path. If None, the whole cache is cleared.
+        """
+        logger = logging.getLogger(__name__)
+        with self._lock:
+            if filepath is None:
+                self._templates.clear()
+                self._environments.clear()
+                logger.debug('Template cache cleared')
+                return
+            filepath = os.path.abspath(filepath)
+            for key in [k for k in self._templates if k[0] == filepath]:
+                del self._templates[key]
+            for env in self._environments.values():
+                env.cache.clear()
+            logger.debug('Template (%s) removed from cache', filepath)
+
+
+TEMPLATES = TemplateCache()
+
+
+def compile_txt_template(filepath: str):
+    """Compile txt-template file into string.Template object."""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return string.Template(f.read())
+
+
+def compile_html_template(filepath: str):
+    """Compile html-template file into jinja2.environment.Template object
+    using the shared environment of the template directory.
+    """
+    template_dir, template_name = os.path.split(filepath)
+    env = TEMPLATES.environment(template_dir)
+    return env.get_template(template_name)
+
+
+def invalidate_templates(filepath: Path = None):
+    """Remove the template from the process-wide cache.
+
+    filepath    template file path. If None, the whole cache is cleared.
+    """
+    TEMPLATES.invalidate(filepath)
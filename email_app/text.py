@@ -0,0 +1,71 @@
+from html.parser import HTMLParser
+import re
+
+
+# Elements which content is not text
+SKIPPED_TAGS = {'script', 'style', 'template', 'noscript'}
+# Elements which start a new line
+BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'br', 'caption', 'dd',
+    'div', 'dl', 'dt', 'fieldset', 'figcaption', 'figure', 'footer', 'form',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'main', 'nav',
+    'ol', 'p', 'pre', 'section', 'table', 'td', 'th', 'title', 'tr', 'ul'
+}
+WHITESPACE = re.compile(r'\s+')
+
+
+class HTMLTextParser(HTMLParser):
+    """Collect text of HTML document in one pass over parser events.
+    Content of script and style elements is skipped, character references
+    are decoded, whitespace is collapsed and block elements start new lines.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self.line = []
+        self.skip = 0
+
+    def break_line(self):
+        if self.line:
+            line = WHITESPACE.sub(' ', ''.join(self.line)).strip()
+            if line:
+                self.lines.append(line)
+            self.line = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skip += 1
+        elif tag in BLOCK_TAGS:
+            self.break_line()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self.break_line()
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skip = max(self.skip - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self.break_line()
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.line.append(data)
+
+    def get_text(self) -> str:
+        self.close()
+        self.break_line()
+        return '\n'.join(self.lines)
+
+
+def html_to_text(body: str) -> str:
+    """Get text of HTML document without building a document tree.
+
+    body      HTML document;
+
+    return    str.
+    """
+    parser = HTMLTextParser()
+    parser.feed(body)
+    return parser.get_text()
@@ -1,8 +1,9 @@
 import re
 
-from typing import Optional
+from typing import Literal, Optional
 from pydantic import (
-    BaseModel, Extra, FilePath, DirectoryPath, validator, root_validator
+    BaseModel, Extra, FilePath, DirectoryPath, conint, validator,
+    root_validator
 )
 
 
@@ -77,3 +78,16 @@ class ReadEmailParams(Email):
     seen: Optional[bool] = None
     with_payload: Optional[bool] = None
     folder: Optional[DirectoryPath] = None
+    batch_size: conint(gt=0) = 100
+    mode: Literal['full', 'headers', 'text'] = 'full'
+
+
+class BackfillEmailParams(ReadEmailParams):
+    connections: conint(gt=0) = 4
+    processes: Optional[conint(ge=0)] = None
+
+
+class ReadAccountParams(ReadEmailParams):
+    criteria: str = 'ALL'
+    host: Optional[str] = None
+    port: Optional[int] = None
@@ -1,18 +1,33 @@
+from functools import cache
 import json
 import logging
 import os
 
 
-with open(
-    os.path.join(os.path.dirname(__file__), 'servers.json'), 'r',
-    encoding='utf-8'
-) as f:
-    SERVERS = json.load(f)
+@cache
+def load_servers() -> dict:
+    """Read servers.json on the first call, later calls return the same
+    dictionary.
+
+    return    dict {domain: {'smtp': {...}, 'imap': {...}}}.
+    """
+    with open(
+        os.path.join(os.path.dirname(__file__), 'servers.json'), 'r',
+        encoding='utf-8'
+    ) as f:
+        return json.load(f)
+
+
+def __getattr__(name: str):
+    # SERVERS is loaded on the first access, not on import
+    if name == 'SERVERS':
+        return load_servers()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_server(domain: str, server: str):
     logger = logging.getLogger(__name__)
-    server_dict = SERVERS.get(domain, {}).get(server, {})
+    server_dict = load_servers().get(domain, {}).get(server, {})
     if server_dict:
         logger.debug('Host and port of SMTP server recieved')
         return server_dict['host'], server_dict['port']
@@ -22,6 +37,16 @@ def get_server(domain: str, server: str):
         raise ValueError(message)
 
 
+def get_connection_limit(domain: str, server: str):
+    """Get the maximum number of simultaneous connections of one account
+    allowed by the email service.
+
+    return    int or None if there is no known limit.
+    """
+    servers = load_servers()
+    return servers.get(domain, {}).get(server, {}).get('max_connections')
+
+
 def build_filepath(filepath):
     """Build new filepath if filepath exists."""
     filename, extension = os.path.splitext(filepath)
@@ -0,0 +1,510 @@
+"""Local SMTP and IMAP stand-ins for tests. Each server runs an asyncio
+event loop in a background thread, so it can serve both blocking and asyncio
+clients.
+"""
+import asyncio
+import email
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+import os
+import re
+import ssl
+import threading
+
+
+CERTS = os.path.join(os.path.dirname(__file__), 'certs')
+
+
+def server_context():
+    """Create SSL context with the self-signed localhost certificate."""
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(
+        os.path.join(CERTS, 'localhost.crt'),
+        os.path.join(CERTS, 'localhost.key')
+    )
+    return context
+
+
+def client_context():
+    """Create SSL context which trusts the self-signed localhost
+    certificate.
+    """
+    return ssl.create_default_context(
+        cafile=os.path.join(CERTS, 'localhost.crt')
+    )
+
+
+def make_email(
+    subject: str = 'Subject',
+    text: str = 'Hello!',
+    html: str = None,
+    attachments: dict = None,
+    sender: str = 'sender@local.test',
+    date: str = 'Mon, 02 Jan 2023 10:00:00 +0000'
+) -> bytes:
+    """Build raw email (RFC822) for the mailbox of LocalIMAPServer.
+
+    attachments    dictionary with file names and payloads.
+    """
+    message = MIMEMultipart()
+    message['From'] = sender
+    message['To'] = 'reciever@local.test'
+    message['Subject'] = subject
+    message['Date'] = date
+    message['Message-ID'] = f'<{abs(hash((subject, text)))}@local.test>'
+    message.attach(MIMEText(text, 'plain'))
+    if html:
+        message.attach(MIMEText(html, 'html'))
+    for name, payload in (attachments or {}).items():
+        part = MIMEApplication(payload)
+        part.add_header('Content-Disposition', 'attachment', filename=name)
+        message.attach(part)
+    return message.as_bytes()
+
+
+class CountingReader:
+    """Stream reader which adds the size of read data to the server
+    counter.
+    """
+
+    def __init__(self, reader, server):
+        self.reader = reader
+        self.server = server
+
+    async def readline(self) -> bytes:
+        line = await self.reader.readline()
+        self.server.bytes_received += len(line)
+        return line
+
+    async def readexactly(self, n: int) -> bytes:
+        data = await self.reader.readexactly(n)
+        self.server.bytes_received += len(data)
+        return data
+
+
+class CountingWriter:
+    """Stream writer which adds the size of written data to the server
+    counter.
+    """
+
+    def __init__(self, writer, server):
+        self.writer = writer
+        self.server = server
+
+    def write(self, data: bytes):
+        self.server.bytes_sent += len(data)
+        self.writer.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.writer, name)
+
+
+class LocalServer:
+    """Base class of asyncio servers running in a background thread.
+    Sizes of application data received and sent by the server are kept in
+    bytes_received and bytes_sent attributes.
+
+    Example:
+        with LocalSMTPServer() as server:
+            send_email(..., host=server.host, port=server.port)
+    """
+
+    host = '127.0.0.1'
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.port = None
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+        self.logins = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever)
+        self._thread.daemon = True
+        self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self._thread.start()
+        future = asyncio.run_coroutine_threadsafe(self._start(), self._loop)
+        future.result()
+
+    def stop(self):
+        async def close():
+            self._server.close()
+            await self._server.wait_closed()
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _start(self):
+        self._server = await asyncio.start_server(
+            self._serve, self.host, 0, ssl=server_context()
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await self.handle(
+                CountingReader(reader, self), CountingWriter(writer, self)
+            )
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.active -= 1
+            writer.close()
+
+    async def reply(self, writer, line: str):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        writer.write(line.encode() + b'\r\n')
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        raise NotImplementedError
+
+
+class LocalSMTPServer(LocalServer):
+    """SMTP sink which keeps all received messages.
+
+    latency             delay before each reply, seconds;
+    disconnect_after    close the connection after n messages of a session.
+    """
+
+    def __init__(self, latency: float = 0, disconnect_after: int = None):
+        super().__init__(latency=latency)
+        self.disconnect_after = disconnect_after
+        self.messages = []
+
+    async def handle(self, reader, writer):
+        await self.reply(writer, '220 localhost ESMTP')
+        sent = 0
+        mail_from, rcpt_to = None, []
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                writer.write(b'250-localhost\r\n')
+                writer.write(b'250-8BITMIME\r\n')
+                await self.reply(writer, '250 AUTH PLAIN LOGIN')
+            elif verb == 'AUTH':
+                self.logins += 1
+                await self.reply(writer, '235 Authentication succeeded')
+            elif verb == 'MAIL':
+                if self.disconnect_after and sent >= self.disconnect_after:
+                    return
+                mail_from, rcpt_to = command[10:].strip('<> '), []
+                await self.reply(writer, '250 OK')
+            elif verb == 'RCPT':
+                rcpt_to.append(command[8:].strip('<> '))
+                await self.reply(writer, '250 OK')
+            elif verb == 'DATA':
+                await self.reply(writer, '354 End data with <CR><LF>.<CR><LF>')
+                data = bytearray()
+                while True:
+                    line = await reader.readline()
+                    if line == b'.\r\n':
+                        break
+                    if line.startswith(b'..'):
+                        line = line[1:]
+                    data += line
+                self.messages.append({
+                    'from': mail_from, 'to': rcpt_to, 'data': bytes(data)
+                })
+                sent += 1
+                await self.reply(writer, '250 OK')
+            elif verb == 'QUIT':
+                await self.reply(writer, '221 Bye')
+                return
+            else:
+                await self.reply(writer, '250 OK')
+
+
+def bodystructure(message) -> str:
+    """Build IMAP BODYSTRUCTURE of the message object."""
+    if message.is_multipart():
+        parts = ''.join(bodystructure(part) for part in message.get_payload())
+        return f'({parts} "{message.get_content_subtype()}")'
+    params = ' '.join(
+        f'"{key}" "{value}"' for key, value in message.get_params()[1:]
+    )
+    params = f'({params})' if params else 'NIL'
+    encoding = message.get('Content-Transfer-Encoding', '7bit')
+    body = part_body(message)
+    disposition = message.get_content_disposition()
+    if disposition:
+        filename = message.get_filename()
+        disposition = (
+            f'("{disposition}" ("filename" "{filename}"))' if filename
+            else f'("{disposition}" NIL)'
+        )
+    fields = (
+        f'"{message.get_content_maintype()}" '
+        f'"{message.get_content_subtype()}" {params} NIL NIL '
+        f'"{encoding}" {len(body)}'
+    )
+    if message.get_content_maintype() == 'text':
+        fields += f' {len(body.splitlines())}'
+    return f'({fields} NIL {disposition or "NIL"} NIL NIL)'
+
+
+def part_body(message) -> bytes:
+    """Get transfer-encoded body of the message object."""
+    return message.get_payload().encode('ascii', 'surrogateescape')
+
+
+def get_part(message, section: str):
+    """Get body part of the message object by section number."""
+    for num in section.split('.'):
+        if not message.is_multipart():
+            return message
+        message = message.get_payload()[int(num) - 1]
+    return message
+
+
+def parse_set(message_set: str, last: int) -> set:
+    """Parse IMAP message set like '1,3:5,7:*'."""
+    numbers = set()
+    for item in message_set.split(','):
+        start, _, end = item.partition(':')
+        start = last if start == '*' else int(start)
+        end = start if not end else last if end == '*' else int(end)
+        start, end = min(start, end), max(start, end)
+        numbers.update(range(start, end + 1))
+    return numbers
+
+
+class LocalIMAPServer(LocalServer):
+    """IMAP server with one in-memory mailbox.
+
+    messages    raw emails (RFC822) in the mailbox;
+    latency     delay before each tagged reply, seconds;
+    idle        support IDLE command.
+
+    Server keeps names of all received commands in commands attribute.
+    """
+
+    ITEM = re.compile(r'BODY(\.PEEK)?\[[^\]]*\](<[\d.]+>)?|[A-Z0-9.]+')
+
+    def __init__(
+        self, messages: list[bytes] = (), latency: float = 0,
+        idle: bool = True
+    ):
+        super().__init__(latency=latency)
+        self.idle = idle
+        self.idling = set()
+        self.uidvalidity = 1
+        self.uidnext = 1
+        self.mailbox = []
+        self.commands = []
+        for data in messages:
+            self.append(data)
+
+    def append(self, data: bytes, flags: set = None):
+        """Add a message to the mailbox."""
+        self.mailbox.append({
+            'uid': self.uidnext, 'data': data, 'flags': set(flags or ())
+        })
+        self.uidnext += 1
+        if self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self.notify)
+
+    def notify(self):
+        """Send EXISTS response to idling clients."""
+        for writer in self.idling:
+            writer.write(f'* {len(self.mailbox)} EXISTS\r\n'.encode())
+
+    def select(self, message_set: str, uid: bool):
+        """Get sequence numbers and messages of the message set."""
+        if uid:
+            last = self.mailbox[-1]['uid'] if self.mailbox else 0
+            uids = parse_set(message_set, last)
+            return [
+                (num, message)
+                for num, message in enumerate(self.mailbox, 1)
+                if message['uid'] in uids
+            ]
+        nums = parse_set(message_set, len(self.mailbox))
+        return [
+            (num, message)
+            for num, message in enumerate(self.mailbox, 1)
+            if num in nums
+        ]
+
+    def search(self, criteria: str, uid: bool) -> list[int]:
+        tokens = criteria.upper().split()
+        result = []
+        for num, message in enumerate(self.mailbox, 1):
+            matched = True
+            tokens_iter = iter(tokens)
+            for token in tokens_iter:
+                if token == 'UNSEEN':
+                    matched &= '\\Seen' not in message['flags']
+                elif token == 'SEEN':
+                    matched &= '\\Seen' in message['flags']
+                elif token == 'UID':
+                    last = self.mailbox[-1]['uid'] if self.mailbox else 0
+                    uids = parse_set(next(tokens_iter), last)
+                    matched &= message['uid'] in uids
+                elif token[0].isdigit():
+                    matched &= num in parse_set(token, len(self.mailbox))
+                elif token in ('SINCE', 'BEFORE', 'ON', 'FROM', 'SUBJECT'):
+                    next(tokens_iter)
+            if matched:
+                result.append(message['uid'] if uid else num)
+        return result
+
+    def fetch_item(self, message: dict, item: str):
+        """Build a FETCH response item: (name, inline value or literal)."""
+        if item == 'UID':
+            return f'UID {message["uid"]}', None
+        if item == 'FLAGS':
+            return f'FLAGS ({" ".join(sorted(message["flags"]))})', None
+        if item == 'RFC822.SIZE':
+            return f'RFC822.SIZE {len(message["data"])}', None
+        if item in ('RFC822', 'BODY[]', 'BODY.PEEK[]'):
+            if item != 'BODY.PEEK[]':
+                message['flags'].add('\\Seen')
+            return item.replace('.PEEK', ''), message['data']
+        parsed = email.message_from_bytes(message['data'])
+        if item == 'BODYSTRUCTURE':
+            return f'BODYSTRUCTURE {bodystructure(parsed)}', None
+        if not item.startswith('BODY'):
+            raise ValueError(item)
+        if not item.startswith('BODY.PEEK'):
+            message['flags'].add('\\Seen')
+        name = item.replace('.PEEK', '')
+        section = name[5:-1]
+        if section.startswith('HEADER.FIELDS'):
+            fields = section[section.index('(') + 1:-1].split()
+            return name, b''.join(
+                f'{key}: {value}\r\n'.encode()
+                for key, value in parsed.items()
+                if key.upper() in fields
+            ) + b'\r\n'
+        if section.endswith('.MIME'):
+            part = get_part(parsed, section[:-5])
+            return name, b''.join(
+                f'{key}: {value}\r\n'.encode() for key, value in part.items()
+            ) + b'\r\n'
+        return name, part_body(get_part(parsed, section))
+
+    def fetch(self, num: int, message: dict, items: str, uid: bool):
+        items = [
+            match.group(0)
+            for match in self.ITEM.finditer(items.strip('()').upper())
+        ]
+        if uid and 'UID' not in items:
+            items.insert(0, 'UID')
+        response = f'* {num} FETCH ('.encode()
+        parts = []
+        for item in items:
+            name, literal = self.fetch_item(message, item)
+            if literal is None:
+                parts.append(name.encode())
+            else:
+                parts.append(
+                    name.encode() + f' {{{len(literal)}}}\r\n'.encode()
+                    + literal
+                )
+        return response + b' '.join(parts) + b')\r\n'
+
+    def store(self, message: dict, command: str, flags: str):
+        flags = set(flags.strip('()').split())
+        if command.upper().startswith('+'):
+            message['flags'] |= flags
+        elif command.upper().startswith('-'):
+            message['flags'] -= flags
+        else:
+            message['flags'] = flags
+
+    async def handle(self, reader, writer):
+        writer.write(b'* OK IMAP4rev1 localhost ready\r\n')
+        await writer.drain()
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            tag, _, command = line.decode().rstrip('\r\n').partition(' ')
+            name, _, args = command.partition(' ')
+            name = name.upper()
+            uid = name == 'UID'
+            if uid:
+                name, _, args = args.partition(' ')
+                name = name.upper()
+            self.commands.append(('UID ' if uid else '') + name)
+            if name == 'IDLE' and self.idle:
+                self.idling.add(writer)
+                writer.write(b'+ idling\r\n')
+                try:
+                    await writer.drain()
+                    line = await reader.readline()
+                finally:
+                    self.idling.discard(writer)
+                if not line:
+                    return
+                status = 'OK IDLE terminated'
+            else:
+                status = await self.command(writer, name, args, uid)
+            await self.reply(writer, f'{tag} {status}')
+            if name == 'LOGOUT':
+                return
+
+    async def command(self, writer, name: str, args: str, uid: bool):
+        """Process a command, write untagged responses and return the
+        status of the tagged response.
+        """
+        if name == 'CAPABILITY':
+            writer.write(
+                b'* CAPABILITY IMAP4rev1 AUTH=PLAIN'
+                + (b' IDLE' if self.idle else b'') + b'\r\n'
+            )
+        elif name == 'LOGIN':
+            self.logins += 1
+        elif name in ('SELECT', 'EXAMINE'):
+            writer.write(
+                f'* {len(self.mailbox)} EXISTS\r\n'
+                f'* OK [UIDVALIDITY {self.uidvalidity}]\r\n'
+                f'* OK [UIDNEXT {self.uidnext}]\r\n'.encode()
+            )
+            return 'OK [READ-WRITE] SELECT completed'
+        elif name == 'SEARCH':
+            result = self.search(args, uid)
+            writer.write(
+                ' '.join(['* SEARCH'] + [str(n) for n in result]).encode()
+                + b'\r\n'
+            )
+        elif name in ('FETCH', 'STORE') and not args.split(' ', 1)[0]:
+            # Real servers do not accept an empty message set
+            return 'BAD invalid message set'
+        elif name == 'FETCH':
+            message_set, _, items = args.partition(' ')
+            for num, message in self.select(message_set, uid):
+                writer.write(self.fetch(num, message, items, uid))
+        elif name == 'STORE':
+            message_set, command, flags = args.split(' ', 2)
+            for num, message in self.select(message_set, uid):
+                self.store(message, command, flags)
+                if 'SILENT' not in command.upper():
+                    writer.write(self.fetch(num, message, 'FLAGS', uid))
+        elif name == 'LOGOUT':
+            writer.write(b'* BYE logging out\r\n')
+        elif name not in ('NOOP', 'CLOSE', 'CHECK'):
+            return 'BAD unknown command'
+        return 'OK completed'
@@ -0,0 +1,123 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from email_app.accounts import read_accounts
+from email_app.read import fetch_batch
+
+from .servers import LocalIMAPServer, make_email
+
+
+def account(server, email, **kwargs):
+    return {
+        'email': email,
+        'password': 'password',
+        'host': server.host,
+        'port': server.port,
+        'batch_size': 2,
+        'mode': 'headers'
+    } | kwargs
+
+
+class ReadAccounts(unittest.TestCase):
+    def test_read_accounts(self):
+        big = [make_email(subject=f'Big {i}') for i in range(12)]
+        small = [make_email(subject=f'Small {i}') for i in range(3)]
+        with LocalIMAPServer(big) as first, LocalIMAPServer(small) as second:
+            mails = read_accounts(
+                [
+                    account(first, 'big@one.test'),
+                    account(second, 'small@two.test', seen=True)
+                ],
+                workers=1
+            )
+            self.assertEqual(first.commands.count('UID SEARCH'), 1)
+            self.assertEqual(first.logins, 1)
+            self.assertEqual(second.commands.count('UID STORE'), 1)
+            self.assertEqual(first.commands.count('LOGOUT'), 1)
+            self.assertEqual(second.commands.count('LOGOUT'), 1)
+        subjects = {
+            email: [
+                mail['subject'] for mail in mails if mail['account'] == email
+            ]
+            for email in ('big@one.test', 'small@two.test')
+        }
+        self.assertEqual(
+            subjects['big@one.test'], [f'Big {i}' for i in range(12)]
+        )
+        self.assertEqual(
+            subjects['small@two.test'], [f'Small {i}' for i in range(3)]
+        )
+        self.assertEqual(mails[0]['mailbox'], 'INBOX')
+        # Accounts take turns, so the small mailbox is read before
+        # the end of the big one
+        subjects = [mail['subject'] for mail in mails]
+        self.assertLess(subjects.index('Small 2'), subjects.index('Big 5'))
+
+    def test_nothing_found(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(3)]
+        with LocalIMAPServer(messages) as server:
+            accounts = [account(
+                server, 'reader@one.test', criteria='UNSEEN', seen=True
+            )]
+            self.assertEqual(len(read_accounts(accounts)), 3)
+            # The second poll finds nothing new
+            self.assertEqual(read_accounts(accounts), [])
+            self.assertEqual(server.commands.count('UID FETCH'), 2)
+            self.assertEqual(server.commands.count('UID STORE'), 1)
+
+    def test_provider_limit(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(4)]
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def fetch(*args, **kwargs):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+            return fetch_batch(*args, **kwargs)
+
+        with LocalIMAPServer(messages) as server:
+            accounts = [
+                account(server, f'user{i}@one.test') for i in range(3)
+            ] + [account(server, 'user@two.test')]
+            with mock.patch('email_app.accounts.fetch_batch', fetch):
+                mails = read_accounts(
+                    accounts, workers=4, limits={'one': 1}, provider_limit=2
+                )
+        self.assertEqual(len(mails), 16)
+        self.assertEqual(max(peak), 2)
+
+    def test_zero_limit(self):
+        with LocalIMAPServer([make_email()]) as server:
+            accounts = [account(server, 'user@one.test')]
+            for limits, limit in (({'one': 0}, 4), (None, 0)):
+                with self.subTest(limits=limits, provider_limit=limit):
+                    with self.assertRaises(ValueError):
+                        read_accounts(
+                            accounts, limits=limits, provider_limit=limit
+                        )
+            # No account is admitted, the reading ends with an error
+            with self.assertRaises(RuntimeError):
+                read_accounts(accounts, active=-1)
+            self.assertEqual(server.logins, 0)
+
+    def test_error(self):
+        messages = [make_email(subject='Subject')]
+        with LocalIMAPServer(messages) as server:
+            mails = read_accounts([
+                account(server, 'user@one.test', port=1),
+                account(server, 'user@two.test')
+            ])
+        self.assertEqual(
+            [sorted(mail) for mail in mails],
+            [
+                ['account', 'error', 'mailbox'],
+                ['account', 'date', 'from', 'mailbox', 'subject', 'uid']
+            ]
+        )
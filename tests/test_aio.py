@@ -0,0 +1,178 @@
+import asyncio
+import email
+import smtplib
+import threading
+import unittest
+from unittest import mock
+
+from email_app import aio, read
+from email_app.aio import AsyncSMTP, async_read_email, async_send_email
+
+from .servers import (
+    LocalIMAPServer, LocalSMTPServer, client_context, make_email
+)
+
+
+class AsyncSendEmail(unittest.TestCase):
+    def test_async_send_email(self):
+        async def send(server):
+            await asyncio.gather(*[
+                async_send_email(
+                    email='sender@local.test',
+                    password='password',
+                    recievers=[f'user{i}@local.test'],
+                    subject='Subject',
+                    message_text='.Hello!',
+                    host=server.host,
+                    port=server.port,
+                    context=client_context()
+                )
+                for i in range(5)
+            ])
+
+        with LocalSMTPServer(latency=0.01) as server:
+            asyncio.run(send(server))
+        self.assertEqual(len(server.messages), 5)
+        message = email.message_from_bytes(server.messages[0]['data'])
+        self.assertEqual(message['Subject'], 'Subject')
+        self.assertEqual(
+            message.get_payload()[0].get_payload().strip(), '.Hello!'
+        )
+
+    def test_build_in_executor(self):
+        threads = []
+        original = aio.build_message
+
+        def build_message(params):
+            threads.append(threading.get_ident())
+            return original(params)
+
+        with LocalSMTPServer() as server:
+            with mock.patch.object(aio, 'build_message', build_message):
+                asyncio.run(async_send_email(
+                    email='sender@local.test',
+                    password='password',
+                    recievers=['reciever@local.test'],
+                    message_text='Hello!',
+                    host=server.host,
+                    port=server.port,
+                    context=client_context()
+                ))
+        self.assertEqual(len(server.messages), 1)
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def test_login_sequence_error(self):
+        async def login():
+            client = AsyncSMTP('localhost', 0)
+            reply = mock.AsyncMock(return_value=(503, b'Bad sequence'))
+            with mock.patch.object(client, 'command', reply):
+                await client.login('sender@local.test', 'password')
+
+        with self.assertRaises(smtplib.SMTPAuthenticationError):
+            asyncio.run(login())
+
+
+class AsyncReadEmail(unittest.TestCase):
+    def test_async_read_email(self):
+        messages = [
+            make_email(subject=f'Subject {i}', text=f'Text {i}')
+            for i in range(3)
+        ]
+        with LocalIMAPServer(messages) as server:
+            mails = asyncio.run(
+                async_read_email(
+                    email='reader@local.test',
+                    password='password',
+                    criteria='UNSEEN',
+                    last=2,
+                    seen=True,
+                    host=server.host,
+                    port=server.port,
+                    context=client_context()
+                )
+            )
+        self.assertEqual(
+            [mail['subject'] for mail in mails], ['Subject 1', 'Subject 2']
+        )
+        self.assertEqual(mails[0]['body'], 'Text 1')
+        self.assertEqual(
+            ['\\Seen' in message['flags'] for message in server.mailbox],
+            [False, True, True]
+        )
+        self.assertEqual([mail['uid'] for mail in mails], ['2', '3'])
+
+    def test_parse_in_executor(self):
+        threads = []
+        original = read.parse_emails
+
+        def parse_emails(**kwargs):
+            threads.append(threading.get_ident())
+            return original(**kwargs)
+
+        messages = [make_email(subject=f'Subject {i}') for i in range(3)]
+        with LocalIMAPServer(messages) as server:
+            with mock.patch.object(read, 'parse_emails', parse_emails):
+                mails = asyncio.run(async_read_email(
+                    email='reader@local.test',
+                    password='password',
+                    batch_size=2,
+                    host=server.host,
+                    port=server.port,
+                    context=client_context()
+                ))
+        self.assertEqual(len(mails), 3)
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def test_read_modes(self):
+        messages = [
+            make_email(
+                subject=f'Subject {i}', text=f'Text {i}',
+                attachments={'a.txt': b'data'}
+            )
+            for i in range(3)
+        ]
+        with LocalIMAPServer(messages) as server:
+            for mode in ('headers', 'text'):
+                with self.subTest(mode=mode):
+                    mails = asyncio.run(async_read_email(
+                        email='reader@local.test',
+                        password='password',
+                        batch_size=2,
+                        mode=mode,
+                        host=server.host,
+                        port=server.port,
+                        context=client_context()
+                    ))
+                    self.assertEqual(
+                        [mail['subject'] for mail in mails],
+                        ['Subject 0', 'Subject 1', 'Subject 2']
+                    )
+                    self.assertEqual(
+                        [mail['uid'] for mail in mails], ['1', '2', '3']
+                    )
+                    if mode == 'headers':
+                        self.assertNotIn('body', mails[2])
+                    else:
+                        self.assertEqual(mails[2]['body'], 'Text 2')
+                        self.assertEqual(
+                            mails[2]['attachments'][0]['name'], 'a.txt'
+                        )
+
+    def test_no_search_response(self):
+        class Server(LocalIMAPServer):
+            async def command(self, writer, name, args, uid):
+                if name == 'SEARCH':
+                    return 'OK completed'
+                return await super().command(writer, name, args, uid)
+
+        with Server([make_email(subject='Subject')]) as server:
+            mails = asyncio.run(async_read_email(
+                email='reader@local.test',
+                password='password',
+                seen=True,
+                host=server.host,
+                port=server.port,
+                context=client_context()
+            ))
+        self.assertEqual(mails, [])
@@ -0,0 +1,109 @@
+import email
+from email import encoders
+from email.mime.application import MIMEApplication
+from email.mime.text import MIMEText
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from email_app import attachments
+from email_app.attachments import (
+    AttachmentCache, AttachmentFile, decode_payload, save_attachment
+)
+
+
+FOLDER = os.path.join(os.path.dirname(__file__), 'attachments')
+
+
+class AttachmentCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.pdf = shutil.copy(os.path.join(FOLDER, 'test.pdf'), self.dir.name)
+        self.xlsx = shutil.copy(
+            os.path.join(FOLDER, 'test.xlsx'), self.dir.name
+        )
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_encoded_once(self):
+        cache = AttachmentCache()
+        with mock.patch(
+            'email_app.attachments.encode_attachment',
+            wraps=attachments.encode_attachment
+        ) as encode:
+            parts = [cache.get(self.pdf) for _ in range(5)]
+        self.assertEqual(encode.call_count, 1)
+        self.assertIsNot(parts[0], parts[1])
+        self.assertEqual(parts[0].as_bytes(), parts[4].as_bytes())
+        self.assertEqual(parts[0].get_filename(), 'test.pdf')
+
+    def test_changed_file(self):
+        cache = AttachmentCache()
+        part = cache.get(self.pdf)
+        with open(self.pdf, 'ab') as f:
+            f.write(b'\n')
+        self.assertNotEqual(cache.get(self.pdf).get_payload(),
+                            part.get_payload())
+        self.assertEqual(len(cache), 1)
+
+    def test_max_bytes(self):
+        size = len(attachments.encode_attachment(self.pdf).get_payload())
+        cache = AttachmentCache(max_bytes=size)
+        cache.get(self.pdf)
+        cache.get(self.xlsx)
+        self.assertLessEqual(cache.size, size)
+        cache.invalidate()
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+
+class SaveAttachment(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.data = os.urandom(100000)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def part(self, part):
+        # Parse the part again, as it is in a received email
+        return email.message_from_bytes(part.as_bytes())
+
+    def test_base64(self):
+        part = self.part(MIMEApplication(self.data))
+        self.assertEqual(
+            b''.join(decode_payload(part, chunk_size=1001)), self.data
+        )
+
+    def test_quoted_printable(self):
+        text = ('Строка текста = ' * 20 + '\n') * 50
+        part = MIMEText(text, 'plain', 'utf-8')
+        del part['Content-Transfer-Encoding']
+        part.set_payload(text.encode('utf-8'))
+        encoders.encode_quopri(part)
+        part = self.part(part)
+        self.assertEqual(
+            b''.join(decode_payload(part, chunk_size=100)),
+            part.get_payload(decode=True)
+        )
+
+    def test_save_attachment(self):
+        part = self.part(MIMEApplication(self.data))
+        file = save_attachment(part, self.dir.name, 'scan.pdf', 4096)
+        self.assertEqual(
+            file,
+            AttachmentFile(
+                path=os.path.join(self.dir.name, 'scan.pdf'),
+                size=len(self.data),
+                sha256=hashlib.sha256(self.data).hexdigest()
+            )
+        )
+        self.assertEqual(file.read_bytes(), self.data)
+        # Existing files are not overwritten
+        other = save_attachment(part, self.dir.name, '../scan.pdf')
+        self.assertEqual(
+            other.path, os.path.join(self.dir.name, 'scan (1).pdf')
+        )
@@ -0,0 +1,93 @@
+import unittest
+from unittest import mock
+
+from email_app.backfill import backfill_email
+from email_app.read import read_email
+from email_app.utils import SERVERS
+
+from .servers import LocalIMAPServer, make_email
+
+
+class BackfillEmail(unittest.TestCase):
+    def read(self, server, function, **kwargs):
+        return function(
+            email='reader@local.test',
+            password='password',
+            criteria='ALL',
+            host=server.host,
+            port=server.port,
+            **kwargs
+        )
+
+    def test_backfill_email(self):
+        messages = [
+            make_email(
+                subject=f'Subject {i}',
+                html=f'<p>Text {i}</p>',
+                attachments={f'file{i}.txt': b'content'}
+            )
+            for i in range(25)
+        ]
+        with LocalIMAPServer(messages) as server:
+            expected = self.read(server, read_email, batch_size=4)
+            logins = server.logins
+            for processes in (0, 2):
+                with self.subTest(processes=processes):
+                    mails = self.read(
+                        server, backfill_email,
+                        batch_size=4, connections=3, processes=processes
+                    )
+                    self.assertEqual(mails, expected)
+                    self.assertEqual(server.logins - logins, 3)
+                    logins = server.logins
+
+    def test_modes(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(10)]
+        with LocalIMAPServer(messages) as server:
+            for mode in ('headers', 'text'):
+                with self.subTest(mode=mode):
+                    self.assertEqual(
+                        self.read(
+                            server, backfill_email,
+                            batch_size=3, mode=mode
+                        ),
+                        self.read(server, read_email, mode=mode)
+                    )
+
+    def test_seen(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(10)]
+        with LocalIMAPServer(messages) as server:
+            self.read(
+                server, backfill_email,
+                batch_size=3, connections=2, processes=0
+            )
+            self.assertNotIn('UID STORE', server.commands)
+            self.read(
+                server, backfill_email,
+                seen=True, batch_size=3, connections=2, processes=0
+            )
+            self.assertEqual(server.commands.count('UID STORE'), 1)
+        self.assertTrue(
+            all('\\Seen' in message['flags'] for message in server.mailbox)
+        )
+
+    def test_connection_limit(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(10)]
+        limit = {'local': {'imap': {'max_connections': 2}}}
+        with LocalIMAPServer(messages) as server:
+            with mock.patch.dict(SERVERS, limit):
+                mails = self.read(
+                    server, backfill_email,
+                    batch_size=1, connections=8, processes=0
+                )
+            self.assertEqual(len(mails), 10)
+            self.assertEqual(server.logins, 2)
+
+    def test_empty_mailbox(self):
+        with LocalIMAPServer() as server:
+            self.assertEqual(self.read(server, backfill_email), [])
+            self.assertEqual(server.logins, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+
+from email_app.cache import MessageCache
+from email_app.read import read_email
+
+from .servers import LocalIMAPServer, make_email
+
+
+class MessageCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.dir.name, 'cache')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read(self, server, cache, **kwargs):
+        return read_email(
+            email='reader@local.test',
+            password='password',
+            criteria='ALL',
+            batch_size=3,
+            host=server.host,
+            port=server.port,
+            cache=cache,
+            **kwargs
+        )
+
+    def test_read_email(self):
+        messages = [
+            make_email(subject=f'Subject {i}', text=f'Text {i}')
+            for i in range(5)
+        ]
+        cache = MessageCache(self.root)
+        with LocalIMAPServer(messages) as server:
+            mails = self.read(server, cache)
+            self.assertEqual(mails, self.read(server, None))
+            fetches = server.commands.count('UID FETCH')
+            # Repeat read comes from the cache
+            self.assertEqual(self.read(server, cache), mails)
+            self.assertEqual(server.commands.count('UID FETCH'), fetches)
+            self.assertEqual((cache.hits, cache.misses), (5, 5))
+            # Only the new email is fetched
+            server.append(make_email(subject='New'))
+            mails = self.read(server, cache)
+            self.assertEqual(mails[-1]['subject'], 'New')
+            self.assertEqual(server.commands.count('UID FETCH'), fetches + 1)
+            self.assertEqual((cache.hits, cache.misses), (10, 6))
+            # Cached raw emails are parsed again with other options
+            mails = self.read(server, cache, id_key='Message-ID')
+            self.assertIn('id', mails[0])
+            self.assertEqual(server.commands.count('UID FETCH'), fetches + 1)
+        self.assertEqual(len(cache), 6)
+
+    def test_uidvalidity(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(3)]
+        cache = MessageCache(self.root)
+        with LocalIMAPServer(messages) as server:
+            self.read(server, cache)
+            server.uidvalidity = 2
+            self.read(server, cache)
+        self.assertEqual(cache.misses, 6)
+
+    def test_eviction(self):
+        messages = [
+            make_email(subject=f'Subject {i}', text='x' * 1000)
+            for i in range(10)
+        ]
+        cache = MessageCache(self.root, max_bytes=5000)
+        with LocalIMAPServer(messages) as server:
+            mails = self.read(server, cache)
+        self.assertEqual(len(mails), 10)
+        self.assertLessEqual(cache.size, 5000)
+        self.assertLess(len(cache), 10)
+        self.assertEqual(len(os.listdir(cache.cur)), len(cache))
+        cache.clear('reader@local.test')
+        self.assertEqual((len(cache), cache.size), (0, 0))
+        self.assertEqual(os.listdir(cache.cur), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import imaplib
+import queue
+import time
+import unittest
+from unittest import mock
+
+from email_app import idle
+from email_app.idle import IdleListener
+
+from .servers import LocalIMAPServer, make_email
+
+
+class IdleListenerLocal(unittest.TestCase):
+    def listener(self, server, **kwargs):
+        self.queue = queue.Queue()
+        return IdleListener(
+            email='reader@local.test',
+            password='password',
+            queue=self.queue,
+            host=server.host,
+            port=server.port,
+            **kwargs
+        )
+
+    def test_new_email(self):
+        messages = [make_email(subject='Old')]
+        with LocalIMAPServer(messages) as server:
+            with self.listener(server) as listener:
+                self.assertTrue(listener.idling.wait(5))
+                server.append(make_email(subject='New'))
+                mail = self.queue.get(timeout=5)
+                self.assertEqual(mail['subject'], 'New')
+                self.assertTrue(self.queue.empty())
+            self.assertIn('IDLE', server.commands)
+            self.assertNotIn('UID STORE', server.commands)
+
+    def test_reconnect(self):
+        with LocalIMAPServer() as server:
+            listener = self.listener(server, max_backoff=0.1)
+            with listener:
+                self.assertTrue(listener.idling.wait(5))
+                listener.idling.clear()
+                # Server drops the connection while the client is idling
+                for writer in list(server.idling):
+                    server._loop.call_soon_threadsafe(writer.close)
+                self.assertTrue(listener.idling.wait(5))
+                server.append(make_email(subject='New'))
+                self.assertEqual(self.queue.get(timeout=5)['subject'], 'New')
+            self.assertEqual(server.logins, 2)
+
+    def test_backoff_reset(self):
+        with LocalIMAPServer() as server:
+            listener = self.listener(server)
+            with self.assertLogs('email_app.idle', 'WARNING') as logs:
+                with listener:
+                    for _ in range(2):
+                        self.assertTrue(listener.idling.wait(5))
+                        listener.idling.clear()
+                        for writer in list(server.idling):
+                            server._loop.call_soon_threadsafe(writer.close)
+                    self.assertTrue(listener.idling.wait(5))
+            self.assertEqual(server.logins, 3)
+        # Each loss after a successful reconnect waits the initial delay
+        delays = [
+            record.args[0] for record in logs.records
+            if record.msg.startswith('Reconnecting')
+        ]
+        self.assertEqual(delays, [1, 1])
+
+    def test_callback_error(self):
+        received = []
+
+        def callback(msg):
+            received.append(msg['subject'])
+            if msg['subject'] == 'First':
+                raise ValueError('callback failed')
+
+        with LocalIMAPServer() as server:
+            listener = self.listener(server, callback=callback)
+            with self.assertLogs('email_app.idle', 'ERROR'):
+                with listener:
+                    self.assertTrue(listener.idling.wait(5))
+                    listener.idling.clear()
+                    server.append(make_email(subject='First'))
+                    self.assertEqual(
+                        self.queue.get(timeout=5)['subject'], 'First'
+                    )
+                    # The listener is still running and idling again
+                    self.assertTrue(listener.idling.wait(5))
+                    server.append(make_email(subject='Second'))
+                    self.assertEqual(
+                        self.queue.get(timeout=5)['subject'], 'Second'
+                    )
+            self.assertEqual(received, ['First', 'Second'])
+            self.assertEqual(server.logins, 1)
+
+    def test_bad_email(self):
+        fetch_batch = idle.fetch_batch
+
+        def fetch(**kwargs):
+            # The first email can not be parsed
+            if b'1' in kwargs['uids']:
+                raise LookupError('unknown encoding')
+            return fetch_batch(**kwargs)
+
+        with LocalIMAPServer() as server:
+            listener = self.listener(server)
+            with mock.patch.object(idle, 'fetch_batch', fetch):
+                with self.assertLogs('email_app.idle', 'ERROR'):
+                    with listener:
+                        self.assertTrue(listener.idling.wait(5))
+                        # Both emails are found by one search
+                        with mock.patch.object(server, 'notify'):
+                            server.append(make_email(subject='Bad'))
+                        server.append(make_email(subject='Good'))
+                        mail = self.queue.get(timeout=5)
+                        self.assertEqual(mail['subject'], 'Good')
+                        self.assertEqual(listener.last_uid, 2)
+            self.assertEqual(server.logins, 1)
+
+    def test_unexpected_error(self):
+        search_new = idle.search_new
+        errors = [RuntimeError('unexpected')]
+
+        def search(*args):
+            if errors:
+                raise errors.pop()
+            return search_new(*args)
+
+        with LocalIMAPServer() as server:
+            listener = self.listener(server)
+            with mock.patch.object(idle, 'search_new', search):
+                with self.assertLogs('email_app.idle', 'ERROR') as logs:
+                    with listener:
+                        self.assertTrue(listener.idling.wait(5))
+                        server.append(make_email(subject='New'))
+                        mail = self.queue.get(timeout=5)
+                        self.assertEqual(mail['subject'], 'New')
+            self.assertEqual(server.logins, 2)
+        self.assertIsNotNone(logs.records[0].exc_info)
+
+    def test_backoff_after_login(self):
+        with LocalIMAPServer() as server:
+            listener = self.listener(server)
+            error = imaplib.IMAP4.error('IDLE command error')
+            with mock.patch.object(IdleListener, '_idle', side_effect=error):
+                with self.assertLogs('email_app.idle', 'WARNING') as logs:
+                    with listener:
+                        deadline = time.monotonic() + 5
+                        while time.monotonic() < deadline and len([
+                            record for record in logs.records
+                            if record.msg.startswith('Reconnecting')
+                        ]) < 2:
+                            time.sleep(0.01)
+        # Failures after login without a working IDLE keep growing delays
+        delays = [
+            record.args[0] for record in logs.records
+            if record.msg.startswith('Reconnecting')
+        ]
+        self.assertEqual(delays[:2], [1, 2])
+
+    def test_polling(self):
+        with LocalIMAPServer(idle=False) as server:
+            with self.listener(server, poll_interval=0.1, seen=True):
+                while 'SELECT' not in server.commands:
+                    time.sleep(0.01)
+                server.append(make_email(subject='New'))
+                self.assertEqual(self.queue.get(timeout=5)['subject'], 'New')
+            self.assertNotIn('IDLE', server.commands)
+            self.assertEqual(server.mailbox[0]['flags'], {'\\Seen'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import json
+import subprocess
+import sys
+import unittest
+
+import email_app
+from email_app import utils
+
+
+def imported_modules(statement: str) -> set[str]:
+    """Run the statement in a new interpreter and get imported modules."""
+    process = subprocess.run(
+        [
+            sys.executable, '-c',
+            f'{statement}\nimport json, sys\n'
+            'print(json.dumps(sorted(sys.modules)))'
+        ],
+        capture_output=True, text=True, check=True
+    )
+    return set(json.loads(process.stdout))
+
+
+class LazyImports(unittest.TestCase):
+    def test_package(self):
+        modules = imported_modules('import email_app')
+        for name in ('smtplib', 'imaplib', 'pydantic', 'jinja2', 'bs4',
+                     'email.mime.multipart', 'email_app.send'):
+            with self.subTest(name=name):
+                self.assertNotIn(name, modules)
+
+    def test_send(self):
+        modules = imported_modules('from email_app import send_email')
+        self.assertIn('smtplib', modules)
+        for name in ('imaplib', 'jinja2', 'bs4', 'email_app.read'):
+            with self.subTest(name=name):
+                self.assertNotIn(name, modules)
+
+    def test_read(self):
+        modules = imported_modules('from email_app import read_email')
+        self.assertIn('imaplib', modules)
+        for name in ('smtplib', 'jinja2', 'bs4', 'email_app.send'):
+            with self.subTest(name=name):
+                self.assertNotIn(name, modules)
+
+    def test_exports(self):
+        for name in email_app.__all__:
+            with self.subTest(name=name):
+                self.assertTrue(callable(getattr(email_app, name)))
+        self.assertIn('read_email', dir(email_app))
+        with self.assertRaises(AttributeError):
+            email_app.missing
+
+    def test_servers(self):
+        self.assertIs(utils.SERVERS, utils.load_servers())
+        self.assertEqual(
+            utils.get_server('yandex', 'imap'), ('imap.yandex.ru', 993)
+        )
@@ -0,0 +1,148 @@
+import os
+import tempfile
+import unittest
+
+from email_app import Counters, add_hook, remove_hook
+from email_app.accounts import read_accounts
+from email_app.backfill import backfill_email
+from email_app.pool import MailerPool
+from email_app.read import read_email
+from email_app.send import send_email
+
+from .servers import LocalIMAPServer, LocalSMTPServer, make_email
+
+
+class Metrics(unittest.TestCase):
+    def read(self, server):
+        return read_email(
+            email='reader@local.test',
+            password='password',
+            criteria='ALL',
+            batch_size=2,
+            host=server.host,
+            port=server.port
+        )
+
+    def test_read_stages(self):
+        messages = [
+            make_email(subject=f'Subject {i}', html=f'<p>Text {i}</p>')
+            for i in range(3)
+        ]
+        with LocalIMAPServer(messages) as server:
+            with Counters() as counters:
+                mails = self.read(server)
+        self.assertEqual(len(mails), 3)
+        for stage in (
+            'imap.connect', 'imap.tls', 'imap.login', 'imap.select',
+            'imap.search', 'imap.fetch', 'parse', 'html_to_text'
+        ):
+            with self.subTest(stage=stage):
+                self.assertIn(stage, counters)
+        self.assertEqual(counters['imap.fetch']['count'], 2)
+        self.assertEqual(counters['parse']['count'], 3)
+        self.assertGreater(counters['imap.fetch']['bytes'], 0)
+        self.assertGreaterEqual(
+            counters['imap.fetch']['bytes'], counters['parse']['bytes']
+        )
+
+    def test_send_stages(self):
+        with tempfile.TemporaryDirectory() as folder:
+            template = os.path.join(folder, 'template.txt')
+            with open(template, 'w', encoding='utf-8') as f:
+                f.write('Hello, $name!')
+            with LocalSMTPServer() as server:
+                with Counters() as counters:
+                    send_email(
+                        email='sender@local.test',
+                        password='password',
+                        recievers=['reciever@local.test'],
+                        message_template=template,
+                        template_kwargs={'name': 'Reciever'},
+                        host=server.host,
+                        port=server.port
+                    )
+        for stage in (
+            'smtp.connect', 'smtp.tls', 'smtp.login', 'smtp.data', 'render'
+        ):
+            with self.subTest(stage=stage):
+                self.assertIn(stage, counters)
+        self.assertEqual(counters['render']['bytes'], len('Hello, Reciever!'))
+        self.assertGreater(counters['smtp.data']['bytes'], 0)
+
+    def test_backfill(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(6)]
+        with LocalIMAPServer(messages) as server:
+            for processes in (0, 1):
+                with self.subTest(processes=processes):
+                    with Counters() as counters:
+                        backfill_email(
+                            email='reader@local.test',
+                            password='password',
+                            batch_size=2,
+                            connections=2,
+                            processes=processes,
+                            host=server.host,
+                            port=server.port
+                        )
+                    self.assertEqual(counters['imap.fetch']['count'], 3)
+                    # Emails parsed in worker processes are counted too
+                    self.assertEqual(counters['parse']['count'], 6)
+                    self.assertIn('imap.search', counters)
+
+    def test_read_accounts(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(3)]
+        with LocalIMAPServer(messages) as server:
+            with Counters() as counters:
+                mails = read_accounts([{
+                    'email': 'reader@local.test',
+                    'password': 'password',
+                    'host': server.host,
+                    'port': server.port
+                }])
+        self.assertEqual(len(mails), 3)
+        self.assertEqual(counters['parse']['count'], 3)
+        self.assertIn('imap.login', counters)
+
+    def test_mailer_pool(self):
+        with LocalSMTPServer() as server:
+            with Counters() as counters:
+                with MailerPool(
+                    'sender@local.test', 'password',
+                    host=server.host, port=server.port, connections=2
+                ) as pool:
+                    results = pool.send_emails([
+                        {'recievers': ['reciever@local.test'],
+                         'message_text': 'Hi'}
+                        for _ in range(3)
+                    ])
+        self.assertTrue(all(result['sent'] for result in results))
+        self.assertEqual(counters['smtp.data']['count'], 3)
+
+    def test_global_hook(self):
+        calls = []
+
+        def hook(stage, seconds, size):
+            calls.append(stage)
+
+        def failing(stage, seconds, size):
+            raise ValueError(stage)
+
+        add_hook(hook)
+        add_hook(failing)
+        try:
+            with LocalIMAPServer([make_email(subject='Subject')]) as server:
+                with self.assertLogs('email_app.metrics', 'WARNING'):
+                    mails = self.read(server)
+        finally:
+            remove_hook(hook)
+            remove_hook(failing)
+        self.assertEqual(len(mails), 1)
+        self.assertIn('imap.fetch', calls)
+        calls.clear()
+        with LocalIMAPServer([make_email(subject='Subject')]) as server:
+            self.read(server)
+        self.assertEqual(calls, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
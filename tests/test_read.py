@@ -1,8 +1,20 @@
+import base64
+from concurrent.futures import ProcessPoolExecutor
+import email
+import imaplib
 import os
+import tempfile
 import unittest
 
 from dotenv import load_dotenv
 from email_app import read_email
+from email_app.pool import IMAPPool
+from email_app.read import (
+    decode_text, fetch_attachment, fetch_messages, get_emails,
+    get_part_text, iter_emails, message_set, parse_email
+)
+
+from .servers import LocalIMAPServer, make_email
 
 
 load_dotenv()
@@ -41,3 +53,399 @@ class ReadEmail(unittest.TestCase):
             folder=FOLDER
         )
         print(mails)
+
+
+class ReadEmailLocal(unittest.TestCase):
+    def test_read_email(self):
+        messages = [
+            make_email(
+                subject=f'Subject {i}',
+                text=f'Text {i}',
+                attachments={'test.txt': b'payload'}
+            )
+            for i in range(3)
+        ]
+        with LocalIMAPServer(messages) as server:
+            mails = read_email(
+                email='reader@local.test',
+                password='password',
+                criteria='ALL',
+                seen=False,
+                with_payload=True,
+                host=server.host,
+                port=server.port
+            )
+        self.assertEqual(len(mails), 3)
+        self.assertEqual(mails[2]['subject'], 'Subject 2')
+        self.assertEqual(mails[2]['body'], 'Text 2')
+        self.assertEqual(
+            mails[2]['attachments'],
+            [{'name': 'test.txt', 'payload': b'payload'}]
+        )
+
+    def test_read_email_with_folder(self):
+        messages = [
+            make_email(subject='Scan', attachments={'scan.pdf': b'%PDF scan'})
+        ]
+        with tempfile.TemporaryDirectory() as folder:
+            with LocalIMAPServer(messages) as server:
+                mails = read_email(
+                    email='reader@local.test',
+                    password='password',
+                    criteria='ALL',
+                    folder=folder,
+                    host=server.host,
+                    port=server.port
+                )
+            attachment = mails[0]['attachments'][0]
+            self.assertEqual(
+                attachment['path'], os.path.join(folder, 'scan.pdf')
+            )
+            self.assertNotIn('payload', attachment)
+            self.assertEqual(attachment['file'].size, 9)
+            self.assertEqual(attachment['file'].read_bytes(), b'%PDF scan')
+
+    def test_read_email_batches(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(10)]
+        with LocalIMAPServer(messages) as server:
+            server.mailbox[3]['flags'].add('\\Seen')
+            mails = read_email(
+                email='reader@local.test',
+                password='password',
+                criteria='UNSEEN',
+                seen=True,
+                batch_size=4,
+                host=server.host,
+                port=server.port
+            )
+        self.assertEqual(
+            [mail['subject'] for mail in mails],
+            [f'Subject {i}' for i in range(10) if i != 3]
+        )
+        self.assertEqual(server.commands.count('UID FETCH'), 3)
+        self.assertEqual(server.commands.count('UID STORE'), 1)
+        self.assertNotIn('FETCH', server.commands)
+        self.assertTrue(
+            all('\\Seen' in message['flags'] for message in server.mailbox)
+        )
+
+    def test_read_email_peek(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(5)]
+        with LocalIMAPServer(messages) as server:
+            server.mailbox[1]['flags'].add('\\Seen')
+            mails = read_email(
+                email='reader@local.test',
+                password='password',
+                criteria='ALL',
+                batch_size=2,
+                host=server.host,
+                port=server.port
+            )
+        self.assertEqual(len(mails), 5)
+        self.assertNotIn('UID STORE', server.commands)
+        self.assertEqual(
+            ['\\Seen' in message['flags'] for message in server.mailbox],
+            [False, True, False, False, False]
+        )
+
+    def test_read_email_unseen(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(5)]
+        with LocalIMAPServer(messages) as server:
+            for message in server.mailbox:
+                message['flags'].add('\\Seen')
+            read_email(
+                email='reader@local.test',
+                password='password',
+                criteria='ALL',
+                seen=False,
+                batch_size=2,
+                host=server.host,
+                port=server.port
+            )
+        self.assertEqual(server.commands.count('UID STORE'), 1)
+        self.assertTrue(
+            all(not message['flags'] for message in server.mailbox)
+        )
+
+
+class MessageSet(unittest.TestCase):
+    def test_message_set(self):
+        self.assertEqual(
+            message_set([b'1', b'2', b'3', b'5', b'7', b'8']), '1:3,5,7:8'
+        )
+
+    def test_fetch_messages(self):
+        data = [
+            (b'1 (UID 10 RFC822 {3}', b'abc'), b')',
+            (b'2 (RFC822 {3}', b'def'), b' UID 12)'
+        ]
+        self.assertEqual(
+            fetch_messages(data), {b'10': b'abc', b'12': b'def'}
+        )
+
+    def test_fetch_messages_not_copied(self):
+        raw = b'Subject: Big\r\n\r\n' + b'x' * 100000
+        data = [(b'1 (UID 10 BODY[] {%d}' % len(raw), raw), b')']
+        self.assertIs(fetch_messages(data)[b'10'], data[0][1])
+
+
+class ReadModes(unittest.TestCase):
+    messages = [
+        make_email(
+            subject='Subject',
+            text='Text',
+            html='<p>Html text</p>',
+            attachments={'test.pdf': b'%PDF payload'}
+        ),
+        make_email(subject='Только текст', text='Текст письма')
+    ]
+
+    def read(self, mode):
+        with LocalIMAPServer(self.messages) as server:
+            mails = read_email(
+                email='reader@local.test',
+                password='password',
+                id_key='Message-ID',
+                seen=True,
+                mode=mode,
+                host=server.host,
+                port=server.port
+            )
+        return server, mails
+
+    def test_headers(self):
+        server, mails = self.read('headers')
+        full = [
+            parse_email(data, id_key='Message-ID') for data in self.messages
+        ]
+        self.assertEqual(
+            [{key: mail[key] for key in ('id', 'subject', 'from', 'date')}
+             for mail in full],
+            [{key: mail[key] for key in ('id', 'subject', 'from', 'date')}
+             for mail in mails]
+        )
+        self.assertNotIn('body', mails[0])
+        self.assertEqual(mails[0]['uid'], '1')
+
+    def test_text(self):
+        server, mails = self.read('text')
+        self.assertEqual(mails[0]['body'], 'Html text')
+        self.assertEqual(mails[1]['body'], 'Текст письма')
+        self.assertEqual(mails[1]['subject'], 'Только текст')
+        self.assertEqual(
+            mails[0]['attachments'],
+            [{'name': 'test.pdf', 'part': '3', 'size': 17}]
+        )
+        self.assertNotIn('attachments', mails[1])
+        self.assertEqual(server.commands.count('UID FETCH'), 3)
+
+    def test_uid(self):
+        for mode in ('full', 'headers', 'text'):
+            with self.subTest(mode=mode):
+                server, mails = self.read(mode)
+                self.assertEqual([mail['uid'] for mail in mails], ['1', '2'])
+
+    def test_fetch_attachment(self):
+        with LocalIMAPServer(self.messages) as server:
+            with imaplib.IMAP4_SSL(server.host, server.port) as client:
+                client.login('reader@local.test', 'password')
+                client.select('INBOX')
+                payload = fetch_attachment(client, '1', '3')
+        self.assertEqual(payload, b'%PDF payload')
+        self.assertNotIn('\\Seen', server.mailbox[0]['flags'])
+
+
+class DecodeText(unittest.TestCase):
+    body = base64.b64encode('Текст письма'.encode())
+
+    def part(self, charset):
+        return {'type': 'text/plain', 'charset': charset,
+                'encoding': 'base64'}
+
+    def test_no_charset(self):
+        self.assertEqual(
+            get_part_text(self.part(None), self.body), 'Текст письма'
+        )
+        message = email.message_from_bytes(
+            b'Content-Type: text/plain\r\n'
+            b'Content-Transfer-Encoding: base64\r\n\r\n' + self.body
+        )
+        self.assertEqual(decode_text(message), 'Текст письма')
+
+    def test_unknown_charset(self):
+        self.assertEqual(
+            get_part_text(self.part('x-unknown'), self.body), 'Текст письма'
+        )
+        message = email.message_from_bytes(
+            b'Content-Type: text/plain; charset="x-unknown"\r\n'
+            b'Content-Transfer-Encoding: quoted-printable\r\n\r\n'
+            b'=D0=A2=D0=B5=D0=BA=D1=81=D1=82=FF'
+        )
+        self.assertEqual(decode_text(message), 'Текст\ufffd')
+
+
+class IterEmails(unittest.TestCase):
+    def test_iter_emails(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(5)]
+        with LocalIMAPServer(messages) as server:
+            emails = iter_emails(
+                email='reader@local.test',
+                password='password',
+                seen=True,
+                batch_size=2,
+                host=server.host,
+                port=server.port
+            )
+            self.assertEqual(next(emails)['subject'], 'Subject 0')
+            self.assertEqual(server.commands.count('UID FETCH'), 1)
+            self.assertEqual(next(emails)['subject'], 'Subject 1')
+            self.assertEqual(next(emails)['subject'], 'Subject 2')
+            self.assertEqual(server.commands.count('UID FETCH'), 2)
+            emails.close()
+            self.assertEqual(server.commands[-1], 'LOGOUT')
+            self.assertEqual(server.commands.count('UID STORE'), 1)
+            self.assertEqual(
+                ['\\Seen' in message['flags'] for message in server.mailbox],
+                [True, True, True, False, False]
+            )
+
+    def test_close_unseen(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(10)]
+        with LocalIMAPServer(messages) as server:
+            emails = iter_emails(
+                email='reader@local.test',
+                password='password',
+                criteria='UNSEEN',
+                seen=True,
+                host=server.host,
+                port=server.port
+            )
+            self.assertEqual(next(emails)['subject'], 'Subject 0')
+            emails.close()
+            self.assertEqual(
+                ['\\Seen' in message['flags'] for message in server.mailbox],
+                [True] + [False] * 9
+            )
+            # Emails which were not received are read by the next poll
+            emails = iter_emails(
+                email='reader@local.test',
+                password='password',
+                criteria='UNSEEN',
+                seen=True,
+                host=server.host,
+                port=server.port
+            )
+            self.assertEqual(len(list(emails)), 9)
+
+
+class ReadEmailPooled(unittest.TestCase):
+    messages = [make_email(subject=f'Subject {i}') for i in range(3)]
+
+    def read(self, server, pool, **kwargs):
+        return read_email(
+            email='reader@local.test',
+            password='password',
+            criteria='ALL',
+            host=server.host,
+            port=server.port,
+            pool=pool,
+            **kwargs
+        )
+
+    def test_reuse(self):
+        with LocalIMAPServer(self.messages) as server:
+            with IMAPPool() as pool:
+                first = self.read(server, pool)
+                second = self.read(server, pool, last=1)
+                self.assertEqual(len(pool), 1)
+                with pool.session(
+                    'reader@local.test', 'password', server.host, server.port
+                ) as session:
+                    mails = get_emails(session, seen=None)
+            self.assertEqual(server.commands[-1], 'LOGOUT')
+        self.assertEqual(len(first), 3)
+        self.assertEqual(second, first[-1:])
+        self.assertEqual(mails, first)
+        self.assertEqual((server.connections, server.logins), (1, 1))
+        self.assertEqual(server.commands.count('SELECT'), 1)
+        self.assertEqual(server.commands.count('NOOP'), 2)
+        self.assertEqual((pool.opened, pool.reused), (1, 2))
+
+    def test_broken_session(self):
+        with LocalIMAPServer(self.messages) as server:
+            with IMAPPool() as pool:
+                session = pool.acquire(
+                    'reader@local.test', 'password', server.host, server.port
+                )
+                pool.release(session)
+                # The connection is closed while the session is in the pool
+                session.shutdown()
+                mails = self.read(server, pool)
+        self.assertEqual(len(mails), 3)
+        self.assertEqual(server.logins, 2)
+        self.assertEqual((pool.opened, pool.reused), (2, 0))
+
+    def test_ttl(self):
+        with LocalIMAPServer(self.messages) as server:
+            with IMAPPool(ttl=0) as pool:
+                self.read(server, pool)
+                self.read(server, pool)
+                self.assertEqual(server.commands.count('LOGOUT'), 1)
+        self.assertEqual(server.logins, 2)
+        self.assertNotIn('NOOP', server.commands)
+
+
+class ParserPipeline(unittest.TestCase):
+    def read(self, server, **kwargs):
+        return iter_emails(
+            email='reader@local.test',
+            password='password',
+            criteria='ALL',
+            host=server.host,
+            port=server.port,
+            **{'batch_size': 3} | kwargs
+        )
+
+    def test_parser(self):
+        messages = [
+            make_email(
+                subject=f'Subject {i}',
+                html=f'<p>Text {i}</p>',
+                attachments={f'file{i}.txt': b'content'}
+            )
+            for i in range(10)
+        ]
+        with LocalIMAPServer(messages) as server:
+            with ProcessPoolExecutor(max_workers=2) as parser:
+                self.assertEqual(
+                    list(self.read(server, parser=parser)),
+                    list(self.read(server))
+                )
+
+    def test_close(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(30)]
+        with LocalIMAPServer(messages) as server:
+            with ProcessPoolExecutor(max_workers=1) as parser:
+                emails = self.read(server, parser=parser)
+                self.assertEqual(next(emails)['subject'], 'Subject 0')
+                emails.close()
+            self.assertEqual(server.commands[-1], 'LOGOUT')
+            # Fetching waits while the queue is full: one batch is read,
+            # two are queued and one is waiting
+            self.assertLessEqual(server.commands.count('UID FETCH'), 4)
+
+    def test_close_seen(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(10)]
+        with LocalIMAPServer(messages) as server:
+            with ProcessPoolExecutor(max_workers=1) as parser:
+                emails = self.read(
+                    server, parser=parser, batch_size=1, seen=True
+                )
+                self.assertEqual(next(emails)['subject'], 'Subject 0')
+                emails.close()
+            # Prefetched batches are not marked
+            self.assertEqual(server.commands.count('UID STORE'), 1)
+            self.assertEqual(
+                ['\\Seen' in message['flags'] for message in server.mailbox],
+                [True] + [False] * 9
+            )
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+
+from email_app.read import message_set, read_email
+from email_app.search import SearchIndex, parse_query
+from email_app.sync import SyncState, sync_email
+
+from .servers import LocalIMAPServer, make_email
+
+
+ACCOUNT = 'reader@local.test'
+
+
+class ParseQuery(unittest.TestCase):
+    def test_parse_query(self):
+        self.assertEqual(
+            parse_query('invoice from:acme "big deal" since:2025-01 rep*'),
+            (
+                '"invoice" sender : "acme" "big deal" "rep"*',
+                {'since': '2025-01', 'before': None}
+            )
+        )
+        self.assertEqual(
+            parse_query('before:2024'),
+            (None, {'since': None, 'before': '2024'})
+        )
+        with self.assertRaises(ValueError):
+            parse_query('since:yesterday')
+
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.index = SearchIndex(os.path.join(self.dir.name, 'index.sqlite'))
+        self.messages = [
+            make_email(
+                subject='Invoice 1',
+                sender='Billing <billing@acme.com>',
+                date='Wed, 15 Jan 2025 12:00:00 +0000',
+                attachments={'invoice.pdf': b'%PDF'}
+            ),
+            make_email(
+                subject='Invoice 2',
+                sender='billing@other.com',
+                date='Sat, 15 Feb 2025 12:00:00 +0000'
+            ),
+            make_email(
+                subject='Hello',
+                text='Your invoice is attached',
+                sender='Billing <billing@acme.com>',
+                date='Sun, 15 Dec 2024 12:00:00 +0000'
+            ),
+            make_email(subject='News', sender='news@acme.com')
+        ]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read(self, server, **kwargs):
+        return read_email(
+            email=ACCOUNT,
+            password='password',
+            host=server.host,
+            port=server.port,
+            **kwargs
+        )
+
+    def test_read_email(self):
+        with LocalIMAPServer(self.messages) as server:
+            self.read(server, criteria='ALL', index=self.index)
+            self.assertEqual(len(self.index), 4)
+            self.assertEqual(self.index.uids('invoice', ACCOUNT), [1, 2, 3])
+            uids = self.index.uids('invoice from:acme since:2025-01', ACCOUNT)
+            self.assertEqual(uids, [1])
+            self.assertEqual(
+                self.index.uids('from:billing before:2025', ACCOUNT), [3]
+            )
+            self.assertEqual(
+                self.index.uids('attachment:invoice.pdf', ACCOUNT), [1]
+            )
+            found = self.index.search('news')
+            self.assertEqual(
+                [(msg['uid'], msg['subject']) for msg in found],
+                [(4, 'News')]
+            )
+            # Only the found emails are fetched
+            mails = self.read(server, criteria='UID ' + message_set(uids))
+            self.assertEqual(
+                [mail['subject'] for mail in mails], ['Invoice 1']
+            )
+            # Emails read again are replaced in the index
+            self.read(server, criteria='ALL', mode='text', index=self.index)
+            self.assertEqual(len(self.index), 4)
+        self.index.clear(ACCOUNT)
+        self.assertEqual(len(self.index), 0)
+
+    def test_sync_email(self):
+        state = SyncState(os.path.join(self.dir.name, 'state.json'))
+        with LocalIMAPServer(self.messages[:2]) as server:
+            sync_email(
+                email=ACCOUNT,
+                password='password',
+                state=state,
+                host=server.host,
+                port=server.port,
+                index=self.index
+            )
+            server.append(self.messages[2])
+            sync_email(
+                email=ACCOUNT,
+                password='password',
+                state=state,
+                host=server.host,
+                port=server.port,
+                index=self.index
+            )
+        self.assertEqual(self.index.uids('invoice', ACCOUNT), [1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,16 @@
+import email
 import os
+import tempfile
 import unittest
+from unittest import mock
 
 from dotenv import load_dotenv
-from email_app.send import send_email
+from email_app.pool import MailerPool, send_emails_pooled
+from email_app.send import (
+    Mailer, get_attachments, send_email, send_emails, send_mail_merge
+)
+
+from .servers import LocalSMTPServer
 
 
 load_dotenv()
@@ -39,3 +47,174 @@ class SendEmail(unittest.TestCase):
                 os.path.join(FOLDER, 'test.pdf')
             ]
         )
+
+
+class SendEmails(unittest.TestCase):
+    def test_send_emails_one_session(self):
+        with LocalSMTPServer() as server:
+            results = send_emails(
+                email='sender@local.test',
+                password='password',
+                messages=[
+                    {
+                        'recievers': [f'user{i}@local.test'],
+                        'message_text': 'Hi'
+                    }
+                    for i in range(5)
+                ],
+                host=server.host,
+                port=server.port
+            )
+        self.assertTrue(all(result['sent'] for result in results))
+        self.assertEqual(len(server.messages), 5)
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(server.logins, 1)
+
+    def test_send_emails_reconnect(self):
+        with LocalSMTPServer(disconnect_after=2) as server:
+            results = send_emails(
+                email='sender@local.test',
+                password='password',
+                messages=[
+                    {
+                        'recievers': [f'user{i}@local.test'],
+                        'message_text': 'Hi'
+                    }
+                    for i in range(5)
+                ],
+                host=server.host,
+                port=server.port
+            )
+        self.assertTrue(all(result['sent'] for result in results))
+        self.assertEqual(len(server.messages), 5)
+        self.assertEqual(server.connections, 3)
+
+    def test_send_emails_errors(self):
+        with LocalSMTPServer() as server:
+            with Mailer(
+                email='sender@local.test',
+                password='password',
+                host=server.host,
+                port=server.port
+            ) as mailer:
+                results = mailer.send_emails([
+                    {'recievers': ['invalid'], 'message_text': 'Hi'},
+                    {'recievers': ['user@local.test'], 'message_text': 'Hi'}
+                ])
+        self.assertFalse(results[0]['sent'])
+        self.assertIsInstance(results[0]['error'], ValueError)
+        self.assertTrue(results[1]['sent'])
+        self.assertEqual(len(server.messages), 1)
+
+
+class SendEmailsPooled(unittest.TestCase):
+    messages = [
+        {'recievers': [f'user{i}@local.test'], 'message_text': 'Hi'}
+        for i in range(12)
+    ]
+
+    def test_pool_connections(self):
+        with LocalSMTPServer(latency=0.01) as server:
+            with MailerPool(
+                email='sender@local.test',
+                password='password',
+                host=server.host,
+                port=server.port,
+                connections=3
+            ) as pool:
+                results = pool.send_emails(self.messages)
+        self.assertEqual(
+            [result['recievers'] for result in results],
+            [message['recievers'] for message in self.messages]
+        )
+        self.assertTrue(all(result['sent'] for result in results))
+        self.assertEqual(len(server.messages), 12)
+        self.assertLessEqual(server.connections, 3)
+
+    def test_pool_connection_messages(self):
+        with LocalSMTPServer() as server:
+            results = send_emails_pooled(
+                email='sender@local.test',
+                password='password',
+                messages=self.messages,
+                host=server.host,
+                port=server.port,
+                connections=2,
+                connection_messages=3
+            )
+        self.assertTrue(all(result['sent'] for result in results))
+        self.assertGreaterEqual(server.connections, 4)
+
+
+class SendMailMerge(unittest.TestCase):
+    def test_send_mail_merge(self):
+        template = os.path.join(FOLDER, 'template.txt')
+        with open(template, 'w', encoding='utf-8') as f:
+            f.write('Hello, $name!')
+        self.addCleanup(os.remove, template)
+        rows = [
+            ('user1@local.test', {'name': 'Alice'}),
+            ('invalid', {'name': 'Bob'}),
+            ('user2@local.test', {}),
+            ('user3@local.test', {'name': 'Carol'})
+        ]
+        with LocalSMTPServer() as server:
+            with mock.patch(
+                'email_app.send.get_attachments', wraps=get_attachments
+            ) as attachments:
+                results = send_mail_merge(
+                    email='sender@local.test',
+                    password='password',
+                    message_template=template,
+                    rows=iter(rows),
+                    subject='Subject',
+                    attachments=[os.path.join(FOLDER, 'test.pdf')],
+                    host=server.host,
+                    port=server.port
+                )
+        self.assertEqual(attachments.call_count, 1)
+        self.assertEqual(
+            [result['sent'] for result in results], [True, False, False, True]
+        )
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(
+            [message['to'] for message in server.messages],
+            [['user1@local.test'], ['user3@local.test']]
+        )
+        message = email.message_from_bytes(server.messages[1]['data'])
+        self.assertEqual(
+            message.get_payload()[0].get_payload(), 'Hello, Carol!'
+        )
+        self.assertEqual(message.get_payload()[1].get_filename(), 'test.pdf')
+
+
+class SendEmailStream(unittest.TestCase):
+    def test_send_email_stream(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filepath = os.path.join(folder, 'archive.bin')
+            payload = os.urandom(1024 * 1024 + 7)
+            with open(filepath, 'wb') as f:
+                f.write(payload)
+            with LocalSMTPServer() as server:
+                send_email(
+                    email='sender@local.test',
+                    password='password',
+                    recievers=['user@local.test'],
+                    subject='Subject',
+                    message_text='.Hello!\n.',
+                    attachments=[
+                        filepath, os.path.join(FOLDER, 'test.pdf')
+                    ],
+                    host=server.host,
+                    port=server.port,
+                    stream=True
+                )
+        message = email.message_from_bytes(server.messages[0]['data'])
+        self.assertEqual(message['Subject'], 'Subject')
+        text, archive, pdf = message.get_payload()
+        self.assertEqual(text.get_payload().splitlines(), ['.Hello!', '.'])
+        self.assertEqual(archive.get_filename(), 'archive.bin')
+        self.assertEqual(archive.get_payload(decode=True), payload)
+        with open(os.path.join(FOLDER, 'test.pdf'), 'rb') as f:
+            self.assertEqual(pdf.get_payload(decode=True), f.read())
+        self.assertEqual(pdf.get_content_type(), 'application/pdf')
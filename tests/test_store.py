@@ -0,0 +1,100 @@
+from concurrent.futures import ProcessPoolExecutor
+import email
+from email.mime.application import MIMEApplication
+import hashlib
+import os
+import tempfile
+import unittest
+
+from email_app.read import read_email
+from email_app.store import AttachmentStore
+
+from .servers import LocalIMAPServer, make_email
+
+
+def part(data: bytes):
+    return email.message_from_bytes(MIMEApplication(data).as_bytes())
+
+
+class AttachmentStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.dir.name, 'store')
+        self.folder = os.path.join(self.dir.name, 'files')
+        os.mkdir(self.folder)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_duplicates(self):
+        store = AttachmentStore(self.root)
+        files = [
+            store.save(part(b'invoice'), self.folder, 'report.pdf')
+            for _ in range(3)
+        ]
+        self.assertEqual(files[0], files[2])
+        self.assertEqual(
+            files[0].path, os.path.join(self.folder, 'report.pdf')
+        )
+        self.assertEqual(os.listdir(self.folder), ['report.pdf'])
+        sha256 = hashlib.sha256(b'invoice').hexdigest()
+        self.assertTrue(
+            os.path.samefile(files[0].path, store.blob_path(sha256))
+        )
+        self.assertEqual(
+            store.lookup(sha256), {'size': 7, 'names': [files[0].path]}
+        )
+        self.assertIsNone(store.lookup('0' * 64))
+
+    def test_same_name(self):
+        store = AttachmentStore(self.root)
+        first = store.save(part(b'first'), self.folder, 'report.pdf')
+        second = store.save(part(b'second'), self.folder, 'report.pdf')
+        self.assertEqual(
+            second.path,
+            os.path.join(
+                self.folder, f'report ({second.sha256[:12]}).pdf'
+            )
+        )
+        self.assertEqual(first.read_bytes(), b'first')
+        self.assertEqual(second.read_bytes(), b'second')
+        # The same content is linked to the same name again
+        self.assertEqual(
+            store.save(part(b'second'), self.folder, 'report.pdf'), second
+        )
+
+    def test_symlink(self):
+        store = AttachmentStore(self.root, link='symlink')
+        file = store.save(part(b'scan'), self.folder, 'scan.png')
+        self.assertTrue(os.path.islink(file.path))
+        self.assertEqual(file.read_bytes(), b'scan')
+
+    def test_read_email(self):
+        messages = [
+            make_email(
+                subject=f'Report {i}',
+                attachments={'report.pdf': b'%PDF daily report'}
+            )
+            for i in range(6)
+        ]
+        store = AttachmentStore(self.root)
+        with LocalIMAPServer(messages) as server:
+            with ProcessPoolExecutor(max_workers=2) as parser:
+                mails = read_email(
+                    email='reader@local.test',
+                    password='password',
+                    criteria='ALL',
+                    folder=self.folder,
+                    batch_size=2,
+                    host=server.host,
+                    port=server.port,
+                    parser=parser,
+                    store=store
+                )
+        paths = {mail['attachments'][0]['path'] for mail in mails}
+        self.assertEqual(paths, {os.path.join(self.folder, 'report.pdf')})
+        self.assertEqual(os.listdir(self.folder), ['report.pdf'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+
+from email_app.sync import SyncState, sync_email
+
+from .servers import LocalIMAPServer, make_email
+
+
+class SyncEmail(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'state.json')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def sync(self, server):
+        return sync_email(
+            email='reader@local.test',
+            password='password',
+            state=SyncState(self.path),
+            host=server.host,
+            port=server.port,
+            batch_size=2
+        )
+
+    def test_sync_email(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(3)]
+        with LocalIMAPServer(messages) as server:
+            mails = self.sync(server)
+            self.assertEqual(len(mails), 3)
+            self.assertEqual(
+                SyncState(self.path).get('reader@local.test', 'INBOX'),
+                {
+                    'uidvalidity': 1,
+                    'uidnext': 4,
+                    'highestmodseq': None,
+                    'last_uid': 3
+                }
+            )
+            # No new emails, no search
+            self.assertEqual(self.sync(server), [])
+            self.assertEqual(server.commands.count('UID SEARCH'), 1)
+            server.append(make_email(subject='New'))
+            mails = self.sync(server)
+            self.assertEqual([mail['subject'] for mail in mails], ['New'])
+            self.assertNotIn('UID STORE', server.commands)
+            self.assertFalse(
+                any(message['flags'] for message in server.mailbox)
+            )
+
+    def test_uidvalidity_changed(self):
+        messages = [make_email(subject=f'Subject {i}') for i in range(3)]
+        with LocalIMAPServer(messages) as server:
+            self.sync(server)
+            server.uidvalidity = 2
+            server.append(make_email(subject='New'))
+            self.assertEqual(len(self.sync(server)), 4)
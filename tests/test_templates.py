@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+
+from email_app.send import (
+    create_message_text, read_html_template, read_txt_template
+)
+from email_app.templates import TemplateCache, invalidate_templates
+
+
+class TemplateCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.html = os.path.join(self.dir.name, 'template.html')
+        self.txt = os.path.join(self.dir.name, 'template.txt')
+        with open(self.html, 'w', encoding='utf-8') as f:
+            f.write('<p>Hello, {{ data.name }}!</p>')
+        with open(self.txt, 'w', encoding='utf-8') as f:
+            f.write('Hello, $name!')
+        invalidate_templates()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_compiled_once(self):
+        self.assertIs(read_html_template(self.html),
+                      read_html_template(self.html))
+        self.assertIs(read_txt_template(self.txt),
+                      read_txt_template(self.txt))
+
+    def test_changed_file(self):
+        template = read_txt_template(self.txt)
+        with open(self.txt, 'w', encoding='utf-8') as f:
+            f.write('Bye, $name!')
+        stat = os.stat(self.txt)
+        os.utime(self.txt, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertIsNot(read_txt_template(self.txt), template)
+        text = create_message_text(self.txt, {'name': 'Bob'})
+        self.assertEqual(text.get_payload(), 'Bye, Bob!')
+
+    def test_invalidate(self):
+        template = read_html_template(self.html)
+        invalidate_templates(self.html)
+        self.assertIsNot(read_html_template(self.html), template)
+        text = create_message_text(self.html, {'name': 'Bob'})
+        self.assertEqual(text.get_payload(), '<p>Hello, Bob!</p>')
+
+    def test_maxsize(self):
+        cache = TemplateCache(maxsize=1)
+        cache.get(self.html, lambda path: 'html')
+        cache.get(self.txt, lambda path: 'txt')
+        cache.get(self.txt, lambda path: 'txt')
+        self.assertEqual(len(cache), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
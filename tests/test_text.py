@@ -0,0 +1,42 @@
+import unittest
+from unittest import mock
+
+from email_app import read
+from email_app.read import get_html_text
+from email_app.text import html_to_text
+
+
+class HTMLToText(unittest.TestCase):
+    def test_html_to_text(self):
+        body = (
+            '<html><head><title>Title</title>'
+            '<style>p {color: red}</style></head>'
+            '<body><p>Hello,&nbsp;<b>dear</b>\n    friend &amp; co</p>'
+            '<script>var s = "<p>no</p>";</script>'
+            'Line<br/>break'
+            '<ul><li>One</li><li>Two</li></ul>'
+            '<!-- comment --></body></html>'
+        )
+        self.assertEqual(
+            html_to_text(body),
+            'Title\nHello, dear friend & co\nLine\nbreak\nOne\nTwo'
+        )
+
+    def test_unclosed_tags(self):
+        self.assertEqual(html_to_text('<p>One<p>Two <b>bold'), 'One\nTwo bold')
+
+    def test_bs4_engine(self):
+        self.assertEqual(
+            get_html_text('<p>Some&nbsp;text</p>', engine='bs4'),
+            'Some text'
+        )
+
+    def test_fallback(self):
+        with mock.patch.object(read, 'html_to_text', side_effect=ValueError):
+            self.assertEqual(get_html_text('<p>Text</p>'), 'Text')
+        with mock.patch.object(read, 'load_beautiful_soup', return_value=None):
+            self.assertEqual(get_html_text('<p>Text</p>', engine='bs4'), '')
+
+
+if __name__ == '__main__':
+    unittest.main()